@@ -1,4 +1,3 @@
-import locale
 import os
 import sys
 import time
@@ -72,22 +71,11 @@ def blosxom_handler(request):
         mtime = entry_list[0].get("mtime", time.time())
     else:
         mtime = time.time()
-    mtime_tuple = time.localtime(mtime)
-    mtime_gmtuple = time.gmtime(mtime)
+    fields = tools.get_time_fields(time.localtime(mtime))
 
-    data["latest_date"] = time.strftime('%a, %d %b %Y', mtime_tuple)
-
-    # Make sure we get proper 'English' dates when using standards
-    loc = locale.getlocale(locale.LC_ALL)
-    locale.setlocale(locale.LC_ALL, 'C')
-
-    data["latest_w3cdate"] = time.strftime('%Y-%m-%dT%H:%M:%SZ',
-                                           mtime_gmtuple)
-    data['latest_rfc822date'] = time.strftime('%a, %d %b %Y %H:%M GMT',
-                                              mtime_gmtuple)
-
-    # set the locale back
-    locale.setlocale(locale.LC_ALL, loc)
+    data["latest_date"] = fields["date"]
+    data["latest_w3cdate"] = fields["w3cdate"]
+    data["latest_rfc822date"] = fields["rfc822date"]
 
     # we pass the request with the entry_list through the prepare
     # callback giving everyone a chance to transform the data.  the
@@ -21,5 +21,10 @@ There are several cache mechanisms.  Read the documentation for each
 to understand how they work and how to set them up.  Additional caching
 mechanisms can be dropped in this directory and used by setting the
 "cacheDriver" item in the config dict.
+
+The ``store`` module isn't a cache driver.  It has the size-bounded
+stores that rendered output caches (like the ``pagecache`` plugin)
+keep things in.  The ``preformat`` module caches the HTML
+preformatters like reST and Markdown convert entries to.
 """
 pass
@@ -0,0 +1,105 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2003-2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+"""
+Caches the output of preformatters (reST, Markdown, ...).
+
+Converting markup to HTML is the slowest part of reading most
+entries.  The converted HTML only depends on the source text and the
+parser settings, so it's cached under a key made of the parser id,
+the parser settings, and a hash of the source text.  Since the key is
+content-addressed, cached HTML never goes stale--an edited entry just
+gets a new key and the old one is evicted eventually.
+
+This is enabled by setting ``preformatcache_backend`` in
+``config.py``.  With the ``"disk"`` backend, HTML is shared between
+processes and kept across restarts and static rendering runs.
+
+Preformatters use it like this::
+
+    from Pyblosxom.cache.preformat import cached_preformat
+
+    def parse(story, request):
+        config = request.get_configuration()
+        settings = {"some_option": config.get("some_option", 1)}
+        return cached_preformat(config, PREFORMATTER_ID, settings, story,
+                                lambda: _parse(story, settings))
+"""
+
+import os
+
+from Pyblosxom.cache.store import get_store
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+
+def get_preformat_cache(cfg):
+    """
+    Returns the store preformatted HTML is cached in or None if the
+    preformat cache isn't enabled.
+
+    :param cfg: the config.py dict
+    """
+    backend = cfg.get("preformatcache_backend", None)
+    if not backend:
+        return None
+
+    path = None
+    if backend == "disk":
+        path = cfg.get("preformatcache_dir",
+                       os.path.join(cfg["datadir"], os.pardir,
+                                    "preformatcache"))
+    return get_store("preformatcache", backend, path,
+                     cfg.get("preformatcache_max_entries", 2000))
+
+
+def get_preformat_key(parser_id, settings, story):
+    """
+    Returns the cache key for story converted by parser_id with
+    settings.
+
+    :param parser_id: the preformatter id, e.g. ``"reST"``
+    :param settings: dict of everything else the output depends on
+                     (options, parser version, ...)
+    :param story: the source text
+    """
+    if isinstance(story, unicode):
+        story = story.encode("utf-8")
+    items = settings.items()
+    items.sort()
+    return "%s\n%r\n%s" % (parser_id, items, sha1(story).hexdigest())
+
+
+def cached_preformat(cfg, parser_id, settings, story, parse):
+    """
+    Returns the preformatted story from the cache or calls parse to
+    convert it and caches the result.
+
+    :param cfg: the config.py dict
+    :param parser_id: the preformatter id, e.g. ``"reST"``
+    :param settings: dict of everything else the output depends on
+    :param story: the source text
+    :param parse: function that takes no arguments and returns the
+                  converted story
+
+    :returns: the converted story
+    """
+    store = get_preformat_cache(cfg)
+    if store is None:
+        return parse()
+
+    key = get_preformat_key(parser_id, settings, story)
+    body = store.get(key)
+    if body is None:
+        body = parse()
+        store.set(key, body)
+    return body
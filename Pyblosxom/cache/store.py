@@ -0,0 +1,293 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2003-2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+"""
+Size-bounded key/value stores for caching rendered output.
+
+Unlike the cache drivers in this package which cache parsed entry
+data and check freshness against the entry file, these stores hold
+arbitrary picklable values under string keys.  Callers are
+responsible for putting whatever they need to check freshness in the
+key or the value.
+
+There are two stores:
+
+* ``MemoryStore`` - keeps values in memory for the life of the
+  process.  This works well for long-running processes (WSGI,
+  FastCGI, static rendering).
+
+* ``DiskStore`` - keeps values as pickle files in a directory.  This
+  works for CGI and is shared between processes.
+
+Both are bounded by the number of entries they hold and evict the
+least recently used entries first.
+
+Use ``get_store`` to get a store.  Stores are shared for the life of
+the process, so every request for the same store name gets the same
+store instance.
+"""
+
+import os
+import threading
+import cPickle as pickle
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+DEFAULT_MAX_ENTRIES = 500
+
+# this holds the stores for this process keyed by (name, kind, path)
+_stores = {}
+
+_stores_lock = threading.Lock()
+
+
+class MemoryStore(object):
+    """
+    Stores values in a dict in memory.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param max_entries: the maximum number of values to hold
+        """
+        self.max_entries = max_entries
+        self._data = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key or default if there is no value.
+        """
+        self._lock.acquire()
+        try:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._tick += 1
+            item[0] = self._tick
+            return item[1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        """
+        Stores value under key evicting the least recently used
+        values if the store is full.
+        """
+        self._lock.acquire()
+        try:
+            self._tick += 1
+            self._data[key] = [self._tick, value]
+            if self.max_entries and len(self._data) > self.max_entries:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """
+        Removes the value for key if there is one.
+        """
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Removes all values.
+        """
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        # evict down to 90% so we're not doing this on every set once
+        # the store fills up
+        keep = self.max_entries - max(1, self.max_entries / 10)
+        items = [(item[0], key) for key, item in self._data.items()]
+        items.sort()
+        for tick, key in items[:len(items) - keep]:
+            del self._data[key]
+
+
+class DiskStore(object):
+    """
+    Stores values as pickle files in a directory.  The filename is
+    the md5 hexdigest of the key.
+
+    Files are written to a temporary file and then moved into place,
+    so concurrent readers never see partial values.  The file mtime
+    is used as the last-used time for eviction.
+    """
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param path: the directory to store values in.  It's created
+                     if it doesn't exist.
+        :param max_entries: the maximum number of values to hold
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._count = None
+        self._lock = threading.Lock()
+
+    def _filename(self, key):
+        return os.path.join(self.path, md5(key).hexdigest() + ".cache")
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key or default if there is no value.
+        """
+        filename = self._filename(key)
+        try:
+            fp = open(filename, "rb")
+            try:
+                stored_key, value = pickle.load(fp)
+            finally:
+                fp.close()
+        except (IOError, OSError, EOFError, ValueError,
+                pickle.UnpicklingError):
+            return default
+
+        if stored_key != key:
+            return default
+
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """
+        Stores value under key evicting the least recently used
+        values if the store is full.
+        """
+        filename = self._filename(key)
+        tmp = "%s.%d.%d.new" % (filename, os.getpid(),
+                                threading.currentThread().ident or 0)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            existed = os.path.exists(filename)
+            fp = open(tmp, "wb")
+            try:
+                pickle.dump((key, value), fp, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fp.close()
+            os.rename(tmp, filename)
+        except (IOError, OSError):
+            return
+
+        self._lock.acquire()
+        try:
+            if self._count is None:
+                self._count = len(self._listing())
+            elif not existed:
+                self._count += 1
+
+            if self.max_entries and self._count > self.max_entries:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """
+        Removes the value for key if there is one.
+        """
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+        self._count = None
+
+    def clear(self):
+        """
+        Removes all values.
+        """
+        for mem in self._listing():
+            try:
+                os.remove(mem)
+            except OSError:
+                pass
+        self._count = None
+
+    def __len__(self):
+        return len(self._listing())
+
+    def _listing(self):
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        return [os.path.join(self.path, mem) for mem in names
+                if mem.endswith(".cache")]
+
+    def _evict(self):
+        keep = self.max_entries - max(1, self.max_entries / 10)
+        items = []
+        for mem in self._listing():
+            try:
+                items.append((os.stat(mem).st_mtime, mem))
+            except OSError:
+                pass
+        items.sort()
+        for mtime, mem in items[:len(items) - keep]:
+            try:
+                os.remove(mem)
+            except OSError:
+                pass
+        self._count = min(len(items), keep)
+
+
+def get_store(name, kind="memory", path=None,
+              max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Returns the store for name creating it if it doesn't exist.  If
+    the kind or path for name changes, a new store is created.
+
+    :param name: the name of the store, e.g. ``"pagecache"``
+    :param kind: ``"memory"`` or ``"disk"``
+    :param path: the directory for a ``"disk"`` store
+    :param max_entries: the maximum number of values the store holds
+
+    :raises ValueError: if kind is unknown or a disk store has no path
+
+    :returns: a MemoryStore or DiskStore
+    """
+    _stores_lock.acquire()
+    try:
+        key = (name, kind, path)
+        store = _stores.get(key)
+        if store is not None:
+            store.max_entries = max_entries
+            return store
+
+        if kind == "memory":
+            store = MemoryStore(max_entries)
+        elif kind == "disk":
+            if not path:
+                raise ValueError("disk store '%s' needs a path" % name)
+            store = DiskStore(path, max_entries)
+        else:
+            raise ValueError("unknown store kind '%s'" % kind)
+
+        _stores[key] = store
+        return store
+    finally:
+        _stores_lock.release()
@@ -21,7 +21,8 @@ from optparse import OptionParser
 
 from Pyblosxom import __version__
 from Pyblosxom.pyblosxom import Pyblosxom
-from Pyblosxom.tools import run_callback, pwrap, pwrap_error
+from Pyblosxom.tools import (run_callback, pwrap, pwrap_error,
+                             get_config_filename)
 from Pyblosxom import plugin_utils
 
 USAGE = "%prog [options] [command] [command-options]"
@@ -33,7 +34,8 @@ def build_pyblosxom():
     """
     pwrap("Trying to import the config module....")
     try:
-        from config import py as cfg
+        import config
+        cfg = config.py
     except StandardError:
         h, t = os.path.split(sys.argv[0])
         script_name = t or h
@@ -45,6 +47,7 @@ def build_pyblosxom():
                                                              script_name))
         return None
 
+    cfg.setdefault("config_filename", get_config_filename(config))
     return Pyblosxom(cfg, {})
 
 
@@ -425,6 +428,146 @@ def run_static_renderer(command, argv):
 
     return p.run_static_renderer(options.incremental)
 
+
+def run_mail_queue(command, argv):
+    """Delivers the mail in the mail queue.
+    """
+    from Pyblosxom import mailqueue
+
+    parser = build_parser("%prog mailqueue [options]")
+    parser.add_option("--batch-size", type="int", dest="batch_size",
+                      default=mailqueue.DEFAULT_BATCH_SIZE,
+                      help="The maximum number of messages to send over "
+                      "one SMTP connection.")
+    parser.add_option("--max-attempts", type="int", dest="max_attempts",
+                      default=mailqueue.DEFAULT_MAX_ATTEMPTS,
+                      help="The number of times to try a message before "
+                      "moving it to the failed directory.")
+    parser.add_option("--backoff", type="int", dest="backoff",
+                      default=mailqueue.DEFAULT_BACKOFF,
+                      help="The number of seconds to wait before trying "
+                      "a message again.  This doubles with every failure.")
+    parser.add_option("--interval", type="int", dest="interval", default=0,
+                      help="Keep running and check the queue every "
+                      "INTERVAL seconds.  By default, the queue is "
+                      "processed once.")
+
+    (options, args) = parser.parse_args()
+
+    p = build_pyblosxom()
+    if not p:
+        return 0
+
+    queue = mailqueue.get_mail_queue(p.get_request().config)
+    if queue is None:
+        pwrap_error("ERROR: mail_spool_dir isn't set in config.py.")
+        return 0
+
+    while 1:
+        sent, failed = queue.process(batch_size=options.batch_size,
+                                     max_attempts=options.max_attempts,
+                                     backoff=options.backoff)
+        if options.verbose and (sent or failed):
+            pwrap("%d message(s) sent, %d failed." % (sent, failed))
+        if not options.interval:
+            break
+        time.sleep(options.interval)
+
+    return 0
+
+
+def run_warm_cache(command, argv):
+    """Parses entries and saves them in the cache.
+    """
+    parser = build_parser("%prog warmcache [options]")
+    parser.add_option("--jobs", type="int", dest="jobs", default=1,
+                      help="The number of processes to parse entries in.")
+    parser.add_option("--force", action="store_true", dest="force",
+                      default=False,
+                      help="Parse entries that are already cached, too.")
+    parser.add_option("--slowest", type="int", dest="slowest", default=10,
+                      help="The number of slowest entries to list.")
+
+    (options, args) = parser.parse_args()
+
+    p = build_pyblosxom()
+    if not p:
+        return 0
+
+    cfg = p.get_request().config
+    if cfg.get("cacheDriver", "base") == "base":
+        pwrap_error("WARNING: cacheDriver isn't set in config.py, so parsed "
+                    "entries aren't kept.")
+
+    start = time.time()
+    results = p.run_warm_cache(options.jobs, options.force)
+    elapsed = time.time() - start
+
+    for filename, seconds, error in results:
+        if error:
+            pwrap_error("ERROR: %s: %s" % (filename, error))
+
+    if options.verbose:
+        rate = 0
+        if elapsed:
+            rate = len(results) / elapsed
+        pwrap("Parsed %d entries in %.2f seconds (%.1f entries/second)." %
+              (len(results), elapsed, rate))
+
+        results.sort(key=lambda result: result[1], reverse=True)
+        if results and options.slowest > 0:
+            pwrap("Slowest entries:")
+            for filename, seconds, error in results[:options.slowest]:
+                print "  %8.3fs  %s" % (seconds, filename)
+
+    return 0
+
+
+def run_server(command, argv):
+    """Serves the blog over HTTP.
+    """
+    parser = build_parser("%prog serve [options]")
+    parser.add_option("--host", dest="host", default="127.0.0.1",
+                      help="The address to listen on.  Use 0.0.0.0 to "
+                      "listen on all interfaces.")
+    parser.add_option("--port", type="int", dest="port", default=8000,
+                      help="The port to listen on.")
+    parser.add_option("--threads", type="int", dest="threads", default=10,
+                      help="The number of threads handling connections in "
+                      "each process.")
+    parser.add_option("--processes", type="int", dest="processes",
+                      default=1,
+                      help="The number of worker processes.")
+    parser.add_option("--keepalive-timeout", type="float",
+                      dest="keepalive_timeout", default=5,
+                      help="The number of seconds idle connections are "
+                      "kept open.")
+    parser.add_option("--no-reload", action="store_false", dest="reload",
+                      default=True,
+                      help="Don't reload when config.py changes.")
+
+    (options, args) = parser.parse_args()
+
+    if options.threads < 1 or options.processes < 1:
+        pwrap_error("ERROR: --threads and --processes must be at least 1.")
+        return 1
+
+    if options.processes > 1 and not hasattr(os, "fork"):
+        pwrap_error("ERROR: --processes isn't supported on this platform.")
+        return 1
+
+    p = build_pyblosxom()
+    if not p:
+        return 0
+
+    # the command was taken off argv, so put it back for reloading
+    from Pyblosxom import server
+    server.serve(options.host, options.port, options.threads,
+                 options.processes, options.keepalive_timeout,
+                 options.reload, not options.verbose,
+                 [argv[0], command] + argv[1:])
+    return 0
+
 DEFAULT_HANDLERS = (
     ("create", create_blog, "Creates directory structure for a new blog."),
     ("test", test_installation,
@@ -433,7 +576,11 @@ DEFAULT_HANDLERS = (
      "Statically renders your blog into an HTML site."),
     ("renderurl", render_url, "Renders a single url of your blog."),
     ("generate", generate_entries, "Generates random entries--helps "
-     "with blog setup.")
+     "with blog setup."),
+    ("mailqueue", run_mail_queue, "Delivers mail in the mail queue."),
+    ("warmcache", run_warm_cache, "Parses entries and saves them in the "
+     "cache."),
+    ("serve", run_server, "Serves your blog over HTTP.")
 )
 
 
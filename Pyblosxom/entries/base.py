@@ -18,7 +18,6 @@ a BaseEntry with data that you provide for it.
 """
 
 import time
-import locale
 from Pyblosxom import tools
 
 BIGNUM = 2000000000
@@ -214,33 +213,9 @@ class EntryBase:
                           time is expected to be local time, not UTC.
         """
         self['timetuple'] = timetuple
-        self._mtime = time.mktime(timetuple)
-        gmtimetuple = time.gmtime(self._mtime)
-        self['mtime'] = self._mtime
-        self['ti'] = time.strftime('%H:%M', timetuple)
-        self['mo'] = time.strftime('%b', timetuple)
-        self['mo_num'] = time.strftime('%m', timetuple)
-        self['da'] = time.strftime('%d', timetuple)
-        self['dw'] = time.strftime('%A', timetuple)
-        self['yr'] = time.strftime('%Y', timetuple)
-        self['fulltime'] = time.strftime('%Y%m%d%H%M%S', timetuple)
-        self['date'] = time.strftime('%a, %d %b %Y', timetuple)
-
-        # YYYY-MM-DDThh:mm:ssZ
-        self['w3cdate'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', gmtimetuple)
-
-        # Temporarily disable the set locale, so RFC-compliant date is
-        # really RFC-compliant: directives %a and %b are locale
-        # dependent.  Technically, we're after english locale, but
-        # only 'C' locale is guaranteed to exist.
-        loc = locale.getlocale(locale.LC_ALL)
-        locale.setlocale(locale.LC_ALL, 'C')
-
-        self['rfc822date'] = time.strftime('%a, %d %b %Y %H:%M GMT', \
-                                           gmtimetuple)
-
-        # set the locale back
-        locale.setlocale(locale.LC_ALL, loc)
+        fields = tools.get_time_fields(timetuple)
+        self._mtime = fields['mtime']
+        self.update(fields)
 
     setTime = tools.deprecated_function(set_time)
 
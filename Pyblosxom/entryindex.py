@@ -0,0 +1,513 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2003-2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+"""
+The entry index keeps track of all the entries in the datadir and
+their mtimes.  Building it costs a walk of the datadir and a stat per
+entry, but no entry parsing, so it's the cheap answer to "has anything
+changed?".
+
+Every time the index is refreshed, it compares what's on disk with
+what it saw last time.  If entries were added, changed, or removed,
+it runs the ``entryindex_update`` callback with the lists of
+filenames and recomputes its ``generation``.  The generation is a
+digest of the entry filenames and their mtimes, so every process
+looking at the same datadir agrees on it without having to
+coordinate.  Caches use it to figure out whether what they're holding
+is stale.
+
+The index is kept in memory for the life of the process.  It's
+refreshed at most once per request and, if ``entryindex_interval`` is
+set, at most once every ``entryindex_interval`` seconds.
+
+The index also keeps a per-category count of entries and, built on
+demand, an ``ArchiveIndex`` of entries by year, month, and day that
+archive and calendar plugins share.
+
+If ``entryindex_filename`` is set, the index is also saved to that
+file.  This lets CGI deployments skip the filestat callbacks for
+entries that haven't changed and makes ``entryindex_interval`` work
+across processes.
+"""
+
+import os
+import time
+import bisect
+import threading
+import cPickle as pickle
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from Pyblosxom import tools
+
+
+# this holds the EntryIndex instances for this process keyed by
+# datadir.
+_indexes = {}
+
+_indexes_lock = threading.Lock()
+
+
+class EntryIndex(object):
+    """
+    Index of the entries in a datadir.
+
+    ``entries`` maps the full filename of each entry to a
+    ``(stamp, mtime)`` tuple where ``stamp`` is the mtime of the file
+    on disk and ``mtime`` is the entry mtime as returned by
+    ``tools.filestat`` (which plugins can adjust with
+    ``cb_filestat``).
+
+    ``categories`` maps each category (the directory of an entry
+    relative to the datadir, ``""`` for the datadir itself) to the
+    number of entries directly in it.  It's updated as entries are
+    added and removed.
+    """
+    def __init__(self, datadir):
+        self.datadir = datadir
+        self.entries = {}
+        self.categories = {}
+        self.generation = ""
+        self.checked = 0
+        self._lock = threading.Lock()
+        self._category_counts = (None, {})
+        self._archive = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        del state["_category_counts"]
+        del state["_archive"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._category_counts = (None, {})
+        self._archive = None
+
+        # indexes saved by older versions don't have categories
+        if not "categories" in state:
+            self.categories = {}
+            for mem in self.entries:
+                self._add_category(mem, 1)
+
+    def get_category(self, filename):
+        """
+        Returns the category of the entry with this filename.
+        """
+        return os.path.dirname(filename[len(self.datadir) + 1:])
+
+    def _add_category(self, filename, n):
+        category = self.get_category(filename)
+        count = self.categories.get(category, 0) + n
+        if count > 0:
+            self.categories[category] = count
+        else:
+            self.categories.pop(category, None)
+
+    def scan(self, request):
+        """
+        Walks the datadir and updates the index.
+
+        :param request: the Request object
+
+        :returns: tuple of (added, changed, removed) lists of
+                  filenames
+        """
+        old = self.entries
+        new = {}
+        added = []
+        changed = []
+
+        for mem in tools.walk(request, self.datadir):
+            try:
+                stamp = os.stat(mem).st_mtime
+            except OSError:
+                # the file went away between the walk and the stat
+                continue
+
+            prev = old.get(mem)
+            if prev is not None and prev[0] == stamp:
+                new[mem] = prev
+                continue
+
+            new[mem] = (stamp, time.mktime(tools.filestat(request, mem)))
+            if prev is None:
+                added.append(mem)
+            else:
+                changed.append(mem)
+
+        removed = [mem for mem in old if mem not in new]
+
+        for mem in added:
+            self._add_category(mem, 1)
+        for mem in removed:
+            self._add_category(mem, -1)
+
+        archive = self._archive
+        if archive is not None:
+            for mem in changed + removed:
+                archive.remove(mem, old[mem][1])
+            for mem in added + changed:
+                archive.add(mem, new[mem][1])
+
+        self.entries = new
+        self.checked = time.time()
+        if added or changed or removed or not self.generation:
+            self.generation = self.compute_generation()
+
+        return added, changed, removed
+
+    def compute_generation(self):
+        """
+        Returns a digest of the filenames and on-disk mtimes of all
+        the entries in the index.
+        """
+        items = self.entries.items()
+        items.sort()
+        digest = md5()
+        for filename, (stamp, mtime) in items:
+            digest.update("%s\0%r\n" % (filename, stamp))
+        return digest.hexdigest()[:16]
+
+    def get_category_counts(self):
+        """
+        Returns a dict mapping each category to the number of entries
+        in it and all of its subcategories.  Parent categories that
+        have no entries of their own are included.  The root category
+        is ``""``.
+
+        The counts are computed in one pass from the deepest
+        categories up to the root and kept until the generation
+        changes.
+        """
+        generation, counts = self._category_counts
+        if generation == self.generation:
+            return counts
+
+        counts = dict(self.categories)
+
+        # group categories by depth so each one is added to its parent
+        # after all its children have been added to it
+        levels = {}
+        for mem in counts:
+            if mem:
+                levels.setdefault(mem.count(os.sep) + 1, []).append(mem)
+
+        depth = levels and max(levels.keys()) or 0
+        while depth > 0:
+            for mem in levels.get(depth, []):
+                parent = os.path.dirname(mem)
+                if not parent in counts:
+                    counts[parent] = 0
+                    if parent:
+                        levels.setdefault(depth - 1, []).append(parent)
+                counts[parent] += counts[mem]
+            depth -= 1
+
+        self._category_counts = (self.generation, counts)
+        return counts
+
+    def get_archive_index(self):
+        """
+        Returns the ArchiveIndex for the entries in this index.  It's
+        built the first time it's asked for and then kept up to date
+        as entries are added, changed, and removed.
+        """
+        self._lock.acquire()
+        try:
+            if self._archive is None:
+                archive = ArchiveIndex()
+                for filename, (stamp, mtime) in self.entries.items():
+                    archive.add(filename, mtime)
+                self._archive = archive
+            return self._archive
+        finally:
+            self._lock.release()
+
+    def refresh(self, request):
+        """
+        Scans the datadir if the index is older than
+        ``entryindex_interval`` seconds and runs the
+        ``entryindex_update`` callback if anything changed.
+
+        :param request: the Request object
+
+        :returns: True if the index changed and False otherwise
+        """
+        config = request.get_configuration()
+        interval = config.get("entryindex_interval", 0)
+
+        self._lock.acquire()
+        try:
+            if interval and time.time() - self.checked < interval:
+                return False
+
+            added, changed, removed = self.scan(request)
+        finally:
+            self._lock.release()
+
+        if not (added or changed or removed):
+            return False
+
+        tools.run_callback("entryindex_update",
+                           {"request": request,
+                            "index": self,
+                            "added": added,
+                            "changed": changed,
+                            "removed": removed})
+        return True
+
+
+class ArchiveIndex(object):
+    """
+    Index of entries by the year, month, and day of their mtime in
+    local time.
+
+    ``years`` maps year -> month -> day -> list of ``(mtime,
+    filename)`` tuples.  Years, months, and days are ints.
+    """
+    def __init__(self):
+        self.years = {}
+        self._months = None
+
+    def add(self, filename, mtime):
+        """
+        Adds the entry with this filename and entry mtime.
+        """
+        timetuple = time.localtime(mtime)
+        months = self.years.setdefault(timetuple[0], {})
+        days = months.setdefault(timetuple[1], {})
+        days.setdefault(timetuple[2], []).append((mtime, filename))
+        self._months = None
+
+    def remove(self, filename, mtime):
+        """
+        Removes the entry with this filename and entry mtime if it's
+        in the index.
+        """
+        year, month, day = time.localtime(mtime)[0:3]
+        try:
+            items = self.years[year][month][day]
+            items.remove((mtime, filename))
+        except (KeyError, ValueError):
+            return
+
+        if not items:
+            del self.years[year][month][day]
+            if not self.years[year][month]:
+                del self.years[year][month]
+                if not self.years[year]:
+                    del self.years[year]
+        self._months = None
+
+    def get_years(self):
+        """
+        Returns the sorted list of years that have entries.
+        """
+        years = self.years.keys()
+        years.sort()
+        return years
+
+    def get_months(self):
+        """
+        Returns the sorted list of ``(year, month)`` tuples that have
+        entries.
+        """
+        months = self._months
+        if months is None:
+            months = []
+            for year, mem in self.years.items():
+                months.extend([(year, month) for month in mem])
+            months.sort()
+            self._months = months
+        return months
+
+    def get_last_day(self, year):
+        """
+        Returns the ``(month, day)`` of the newest entry in this year
+        or None if the year has no entries.
+        """
+        months = self.years.get(year)
+        if not months:
+            return None
+        month = max(months)
+        return month, max(months[month])
+
+    def get_days(self, year, month):
+        """
+        Returns a dict of day -> number of entries for the days in
+        this year and month that have entries.
+        """
+        days = self.years.get(year, {}).get(month, {})
+        return dict([(day, len(items)) for day, items in days.items()])
+
+    def get_adjacent_months(self, year, month):
+        """
+        Returns a ``(prev, next)`` tuple of the closest ``(year,
+        month)`` tuples before and after this year and month that have
+        entries.  Either is None if there's no such month.
+        """
+        months = self.get_months()
+        i = bisect.bisect_left(months, (year, month))
+        prev = next = None
+        if i > 0:
+            prev = months[i - 1]
+        if i < len(months) and months[i] == (year, month):
+            i += 1
+        if i < len(months):
+            next = months[i]
+        return prev, next
+
+    def _items(self, year, month=None, day=None):
+        if month is None:
+            months = self.years.get(year, {}).values()
+        else:
+            months = [self.years.get(year, {}).get(month, {})]
+
+        items = []
+        for days in months:
+            if day is None:
+                for mem in days.values():
+                    items.extend(mem)
+            else:
+                items.extend(days.get(day, []))
+        return items
+
+    def count(self, year, month=None, day=None):
+        """
+        Returns the number of entries in this year, month, or day.
+        """
+        return len(self._items(year, month, day))
+
+    def get_entries(self, year, month=None, day=None):
+        """
+        Returns the list of ``(mtime, filename)`` tuples for the
+        entries in this year, month, or day newest first.
+        """
+        items = self._items(year, month, day)
+        items.sort()
+        items.reverse()
+        return items
+
+
+def get_archive_index(request):
+    """
+    Returns the ArchiveIndex for the datadir of this request.
+
+    :param request: the Request object
+
+    :returns: an ArchiveIndex
+    """
+    return get_entry_index(request).get_archive_index()
+
+
+def get_index_filename(cfg):
+    """
+    Returns the filename the entry index is saved to or None if the
+    index isn't saved.
+
+    :param cfg: the config.py dict
+    """
+    return cfg.get("entryindex_filename", None)
+
+
+def load_index(path, datadir):
+    """
+    Loads a saved EntryIndex from path.  If there's no such file or
+    it's for another datadir, this returns a new empty EntryIndex.
+
+    :param path: the filename of the saved index
+    :param datadir: the datadir the index is for
+
+    :returns: an EntryIndex
+    """
+    try:
+        fp = open(path, "rb")
+        try:
+            index = pickle.load(fp)
+        finally:
+            fp.close()
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError,
+            ValueError):
+        return EntryIndex(datadir)
+
+    if not isinstance(index, EntryIndex) or index.datadir != datadir:
+        return EntryIndex(datadir)
+    return index
+
+
+def save_index(path, index):
+    """
+    Saves the EntryIndex to path.  The index is written to a
+    temporary file first and then moved into place so that readers
+    never see a partial file.
+
+    :param path: the filename to save the index to
+    :param index: the EntryIndex to save
+    """
+    tmp = tools.get_temp_filename(path)
+    try:
+        fp = open(tmp, "wb")
+        try:
+            pickle.dump(index, fp, pickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmp, path)
+    except (IOError, OSError), e:
+        tools.get_logger().warning("couldn't save entry index to %s: %s" %
+                                   (path, e))
+
+
+def get_entry_index(request):
+    """
+    Returns the refreshed EntryIndex for the datadir of this request.
+
+    The index is refreshed at most once per request.
+
+    :param request: the Request object
+
+    :returns: an EntryIndex
+    """
+    data = request.get_data()
+    index = data.get("entry_index")
+    if index is not None:
+        return index
+
+    config = request.get_configuration()
+    datadir = config["datadir"]
+    path = get_index_filename(config)
+
+    _indexes_lock.acquire()
+    try:
+        index = _indexes.get(datadir)
+        if index is None:
+            if path:
+                index = load_index(path, datadir)
+            else:
+                index = EntryIndex(datadir)
+            _indexes[datadir] = index
+    finally:
+        _indexes_lock.release()
+
+    checked = index.checked
+    changed = index.refresh(request)
+
+    # save the index if it changed or if we're using an interval and
+    # other processes need to know when we last checked
+    if path and (changed or (index.checked != checked and
+                             config.get("entryindex_interval", 0))):
+        save_index(path, index)
+
+    data["entry_index"] = index
+    return index
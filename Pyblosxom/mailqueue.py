@@ -0,0 +1,367 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2003-2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+"""
+Outbound mail for Pyblosxom.
+
+Plugins that send mail (e.g. comment notifications) can either send it
+right away with ``send_smtp`` and ``send_mta`` or, if
+``mail_spool_dir`` is set in ``config.py``, add it to the mail queue
+with ``MailQueue.enqueue_smtp`` and ``MailQueue.enqueue_mta`` and let
+the ``pyblosxom-cmd mailqueue`` command deliver it.  That keeps slow
+MTAs and SMTP servers out of the request.
+
+The queue is a directory with one pickle file per message.  The
+filename starts with the time the message should next be tried, so
+the worker doesn't have to open messages that aren't due.  Messages
+for the same SMTP server are delivered in batches over one
+connection.  Messages that fail are retried with exponential backoff
+and moved to the ``failed`` subdirectory after ``max_attempts``.
+"""
+
+import os
+import time
+import random
+import threading
+import subprocess
+import cPickle as pickle
+
+from Pyblosxom import tools
+
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BACKOFF = 60
+DEFAULT_MAX_BACKOFF = 6 * 60 * 60
+
+# messages claimed by a worker that didn't finish with them in this
+# many seconds are put back in the queue
+WORK_TIMEOUT = 60 * 60
+
+
+class MailError(Exception):
+    """
+    Raised when a message can't be delivered.
+    """
+    pass
+
+
+def send_mta(argv, body):
+    """
+    Sends a message by running an MTA command.
+
+    :param argv: the command line as a list
+    :param body: the message including headers
+
+    :raises MailError: if the command can't be run or writes to
+                       stderr
+    """
+    try:
+        process = subprocess.Popen(
+            argv, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate(body)
+    except OSError, e:
+        raise MailError("can't run %s: %s" % (argv[0], e))
+
+    tools.get_logger().debug('Ran MTA command: ' + ' '.join(argv))
+    tools.get_logger().debug('Received stdout: ' + stdout)
+    tools.get_logger().debug('Received stderr: ' + stderr)
+    if stderr:
+        raise MailError(stderr)
+
+
+def send_smtp(server, messages):
+    """
+    Sends messages through an SMTP server over one connection.
+
+    :param server: the SMTP server as ``host`` or ``host:port``
+    :param messages: list of ``(from_addr, to_addrs, message)``
+                     tuples
+
+    :returns: list with None for each message that was sent and the
+              error for each message that wasn't
+
+    :raises MailError: if there's a problem with the connection, in
+                       which case no messages were sent
+    """
+    import smtplib
+    import socket
+
+    try:
+        conn = smtplib.SMTP(server)
+    except (smtplib.SMTPException, socket.error), e:
+        raise MailError("can't connect to %s: %s" % (server, e))
+
+    errors = []
+    try:
+        for from_addr, to_addrs, message in messages:
+            try:
+                refused = conn.sendmail(from_addr, to_addrs, message)
+            except (smtplib.SMTPRecipientsRefused,
+                    smtplib.SMTPSenderRefused,
+                    smtplib.SMTPDataError), e:
+                errors.append(str(e))
+                conn.rset()
+                continue
+            if refused:
+                errors.append("refused: %r" % refused)
+            else:
+                errors.append(None)
+    except (smtplib.SMTPException, socket.error), e:
+        # the connection went bad, so the rest weren't sent
+        errors.extend([str(e)] * (len(messages) - len(errors)))
+
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, socket.error):
+        pass
+
+    return errors
+
+
+class MailQueue(object):
+    """
+    A spool directory of messages waiting to be delivered.
+    """
+    def __init__(self, path):
+        """
+        :param path: the spool directory.  It's created if it doesn't
+                     exist.
+        """
+        self.path = path
+
+    def _write(self, msg):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        name = "%010d-%d-%06d.msg" % (int(msg["next_try"]), os.getpid(),
+                                      random.randint(0, 999999))
+        filename = os.path.join(self.path, name)
+        tmp = filename + ".new"
+        f = open(tmp, "wb")
+        try:
+            pickle.dump(msg, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+        return filename
+
+    def enqueue_smtp(self, server, from_addr, to_addrs, message):
+        """
+        Adds a message to be sent through an SMTP server.
+
+        :param server: the SMTP server as ``host`` or ``host:port``
+        :param from_addr: the envelope from address
+        :param to_addrs: an address or list of addresses
+        :param message: the message including headers
+
+        :returns: the filename of the queued message
+        """
+        return self._write({"transport": "smtp",
+                            "server": server,
+                            "from_addr": from_addr,
+                            "to_addrs": to_addrs,
+                            "message": message,
+                            "attempts": 0,
+                            "next_try": time.time(),
+                            "errors": []})
+
+    def enqueue_mta(self, argv, message):
+        """
+        Adds a message to be sent by running an MTA command.
+
+        :param argv: the command line as a list
+        :param message: the message including headers
+
+        :returns: the filename of the queued message
+        """
+        return self._write({"transport": "mta",
+                            "argv": argv,
+                            "message": message,
+                            "attempts": 0,
+                            "next_try": time.time(),
+                            "errors": []})
+
+    def __len__(self):
+        return len(self._listing())
+
+    def _listing(self):
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        names = [mem for mem in names if mem.endswith(".msg")]
+        names.sort()
+        return names
+
+    def _recover(self, now):
+        # put back messages claimed by workers that went away
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for mem in names:
+            if not mem.endswith(".work"):
+                continue
+            filename = os.path.join(self.path, mem)
+            try:
+                if now - os.stat(filename).st_mtime > WORK_TIMEOUT:
+                    os.rename(filename, filename[:filename.rindex(".msg")]
+                              + ".msg")
+            except OSError:
+                pass
+
+    def _claim(self, name):
+        filename = os.path.join(self.path, name)
+        work = "%s.%d.work" % (filename, os.getpid())
+        try:
+            os.rename(filename, work)
+            os.utime(work, None)
+        except OSError:
+            # another worker got it
+            return None, None
+
+        try:
+            f = open(work, "rb")
+            try:
+                return work, pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError), e:
+            tools.get_logger().error("bad message %s: %s" % (work, e))
+            self._fail(work, None)
+            return None, None
+
+    def _fail(self, work, msg):
+        failed = os.path.join(self.path, "failed")
+        if not os.path.isdir(failed):
+            os.makedirs(failed)
+        name = os.path.basename(work)
+        name = name[:name.rindex(".msg")] + ".msg"
+        if msg is None:
+            os.rename(work, os.path.join(failed, name))
+            return
+
+        f = open(os.path.join(failed, name), "wb")
+        try:
+            pickle.dump(msg, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.remove(work)
+
+    def _done(self, work, msg, error, now, max_attempts, backoff,
+              max_backoff):
+        if error is None:
+            os.remove(work)
+            return True
+
+        msg["attempts"] += 1
+        msg["errors"].append(error)
+        tools.get_logger().warning("couldn't deliver %s (attempt %d): %s" %
+                                   (work, msg["attempts"], error))
+
+        if msg["attempts"] >= max_attempts:
+            self._fail(work, msg)
+            return False
+
+        delay = min(backoff * 2 ** (msg["attempts"] - 1), max_backoff)
+        msg["next_try"] = now + delay
+        self._write(msg)
+        os.remove(work)
+        return False
+
+    def process(self, batch_size=DEFAULT_BATCH_SIZE,
+                max_attempts=DEFAULT_MAX_ATTEMPTS,
+                backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                now=None):
+        """
+        Delivers the messages that are due.
+
+        :param batch_size: the maximum number of messages to send over
+                           one SMTP connection
+        :param max_attempts: the number of times to try a message
+                             before giving up on it
+        :param backoff: the number of seconds to wait before trying a
+                        message again after the first failure.  This
+                        doubles with every failure.
+        :param max_backoff: the maximum number of seconds to wait
+                            before trying a message again
+        :param now: the current time--for testing
+
+        :returns: tuple of (sent, failed) counts
+        """
+        if now is None:
+            now = time.time()
+        self._recover(now)
+
+        # claim everything that's due and group smtp messages by server
+        smtp = {}
+        mta = []
+        for name in self._listing():
+            try:
+                next_try = int(name.split("-", 1)[0])
+            except ValueError:
+                next_try = 0
+            if next_try > now:
+                # the listing is sorted, so nothing after this is due
+                break
+
+            work, msg = self._claim(name)
+            if msg is None:
+                continue
+            if msg.get("transport") == "smtp":
+                smtp.setdefault(msg["server"], []).append((work, msg))
+            else:
+                mta.append((work, msg))
+
+        sent = failed = 0
+        args = (now, max_attempts, backoff, max_backoff)
+
+        for server, items in smtp.items():
+            for i in range(0, len(items), batch_size):
+                batch = items[i:i + batch_size]
+                messages = [(msg["from_addr"], msg["to_addrs"],
+                             msg["message"]) for work, msg in batch]
+                try:
+                    errors = send_smtp(server, messages)
+                except MailError, e:
+                    errors = [str(e)] * len(batch)
+
+                for (work, msg), error in zip(batch, errors):
+                    if self._done(work, msg, error, *args):
+                        sent += 1
+                    else:
+                        failed += 1
+
+        for work, msg in mta:
+            try:
+                send_mta(msg["argv"], msg["message"])
+                error = None
+            except MailError, e:
+                error = str(e)
+            if self._done(work, msg, error, *args):
+                sent += 1
+            else:
+                failed += 1
+
+        return sent, failed
+
+
+def get_mail_queue(cfg):
+    """
+    Returns the MailQueue for ``mail_spool_dir`` or None if mail isn't
+    spooled.
+
+    :param cfg: the config.py dict
+    """
+    path = cfg.get("mail_spool_dir")
+    if not path:
+        return None
+    return MailQueue(path)
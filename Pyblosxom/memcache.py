@@ -10,11 +10,15 @@
 """Holds memcache functions.
 """
 
+import threading
+
 # Whether or not to use memcache.
 usecache = False
 
 _memcache_cache = {}
 
+_memcache_lock = threading.Lock()
+
 
 def memcache_decorator(scope, instance=False):
     """Caches function results in memory
@@ -59,10 +63,17 @@ def memcache_decorator(scope, instance=False):
                 return fun(*args, **kwargs)
 
             try:
-                ret = _memcache_cache.setdefault(scope, {})[hash_key]
+                ret = _memcache_cache[scope][hash_key]
             except KeyError:
+                # compute outside the lock so other threads aren't
+                # held up; if two threads compute the same value, the
+                # last one wins, which is fine
                 ret = fun(*args, **kwargs)
-                _memcache_cache[scope][hash_key] = ret
+                _memcache_lock.acquire()
+                try:
+                    _memcache_cache.setdefault(scope, {})[hash_key] = ret
+                finally:
+                    _memcache_lock.release()
             return ret
         return _memcache_decorated
     return _memcache
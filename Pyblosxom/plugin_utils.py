@@ -17,7 +17,11 @@ import os
 import glob
 import sys
 import os.path
+import threading
 import traceback
+import cPickle as pickle
+
+from Pyblosxom import __version__
 
 
 # this holds the list of plugins that have been loaded.  if you're running
@@ -35,6 +39,28 @@ callbacks = {}
 # didn't import.
 bad_plugins = []
 
+# held while plugins are loaded.  it's reentrant because a plugin
+# that's loaded lazily can run callbacks when it's imported.
+_plugins_lock = threading.RLock()
+
+# plugin name -> position in the load order for plugins that are
+# loaded lazily and haven't been imported yet
+_lazy_plugins = {}
+
+# names of the callbacks whose chains have LazyCallbacks in them
+_lazy_chains = set()
+
+# the startup snapshot the plugins were loaded from or None.  see
+# load_snapshot.
+snapshot = None
+
+# (filename, plugin_dirs, load_plugins) to save the startup snapshot
+# with once the entryparser map is known or None
+_snapshot_settings = None
+
+# bump this when the snapshot format changes
+SNAPSHOT_VERSION = 3
+
 
 def catalogue_plugin(plugin_module):
     """
@@ -54,18 +80,186 @@ def catalogue_plugin(plugin_module):
             callbacks.setdefault(memadj, []).append(func)
 
 
-def get_callback_chain(chain):
+def catalogue_callbacks(plugin_module, names):
+    """
+    Catalogues the callbacks of a plugin from a list of callback names
+    instead of going through the plugin's contents.
+
+    :param plugin_module: the module to catalogue
+    :param names: the names of the callbacks the module defines
+                  without the ``cb_``
+    """
+    for mem in names:
+        callbacks.setdefault(mem, []).append(getattr(plugin_module,
+                                                     "cb_" + mem))
+
+
+class LazyCallback:
+    """
+    Stands in for the callback of a plugin that's loaded lazily until
+    the plugin is imported.
+    """
+    def __init__(self, plugin_name, chain):
+        """
+        :param plugin_name: the name of the plugin module
+        :param chain: the name of the callback without the ``cb_``
+        """
+        self.plugin_name = plugin_name
+        self.chain = chain
+
+    def load(self):
+        """
+        Imports the plugin and returns the callback function or None if
+        the plugin doesn't import.
+        """
+        module = load_plugin(self.plugin_name)
+        if module is None:
+            return None
+        return getattr(module, "cb_" + self.chain)
+
+    def __call__(self, *args, **kwargs):
+        func = self.load()
+        if func is None:
+            return None
+        return func(*args, **kwargs)
+
+    def __repr__(self):
+        return "<LazyCallback %s.cb_%s>" % (self.plugin_name, self.chain)
+
+
+class LazyPreformatter(LazyCallback):
+    """
+    Stands in for the ``cb_preformat`` of a plugin that's loaded lazily
+    and has a ``PREFORMATTER_ID``.  The preformat callback runs for
+    every entry, but such a plugin only formats entries whose parser
+    is its ``PREFORMATTER_ID``, so it isn't imported until an entry
+    asks for that parser.
+
+    Unlike ``LazyCallback``, this stays in the callback chain after
+    the plugin is imported.
+    """
+    def __init__(self, plugin_name, preformatter_id):
+        """
+        :param plugin_name: the name of the plugin module
+        :param preformatter_id: the plugin's ``PREFORMATTER_ID``
+        """
+        LazyCallback.__init__(self, plugin_name, "preformat")
+        self.preformatter_id = preformatter_id
+        self._func = None
+
+    def __call__(self, args):
+        if args.get("parser") != self.preformatter_id:
+            return None
+        if self._func is None:
+            self._func = self.load()
+            if self._func is None:
+                return None
+        return self._func(args)
+
+    def __repr__(self):
+        return "<LazyPreformatter %s.cb_preformat for %r>" % (
+            self.plugin_name, self.preformatter_id)
+
+
+def get_callback_chain(chain, load=True):
     """
     Returns a list of functions registered with the callback.
 
+    Plugins that are loaded lazily are imported the first time one of
+    their callbacks is asked for.  The exception is preformatters (see
+    ``LazyPreformatter``), which are imported the first time an entry
+    uses their parser.
+
+    :param chain: the name of the callback
+    :param load: whether to import lazily loaded plugins.  If this is
+                 False, the list can have ``LazyCallback`` instances in
+                 it.
+
     @returns: list of functions registered with the callback (or an
         empty list)
     @rtype: list of functions
     """
+    if load and chain in _lazy_chains:
+        _load_chain(chain)
     return callbacks.get(chain, [])
 
 
-def initialize_plugins(plugin_dirs, plugin_list):
+def _load_chain(chain):
+    _plugins_lock.acquire()
+    try:
+        if chain not in _lazy_chains:
+            return
+
+        funcs = []
+        for func in callbacks.get(chain, []):
+            if ((isinstance(func, LazyCallback)
+                 and not isinstance(func, LazyPreformatter))):
+                func = func.load()
+                if func is None:
+                    continue
+            funcs.append(func)
+
+        # threads running the chain keep the list they have
+        callbacks[chain] = funcs
+        _lazy_chains.discard(chain)
+    finally:
+        _plugins_lock.release()
+
+
+def load_plugin(name):
+    """
+    Returns the plugin module with this name, importing it if it's
+    loaded lazily and hasn't been imported yet.
+
+    :param name: the name of the plugin module
+
+    :returns: the module or None if it's not a plugin or doesn't
+              import
+    """
+    _plugins_lock.acquire()
+    try:
+        if name in _lazy_plugins:
+            _import_plugin(name)
+        return get_plugin_by_name(name)
+    finally:
+        _plugins_lock.release()
+
+
+def _import_plugin(mem):
+    """
+    Imports a plugin and adds it to ``plugins`` or adds it to
+    ``bad_plugins`` if it doesn't import.
+
+    :returns: the module or None
+    """
+    position = _lazy_plugins.pop(mem, None)
+    try:
+        _module = __import__(mem)
+    except (SystemExit, KeyboardInterrupt):
+        raise
+    except:
+        # this needs to be a catch-all
+        bad_plugins.append((mem, "".join(traceback.format_exc())))
+        return None
+
+    for comp in mem.split(".")[1:]:
+        _module = getattr(_module, comp)
+
+    if position is None:
+        plugins.append(_module)
+    else:
+        # keep plugins in load order no matter which is used first
+        index = 0
+        order = snapshot["plugins"]
+        while index < len(plugins) and \
+                order.index(plugins[index].__name__) < position:
+            index += 1
+        plugins.insert(index, _module)
+    return _module
+
+
+def initialize_plugins(plugin_dirs, plugin_list, snapshot_filename=None,
+                       lazy=False, config_filename=None):
     """
     Imports and initializes plugins from the directories in the list
     specified by "plugins_dir".  If no such list exists, then we don't
@@ -86,12 +280,43 @@ def initialize_plugins(plugin_dirs, plugin_list):
 
     :param plugin_list: the list of plugins to load, or if None, we'll
                         load all the plugins we find in those dirs.
+
+    :param snapshot_filename: the file the startup snapshot is kept
+                              in or None.  See ``load_snapshot``.
+
+    :param lazy: whether to import plugins the first time one of their
+                 callbacks is run rather than up front.  This only
+                 happens when plugins are loaded from a startup
+                 snapshot, since the snapshot is what says which
+                 callbacks a plugin has.
+
+    :param config_filename: the filename of ``config.py``.  The
+                            snapshot is rebuilt when it changes, so
+                            the snapshot isn't used if this is None.
     """
-    if plugins or bad_plugins:
+    if plugins or bad_plugins or _lazy_plugins:
         return
 
+    # threads handling their first requests wait here until the
+    # plugins are loaded
+    _plugins_lock.acquire()
+    try:
+        if plugins or bad_plugins or _lazy_plugins:
+            return
+        _initialize_plugins(plugin_dirs, plugin_list, snapshot_filename,
+                            lazy, config_filename)
+    finally:
+        _plugins_lock.release()
+
+
+def _initialize_plugins(plugin_dirs, plugin_list, snapshot_filename=None,
+                        lazy=False, config_filename=None):
+    global snapshot, _snapshot_settings
+
     # we clear out the callbacks dict so we can rebuild them
     callbacks.clear()
+    _lazy_plugins.clear()
+    _lazy_chains.clear()
 
     # handle plugin_dirs here
     for mem in plugin_dirs:
@@ -101,22 +326,44 @@ def initialize_plugins(plugin_dirs, plugin_list):
             raise Exception("Plugin directory '%s' does not exist.  " \
                             "Please check your config file." % mem)
 
-    plugin_list = get_plugin_list(plugin_list, plugin_dirs)
+    snapshot = _snapshot_settings = None
+    # without config.py's filename, we can't tell whether the snapshot
+    # is out of date
+    if snapshot_filename and config_filename:
+        _snapshot_settings = (snapshot_filename, plugin_dirs, plugin_list,
+                              config_filename)
+        snapshot = load_snapshot(snapshot_filename, plugin_dirs, plugin_list,
+                                 config_filename)
+
+    if snapshot is None:
+        plugin_list = get_plugin_list(plugin_list, plugin_dirs)
+    else:
+        plugin_list = snapshot["plugins"]
+
+    if snapshot is not None and lazy:
+        # the callback chains are built from the snapshot in load
+        # order and the plugins are imported when they're first used
+        for i, mem in enumerate(plugin_list):
+            _lazy_plugins[mem] = i
+            for chain in snapshot["callbacks"][mem]:
+                if chain == "preformat" and mem in snapshot["preformatters"]:
+                    func = LazyPreformatter(mem,
+                                            snapshot["preformatters"][mem])
+                else:
+                    func = LazyCallback(mem, chain)
+                callbacks.setdefault(chain, []).append(func)
+                _lazy_chains.add(chain)
+        return
 
     for mem in plugin_list:
-        try:
-            _module = __import__(mem)
-        except (SystemExit, KeyboardInterrupt):
-            raise
-        except:
-            # this needs to be a catch-all
-            bad_plugins.append((mem, "".join(traceback.format_exc())))
+        _module = _import_plugin(mem)
+        if _module is None:
             continue
 
-        for comp in mem.split(".")[1:]:
-            _module = getattr(_module, comp)
-        catalogue_plugin(_module)
-        plugins.append(_module)
+        if snapshot is None:
+            catalogue_plugin(_module)
+        else:
+            catalogue_callbacks(_module, snapshot["callbacks"][mem])
 
 
 def get_plugin_by_name(name):
@@ -128,6 +375,9 @@ def get_plugin_by_name(name):
 
     :returns: the Python module instance for the plugin or None
     """
+    if name in _lazy_plugins:
+        return load_plugin(name)
+
     if plugins:
         for mem in plugins:
             if mem.__name__ == name:
@@ -176,3 +426,226 @@ def get_plugin_list(plugin_list, plugin_dirs):
         plugin_list.sort()
 
     return plugin_list
+
+
+def get_source_filename(module):
+    """
+    Returns the filename of the source of a module or None if it
+    doesn't have one.
+
+    :param module: the module
+    """
+    filename = getattr(module, "__file__", None)
+    if filename and filename[-4:] in (".pyc", ".pyo") and \
+            os.path.exists(filename[:-1]):
+        filename = filename[:-1]
+    return filename
+
+
+def get_file_stamp(filename):
+    """
+    Returns the (mtime, size) of a file or directory or None if it
+    doesn't exist.
+
+    :param filename: the filename
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def _get_snapshot_files(config_filename):
+    """
+    Returns the files whose changes invalidate a startup snapshot of
+    the plugins that are loaded now.
+    """
+    files = [config_filename]
+    files.extend([get_source_filename(mem) for mem in plugins])
+    return [mem for mem in files if mem]
+
+
+def build_snapshot(plugin_dirs, plugin_list, entryparsers, config_filename):
+    """
+    Returns a startup snapshot of the plugins that are loaded now or
+    None if they can't be snapshotted.
+
+    The snapshot holds the list of plugins to import, the names of the
+    callbacks each plugin defines, the ``PREFORMATTER_ID`` of each
+    plugin that has one, and the map of file extension to entryparser
+    function, along with the mtimes and sizes of the files they came
+    from.
+
+    :param plugin_dirs: the plugin_dirs config.py setting
+    :param plugin_list: the load_plugins config.py setting
+    :param entryparsers: dict of file extension -> entryparser function
+    :param config_filename: the filename of ``config.py``
+
+    :returns: the snapshot dict or None
+    """
+    # failed plugins are tried (and reported) again next time
+    if bad_plugins or not config_filename:
+        return None
+
+    names = {}
+    preformatters = {}
+    for mem in plugins:
+        names[mem.__name__] = [item[3:] for item in dir(mem)
+                               if item.startswith("cb_")
+                               and callable(getattr(mem, item))]
+        preformatter_id = getattr(mem, "PREFORMATTER_ID", None)
+        if isinstance(preformatter_id, basestring):
+            preformatters[mem.__name__] = preformatter_id
+
+    # entryparsers have to be importable by name
+    parsers = {}
+    for ext, func in entryparsers.items():
+        module = sys.modules.get(getattr(func, "__module__", None))
+        name = getattr(func, "__name__", None)
+        if module is None or getattr(module, name, None) is not func:
+            return None
+        parsers[ext] = (module.__name__, name)
+
+    files = _get_snapshot_files(config_filename)
+    return {"version": (SNAPSHOT_VERSION, __version__),
+            "config_filename": config_filename,
+            "plugin_dirs": list(plugin_dirs),
+            "load_plugins": plugin_list,
+            "plugins": [mem.__name__ for mem in plugins],
+            "callbacks": names,
+            "preformatters": preformatters,
+            "entryparsers": parsers,
+            "files": [(mem, get_file_stamp(mem)) for mem in files]}
+
+
+def load_snapshot(filename, plugin_dirs, plugin_list, config_filename):
+    """
+    Loads the startup snapshot from filename.
+
+    A startup snapshot saves a process from finding the plugins,
+    looking through them for callbacks and running the entryparser
+    callback.  That's most of the work of starting up for CGI where
+    every request is a new process.
+
+    :param filename: the file the snapshot is kept in
+    :param plugin_dirs: the plugin_dirs config.py setting
+    :param plugin_list: the load_plugins config.py setting
+    :param config_filename: the filename of ``config.py``
+
+    :returns: the snapshot dict or None if there is no snapshot or
+              it's out of date
+    """
+    if not config_filename:
+        return None
+
+    try:
+        fp = open(filename, "rb")
+        try:
+            data = pickle.load(fp)
+        finally:
+            fp.close()
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError,
+            ValueError, ImportError):
+        return None
+
+    if not isinstance(data, dict) or \
+            data.get("version") != (SNAPSHOT_VERSION, __version__):
+        return None
+
+    if data["config_filename"] != config_filename or \
+            data["plugin_dirs"] != list(plugin_dirs) or \
+            data["load_plugins"] != plugin_list:
+        return None
+
+    # plugins are added to and removed from plugin_dirs without
+    # changing config.py if load_plugins isn't set
+    if plugin_list is None and \
+            get_plugin_list(None, plugin_dirs) != data["plugins"]:
+        return None
+
+    for mem, stamp in data["files"]:
+        if get_file_stamp(mem) != stamp:
+            return None
+
+    return data
+
+
+def save_snapshot(entryparsers):
+    """
+    Saves the startup snapshot if one is wanted and the plugins weren't
+    loaded from one.  This is called once the entryparser map is
+    built.
+
+    :param entryparsers: dict of file extension -> entryparser function
+    """
+    global snapshot, _snapshot_settings
+
+    if snapshot is not None or _snapshot_settings is None:
+        return
+
+    from Pyblosxom import tools
+
+    # the first requests of a threaded server all get here, but only
+    # one of them needs to save the snapshot
+    _plugins_lock.acquire()
+    try:
+        if snapshot is not None or _snapshot_settings is None:
+            return
+
+        path, plugin_dirs, plugin_list, config_filename = _snapshot_settings
+        data = build_snapshot(plugin_dirs, plugin_list, entryparsers,
+                              config_filename)
+        if data is None:
+            return
+
+        tmp = tools.get_temp_filename(path)
+        try:
+            fp = open(tmp, "wb")
+            try:
+                pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fp.close()
+            os.rename(tmp, path)
+        except (IOError, OSError), e:
+            tools.get_logger().warning("couldn't save startup snapshot to "
+                                       "%s: %s" % (path, e))
+            # don't try again on every request
+            _snapshot_settings = None
+            return
+        snapshot = data
+    finally:
+        _plugins_lock.release()
+
+
+def get_snapshot_entryparsers():
+    """
+    Returns the dict of file extension -> entryparser function from the
+    startup snapshot or None if the plugins weren't loaded from one.
+    """
+    if snapshot is None:
+        return None
+
+    entryparsers = {}
+    for ext, (module_name, name) in snapshot["entryparsers"].items():
+        if module_name in _lazy_plugins:
+            entryparsers[ext] = _lazy_entryparser(module_name, name)
+            continue
+        if module_name not in sys.modules:
+            __import__(module_name)
+        entryparsers[ext] = getattr(sys.modules[module_name], name)
+    return entryparsers
+
+
+def _lazy_entryparser(plugin_name, name):
+    """
+    Returns an entryparser that imports the plugin the real entryparser
+    is in the first time it's called.
+    """
+    def parse(filename, request):
+        module = load_plugin(plugin_name)
+        if module is None:
+            raise ImportError("plugin '%s' didn't import" % plugin_name)
+        return getattr(module, name)(filename, request)
+    return parse
+
@@ -112,6 +112,12 @@ this to the metadata for the entry::
 
     #noacronyms 1
 
+The acronyms file is read and compiled into one regular expression
+the first time it's needed and again when it changes, so the number
+of acronyms doesn't matter much.  Marked up entry bodies are kept in
+memory, so entries that show up on several pages are only marked up
+once.
+
 
 Styling
 =======
@@ -149,7 +155,13 @@ __registrytags__ = "1.5, core"
 import os
 import re
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 from Pyblosxom import tools
+from Pyblosxom.cache.store import get_store
 from Pyblosxom.tools import pwrap_error
 
 
@@ -226,52 +238,214 @@ def build_acronyms(lines):
     return acronyms
 
 
-def cb_start(args):
-    request = args["request"]
-    config = request.get_configuration()
-    filename = get_acronym_file(config)
+TAG_RE = re.compile("<\D.*?>")
+
+# characters that make an acronym a regular expression rather than a
+# literal string
+REGEXP_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+def build_trie_pattern(words):
+    """
+    Returns a regular expression that matches any of the literal
+    strings in words.  The strings are put in a trie so strings that
+    share a prefix share the part of the regular expression that
+    matches it.
+
+    :param words: list of literal strings
+
+    :returns: regular expression string
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[""] = None
+    return _trie_pattern(trie)
+
+
+def _trie_pattern(node):
+    alts = []
+    optional = False
+    keys = node.keys()
+    keys.sort()
+    for c in keys:
+        if c == "":
+            optional = True
+        else:
+            alts.append(re.escape(c) + _trie_pattern(node[c]))
+
+    if not alts:
+        return ""
+    if len(alts) == 1:
+        pattern = alts[0]
+        if optional:
+            pattern = "(?:%s)?" % pattern
+    else:
+        pattern = "(?:%s)" % "|".join(alts)
+        if optional:
+            pattern = pattern + "?"
+    return pattern
+
+
+class AcronymMatcher(object):
+    """
+    Marks up all the acronyms in a string in one pass.
+
+    The acronyms are compiled into a single regular expression.
+    Literal acronyms go into a trie and the rest are alternatives
+    after it.  HTML tags are matched too so they can be skipped.
+    """
+    def __init__(self, acronyms):
+        """
+        :param acronyms: list of (regexp object, replacement) tuples as
+                         returned by ``build_acronyms``
+        """
+        self.literals = {}
+        self.regexps = []
+        alts = []
+        for reob, repl in acronyms:
+            # patterns are "(\bPATTERN\b)"
+            pattern = reob.pattern[3:-3]
+            if REGEXP_CHARS.search(pattern) is None:
+                self.literals.setdefault(pattern, repl)
+            else:
+                self.regexps.append((re.compile("(?:%s)$" % pattern), repl))
+                alts.append("(?:%s)" % pattern)
+
+        if self.literals:
+            alts.insert(0, build_trie_pattern(self.literals.keys()))
+
+        # expansions are cached under this
+        self.fingerprint = md5(repr([(reob.pattern, repl)
+                                     for reob, repl in acronyms])).hexdigest()
+
+        if alts:
+            self.regexp = re.compile(
+                "(%s)|\\b(?:%s)\\b" % (TAG_RE.pattern, "|".join(alts)))
+        else:
+            self.regexp = None
+
+    def _repl(self, matchobj):
+        if matchobj.group(1) is not None:
+            # it's a tag
+            return matchobj.group(1)
+
+        text = matchobj.group(0)
+        repl = self.literals.get(text)
+        if repl is None:
+            for reob, repl in self.regexps:
+                if reob.match(text):
+                    break
+            else:
+                return text
+        return repl.replace("\\1", text)
+
+    def sub(self, text):
+        """
+        Returns text with the acronyms marked up.
+        """
+        if self.regexp is None:
+            return text
+        return self.regexp.sub(self._repl, text)
+
+
+# filename -> (mtime, size, acronyms list, AcronymMatcher)
+_acronyms_cache = {}
+
+
+def get_acronyms(filename):
+    """
+    Returns the (acronyms list, AcronymMatcher) for the acronyms file.
+    They're built once and rebuilt when the file changes.
+
+    :param filename: the acronyms file
+
+    :returns: (acronyms list, AcronymMatcher) or None if the file
+              can't be read
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    cached = _acronyms_cache.get(filename)
+    if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+        return cached[2:]
 
     try:
         fp = open(filename, "r")
     except IOError:
-        return
+        return None
 
     lines = fp.readlines()
     fp.close()
 
-    request.get_data()["acronyms"] = build_acronyms(lines)
+    acronyms = build_acronyms(lines)
+    matcher = AcronymMatcher(acronyms)
+    _acronyms_cache[filename] = (st.st_mtime, st.st_size, acronyms, matcher)
+    return acronyms, matcher
 
 
-TAG_RE = re.compile("<\D.*?>")
-TAG_DIGIT_RE = re.compile("<\d+?>")
+def cb_start(args):
+    request = args["request"]
+    config = request.get_configuration()
+    filename = get_acronym_file(config)
 
+    ret = get_acronyms(filename)
+    if ret is None:
+        return
 
-def cb_story(args):
-    request = args["request"]
-    acrolist = request.get_data()["acronyms"]
-    entry = args["entry"]
+    data = request.get_data()
+    data["acronyms"], data["acronyms_matcher"] = ret
 
-    if entry.get("noacronyms"):
-        return args
 
-    body = entry.get("body", "")
+def cb_story_cache_key(args):
+    # rendered stories are stale if the acronyms file changes
+    key = args["key"]
+    if key is None:
+        return
 
-    tags = {}
+    filename = get_acronym_file(args["request"].get_configuration())
+    try:
+        key.append(os.stat(filename).st_mtime)
+    except OSError:
+        pass
 
-    def matchrepl(matchobj):
-        ret = "<%d>" % len(tags)
-        tags[ret] = matchobj.group(0)
-        return ret
 
-    body = TAG_RE.sub(matchrepl, body)
+def get_expansion_store():
+    """Returns the store expanded bodies are kept in."""
+    return get_store("acronyms", "memory")
 
-    for reob, repl in acrolist:
-        body = reob.sub(repl, body)
 
-    def matchrepl(matchobj):
-        return tags[matchobj.group(0)]
+def cb_story(args):
+    request = args["request"]
+    data = request.get_data()
+    entry = args["entry"]
+
+    if entry.get("noacronyms"):
+        return args
 
-    body = TAG_DIGIT_RE.sub(matchrepl, body)
+    matcher = data.get("acronyms_matcher")
+    if matcher is None:
+        matcher = AcronymMatcher(data["acronyms"])
+        data["acronyms_matcher"] = matcher
+
+    body = entry.get("body", "")
 
-    entry["body"] = body
+    # the same entry is expanded for every page it shows up on, so
+    # expanded bodies are kept keyed by the body and the matcher
+    store = get_expansion_store()
+    if isinstance(body, unicode):
+        key = md5(body.encode("utf-8"))
+    else:
+        key = md5(body)
+    key = "%s-%s" % (matcher.fingerprint, key.hexdigest())
+    expanded = store.get(key)
+    if expanded is None:
+        expanded = matcher.sub(body)
+        store.set(key, expanded)
+
+    entry["body"] = expanded
     return args
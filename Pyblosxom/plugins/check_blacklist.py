@@ -47,14 +47,18 @@ in them::
 The comment_rejected_words property takes a list of strings as a
 value.
 
-.. Note::
+By default, blacklisted words match substrings, too.  So if you
+blacklist the word "word", that'll nix comments with "word" in it as
+well as comments with "crossword" because "word" is a substring of
+"crossword".  To only match whole words, set
+``comment_rejected_words_boundaries`` to True::
 
-   There's a deficiency in the algorithm.  Currently, it will match
-   substrings, too.  So if you blacklist the word "word", that'll nix
-   comments with "word" in it as well as comments with "crossword"
-   because "word" is a substring of "crossword".
+   py["comment_rejected_words_boundaries"] = True
 
-   Pick your blacklisted words carefully or fix the algorithm!
+Matching is case-insensitive.  The word list is compiled into a
+matcher once per process (and again when it changes in
+``config.py``), so long blacklists don't slow down checking
+comments much.
 
 
 .. Note::
@@ -109,26 +113,129 @@ def verify_installation(request):
     return True
 
 
+def is_word_char(c):
+    return c.isalnum() or c == "_"
+
+
+class WordMatcher(object):
+    """
+    Finds any of a list of words in text in a single pass using the
+    Aho-Corasick algorithm.
+    """
+    def __init__(self, words, boundaries=False):
+        """
+        :param words: the words to look for
+        :param boundaries: whether words only match at word boundaries
+        """
+        self.boundaries = boundaries
+
+        # node 0 is the root.  each node has a dict of transitions,
+        # a failure link, and the words that end there.
+        goto = [{}]
+        output = [[]]
+        for word in words:
+            word = word.lower()
+            if not word:
+                continue
+            node = 0
+            for c in word:
+                child = goto[node].get(c)
+                if child is None:
+                    child = len(goto)
+                    goto[node][c] = child
+                    goto.append({})
+                    output.append([])
+                node = child
+            output[node].append(word)
+
+        fail = [0] * len(goto)
+        queue = goto[0].values()
+        while queue:
+            next_queue = []
+            for node in queue:
+                for c, child in goto[node].items():
+                    state = fail[node]
+                    while state and c not in goto[state]:
+                        state = fail[state]
+                    fail[child] = goto[state].get(c, 0)
+                    output[child].extend(output[fail[child]])
+                    next_queue.append(child)
+            queue = next_queue
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def _at_boundaries(self, text, word, end):
+        start = end - len(word)
+        if ((start > 0 and is_word_char(word[0])
+             and is_word_char(text[start - 1]))):
+            return False
+        if ((end < len(text) and is_word_char(word[-1])
+             and is_word_char(text[end]))):
+            return False
+        return True
+
+    def search(self, text):
+        """
+        Returns the first word found in text or None.  text should
+        be lowercase.
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for word in output[node]:
+                if ((not self.boundaries
+                     or self._at_boundaries(text, word, i + 1))):
+                    return word
+        return None
+
+
+# the matcher for this process and the settings it was built from
+_matcher = None
+_matcher_key = None
+
+
+def get_matcher(config):
+    """
+    Returns the WordMatcher for ``comment_rejected_words`` building it
+    if the words or settings changed.
+    """
+    global _matcher, _matcher_key
+
+    key = (tuple(config.get("comment_rejected_words", [])),
+           bool(config.get("comment_rejected_words_boundaries", False)))
+    if key != _matcher_key:
+        _matcher = WordMatcher(key[0], key[1])
+        _matcher_key = key
+    return _matcher
+
+
 def cb_comment_reject(args):
     r = args["request"]
     c = args["comment"]
 
     config = r.get_configuration()
 
-    badwords = config.get("comment_rejected_words", [])
+    if not config.get("comment_rejected_words"):
+        return False
+
+    matcher = get_matcher(config)
     for mem in c.values():
-        mem = mem.lower()
-        for word in badwords:
-            # FIXME - this matches on substrings, too.  should use
-            # word-boundaries.
-            if mem.find(word) != -1:
-                if ((config.get("comment_rejected_words_log", False) and
-                     "logdir" in config)):
-                    fn = os.path.join(config["logdir"], "blacklist.log")
-                    f = open(fn, "a")
-                    f.write("%s: %s %s\n" % (
-                            time.ctime(), c.get("ipaddress", None), word))
-                    f.close()
-                return (True, "Comment rejected: contains blacklisted words.")
+        word = matcher.search(mem.lower())
+        if word is not None:
+            if ((config.get("comment_rejected_words_log", False) and
+                 "logdir" in config)):
+                fn = os.path.join(config["logdir"], "blacklist.log")
+                f = open(fn, "a")
+                f.write("%s: %s %s\n" % (
+                        time.ctime(), c.get("ipaddress", None), word))
+                f.close()
+            return (True, "Comment rejected: contains blacklisted words.")
 
     return False
@@ -27,6 +27,19 @@ the datadir hierarchy.  The filename of the comment is the filename of
 the blog entry, plus the creation time of the comment as a float, plus
 the comment extension.
 
+The parsed comments for each entry are kept in a comment index which
+is stored in the entry cache (see ``cacheDriver``).  Comment files are
+only read again when files in the comment directory are added or
+removed.  If you edit a comment file by hand, remove the cache or
+touch the comment directory.
+
+On pages that don't show comments, ``$num_comments`` is still set
+for each entry.  The counts come from a ``COUNTS.idx`` file the
+plugin keeps in each comment directory, so comment files aren't read
+for these pages.  If files in the comment directory are added or
+removed by something other than the comments plugin, the counts file
+is rebuilt.
+
 Comments now follow the ``blog_encoding`` variable specified in
 ``config.py``.  If you don't include a ``blog_encoding`` variable,
 this will default to utf-8.
@@ -101,6 +114,13 @@ Configuration
       py['comment_smtp_to']     = "joe@joe.com"
       py['comment_mta_cmd']     = "/usr/bin/mail"
 
+   Sending the notification happens while the comment is being
+   posted, so a slow SMTP server or MTA makes posting comments slow.
+   To avoid that, set ``py['mail_spool_dir']`` to a directory.
+   Notifications are written there and delivered by the
+   ``pyblosxom-cmd mailqueue`` command which you can run from cron
+   or keep running with ``--interval``.
+
 3. (optional) Set ``py['comment_ext']`` to the change comment file
    extension.  The default file extension is "cmt".
 
@@ -159,6 +179,19 @@ required):
    Set this to a positive integer and users won't be able to leave
    comments on entries older than x days.
 
+``comment_journal``
+
+   Set this to 1 to append new comments to a journal file per entry
+   (``entryname.cmt.journal``) instead of writing a file per comment.
+   Drafts (see ``comment_draft_ext``) are always written to their own
+   files.  Defaults to 0.
+
+``comment_journal_max_size``
+
+   When a journal gets bigger than this many bytes, its comments are
+   moved into the entry's ``entryname-all.cmt`` file and the journal
+   is removed.  Defaults to 65536.
+
 
 Related files
 =============
@@ -282,11 +315,17 @@ Best to check the core plugins first.
 Compacting comments
 ===================
 
-This plugin always writes each comment to its own file, but as an
+By default, this plugin writes each comment to its own file, but as an
 optimization, it supports files that contain multiple comments.  You
 can use ``compact_comments.sh`` to compact comments into a single file
 per entry.
 
+If you use ``comment_journal``, journals are compacted into the same
+``-all`` files when they get big.  You can also compact all of them
+with::
+
+    pyblosxom-cmd compactcomments
+
 .. only:: text
 
    compact_comments.sh is located in docs/_static/plugins/comments/
@@ -472,16 +511,44 @@ import cPickle
 import os
 import codecs
 import sys
-import subprocess
+import threading
 import traceback
 
 from email.MIMEText import MIMEText
 from xml.sax.saxutils import escape
 from Pyblosxom import tools
+from Pyblosxom import mailqueue
 from Pyblosxom.renderers import blosxom
 from Pyblosxom.tools import pwrap, pwrap_error
 
-LATEST_PICKLE_FILE = 'LATEST.cmt'
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LATEST_PICKLE_FILE = tools.LATEST_COMMENT_FILE
+
+# appended to fn.comment_ext to get the name of an entry's journal
+JOURNAL_SUFFIX = '.journal'
+
+# bump this when the format of the comment index changes
+COMMENT_INDEX_VERSION = 1
+
+# comment directory -> comment index record for this process
+_comment_indexes = {}
+
+# the comment counts file kept in each comment directory
+COUNTS_FILE = 'COUNTS.idx'
+COUNTS_MAGIC = 'PYBLOSXOM-COMMENT-COUNTS 1'
+
+# comment directory -> (directory mtime, counts) for this process
+_comment_counts = {}
+
+# the file comment writers lock in each comment directory
+LOCK_FILE = 'COMMENTS.lock'
+
+# serializes comment writers in this process
+_write_lock = threading.Lock()
 
 
 def cb_start(args):
@@ -587,22 +654,396 @@ def createhtmlmail(html, headers):
     return msg
 
 
-def read_comments(entry, config):
+def read_comments(entry, config, request=None):
     """
     @param: a file entry
     @type: dict
 
+    @param request: the request object.  If this is passed in, the
+        comments come from the comment index rather than from parsing
+        the comment files.
+    @type request: Request
+
     @returns: a list of comment dicts
     """
+    if request is not None:
+        index = get_comment_index(request, entry)
+        return [dict(cmt) for cmt in index['comments']]
+
     filelist = glob.glob(cmt_expr(entry, config))
     comments = []
     for f in filelist:
         comments += read_file(f, config)
+    comments += read_journal(
+        get_journal_filename(get_comment_dir(entry, config), entry['fn'],
+                             config),
+        config)
     comments = [(cmt['cmt_time'], cmt) for cmt in comments]
     comments.sort()
     return [c[1] for c in comments]
 
 
+def make_comment_index(comments):
+    """
+    Builds the comment index for an entry from its comments.
+
+    @param comments: list of comment dicts sorted by cmt_time
+    @type comments: list
+
+    @returns: dict with the number of comments (count), the time of
+        the latest comment (latest) and the comments (comments)
+    """
+    latest = 0
+    if comments:
+        latest = comments[-1]['cmt_time']
+    return {'count': len(comments), 'latest': latest, 'comments': comments}
+
+
+def get_comment_dir(entry, config):
+    """
+    Returns the directory the comments for entry are stored in.
+    """
+    cdir = os.path.join(config['comment_dir'], entry['absolute_path'])
+    return os.path.normpath(cdir)
+
+
+def _comment_dir_stamp(cdir):
+    try:
+        st = os.stat(cdir)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_ino)
+
+
+def _comment_index_settings(config):
+    return (COMMENT_INDEX_VERSION, config['comment_ext'],
+            config.get('comment_nofollow', 0))
+
+
+def _load_comment_record(request, cdir, stamp):
+    """
+    Returns the comment index record for the comment directory if
+    there's one that's fresh for stamp.  Records are kept in memory
+    for this process and in the entry cache keyed by the comment
+    directory.
+    """
+    settings = _comment_index_settings(request.get_configuration())
+
+    def is_fresh(record):
+        return (isinstance(record, dict)
+                and record.get('stamp') == stamp
+                and record.get('settings') == settings)
+
+    record = _comment_indexes.get(cdir)
+    if is_fresh(record):
+        return record
+
+    cache = tools.get_cache(request)
+    try:
+        cache.load(cdir)
+        data = cache.getEntry()
+    except (IOError, OSError, EOFError, ValueError, cPickle.PickleError):
+        data = None
+
+    if isinstance(data, dict):
+        record = data.get('comment_index')
+        if is_fresh(record):
+            _comment_indexes[cdir] = record
+            return record
+
+    return None
+
+
+def _save_comment_record(request, cdir, record):
+    _comment_indexes[cdir] = record
+
+    cache = tools.get_cache(request)
+    try:
+        cache.load(cdir)
+        cache.saveEntry({'comment_index': record})
+    except (IOError, OSError):
+        pass
+
+
+def get_comment_index(request, entry):
+    """
+    Returns the comment index for entry.  The comment files for an
+    entry are only read and parsed when the comment directory has
+    changed since the index was built.
+
+    @param request: the request object
+    @type request: Request
+
+    @param entry: a file entry
+    @type entry: dict
+
+    @returns: the comment index as returned by make_comment_index
+    """
+    config = request.get_configuration()
+    cdir = get_comment_dir(entry, config)
+
+    # stat before reading comments so a comment written while we're
+    # reading makes the index stale rather than losing the comment
+    stamp = _comment_dir_stamp(cdir)
+    if stamp is None:
+        return make_comment_index([])
+
+    record = _load_comment_record(request, cdir, stamp)
+    if record is None:
+        record = {'stamp': stamp,
+                  'settings': _comment_index_settings(config),
+                  'entries': {}}
+
+    index = record['entries'].get(entry['fn'])
+    if index is None:
+        index = make_comment_index(read_comments(entry, config))
+
+        entries = dict(record['entries'])
+        entries[entry['fn']] = index
+        record = dict(record)
+        record['entries'] = entries
+        _save_comment_record(request, cdir, record)
+
+    return index
+
+
+def add_to_comment_index(request, cdir, cfn, stamp, new_comments=None):
+    """
+    Updates the comment index for the comment directory after the
+    comment in cfn was written.
+
+    @param cdir: the comment directory
+    @param cfn: the filename of the new comment or the journal it was
+        appended to
+    @param stamp: the stamp of the comment directory from before
+        the comment was written
+    @param new_comments: the new comments if they've been parsed
+        already
+    """
+    config = request.get_configuration()
+    record = _load_comment_record(request, cdir, stamp)
+    if record is None:
+        # it's stale anyway and will get rebuilt when it's needed
+        return
+
+    entries = dict(record['entries'])
+
+    # the entry fn is worked out the same way build_comment_counts
+    # does it, so entry names with glob characters in them are fine
+    ext = '.' + config['comment_ext']
+    basename = os.path.basename(cfn)
+    fn = None
+    if basename.endswith(ext + JOURNAL_SUFFIX):
+        fn = basename[:-len(ext + JOURNAL_SUFFIX)]
+    elif basename.endswith(ext) and '-' in basename:
+        fn = basename[:-len(ext)].rsplit('-', 1)[0]
+
+    index = entries.get(fn)
+    if index is not None:
+        if new_comments is None:
+            new_comments = read_file(cfn, config)
+        cmts = [(cmt['cmt_time'], cmt)
+                for cmt in index['comments'] + new_comments]
+        cmts.sort()
+        entries[fn] = make_comment_index([c[1] for c in cmts])
+
+    record = dict(record)
+    record['stamp'] = _comment_dir_stamp(cdir)
+    record['entries'] = entries
+    _save_comment_record(request, cdir, record)
+
+
+def _read_counts_file(filename):
+    try:
+        fp = open(filename, 'rb')
+        try:
+            lines = fp.read().split('\n')
+        finally:
+            fp.close()
+    except (IOError, OSError):
+        return None
+
+    if lines[0] != COUNTS_MAGIC:
+        return None
+
+    counts = {}
+    try:
+        for line in lines[1:]:
+            if line:
+                fn, count, latest = line.split('\t')
+                counts[fn] = (int(count), float(latest))
+    except ValueError:
+        return None
+    return counts
+
+
+def _write_counts_file(cdir, counts):
+    """
+    Writes the counts file for the comment directory and returns
+    the directory mtime the counts are fresh for or None if the file
+    couldn't be written.
+
+    The file is written to a temporary file and moved into place, so
+    readers never see a partial file.  Then the mtime of the counts
+    file is set to the mtime of the directory.  When comment files
+    are added or removed, the directory mtime changes and the counts
+    file is stale.
+    """
+    filename = os.path.join(cdir, COUNTS_FILE)
+    tmp = tools.get_temp_filename(filename)
+
+    items = counts.items()
+    items.sort()
+    lines = [COUNTS_MAGIC]
+    for fn, (count, latest) in items:
+        lines.append('%s\t%d\t%r' % (fn, count, latest))
+
+    try:
+        fp = open(tmp, 'wb')
+        try:
+            fp.write('\n'.join(lines) + '\n')
+        finally:
+            fp.close()
+        os.rename(tmp, filename)
+
+        mtime = os.stat(cdir).st_mtime
+        os.utime(filename, (mtime, mtime))
+    except (IOError, OSError), e:
+        tools.get_logger().warning(
+            "couldn't write comment counts file %s: %s" % (filename, e))
+        return None
+    return mtime
+
+
+def _load_comment_counts(cdir, mtime):
+    """
+    Returns the counts for the comment directory if there are counts
+    that are fresh for the directory mtime and None otherwise.
+    """
+    cached = _comment_counts.get(cdir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    filename = os.path.join(cdir, COUNTS_FILE)
+    try:
+        file_mtime = os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+    # os.utime doesn't keep sub-microsecond precision
+    if abs(file_mtime - mtime) > 0.001:
+        return None
+
+    counts = _read_counts_file(filename)
+    if counts is not None:
+        _comment_counts[cdir] = (mtime, counts)
+    return counts
+
+
+def build_comment_counts(request, cdir):
+    """
+    Reads all the comment files in the comment directory and returns
+    a dict of entry fn -> (number of comments, time of the latest
+    comment).
+    """
+    config = request.get_configuration()
+    ext = '.' + config['comment_ext']
+
+    counts = {}
+    for name in os.listdir(cdir):
+        if name.endswith(ext + JOURNAL_SUFFIX):
+            fn = name[:-len(ext + JOURNAL_SUFFIX)]
+            cmts = read_journal(os.path.join(cdir, name), config)
+        elif name.endswith(ext) and '-' in name:
+            fn = name[:-len(ext)].rsplit('-', 1)[0]
+            cmts = read_file(os.path.join(cdir, name), config)
+        else:
+            continue
+
+        for cmt in cmts:
+            count, latest = counts.get(fn, (0, 0))
+            counts[fn] = (count + 1, max(latest, cmt['cmt_time']))
+    return counts
+
+
+def get_comment_counts(request, cdir):
+    """
+    Returns a dict of entry fn -> (number of comments, time of the
+    latest comment) for the entries with comments in the comment
+    directory.
+
+    The counts are kept in a counts file in the comment directory
+    which is updated when comments are written.  The comment files
+    are only read when the counts file is missing or the directory
+    was changed by something other than the comments plugin.
+
+    @param request: the request object
+    @type request: Request
+
+    @param cdir: the comment directory
+    @type cdir: string
+
+    @returns: dict
+    """
+    try:
+        mtime = os.stat(cdir).st_mtime
+    except OSError:
+        return {}
+
+    counts = _load_comment_counts(cdir, mtime)
+    if counts is None:
+        counts = build_comment_counts(request, cdir)
+        new_mtime = _write_counts_file(cdir, counts)
+        if new_mtime is not None:
+            _comment_counts[cdir] = (new_mtime, counts)
+    return counts
+
+
+def get_comment_count(request, entry):
+    """
+    Returns the number of comments for entry without reading any
+    comment files.  See get_comment_counts.
+
+    @param request: the request object
+    @type request: Request
+
+    @param entry: a file entry
+    @type entry: dict
+
+    @returns: int
+    """
+    config = request.get_configuration()
+    counts = get_comment_counts(request, get_comment_dir(entry, config))
+    return counts.get(entry['fn'], (0, 0))[0]
+
+
+def add_to_comment_counts(request, cdir, fn, cmt_time, mtime):
+    """
+    Updates the counts file for the comment directory after a comment
+    was written.
+
+    @param cdir: the comment directory
+    @param fn: the fn of the entry the comment is for or None if the
+        comment is a draft
+    @param cmt_time: the time of the comment
+    @param mtime: the mtime of the comment directory from before the
+        comment was written
+    """
+    counts = _load_comment_counts(cdir, mtime)
+    if counts is None:
+        # it's stale anyway and will get rebuilt when it's needed
+        return
+
+    counts = dict(counts)
+    if fn is not None:
+        count, latest = counts.get(fn, (0, 0))
+        counts[fn] = (count + 1, max(latest, cmt_time))
+
+    new_mtime = _write_counts_file(cdir, counts)
+    if new_mtime is not None:
+        _comment_counts[cdir] = (new_mtime, counts)
+
+
 def cmt_expr(entry, config):
     """
     Return a string containing the regular expression for comment entries
@@ -625,7 +1066,7 @@ def read_file(filename, config):
     """
     Read comment(s) from filename
 
-    @param filename: filename containing comment(s)
+    @param filename: filename containing comment(s) or a file object
     @type filename: string
 
     @param config: the pyblosxom configuration settings
@@ -686,6 +1127,228 @@ def read_file(filename, config):
     return cmts
 
 
+def get_journal_filename(cdir, fn, config):
+    """
+    Returns the filename of the comment journal for the entry with
+    this fn.
+    """
+    return os.path.join(cdir, fn + '.' + config['comment_ext'] +
+                        JOURNAL_SUFFIX)
+
+
+def _lock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _unlock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _lock_comment_dir(cdir):
+    """
+    Locks the comment directory for writing a comment.  Writers in
+    this process are serialized with a lock and writers in other
+    processes with a lock file in the comment directory.
+
+    @returns: the lock file's fd to pass to _unlock_comment_dir
+    """
+    _write_lock.acquire()
+    try:
+        fd = os.open(os.path.join(cdir, LOCK_FILE),
+                     os.O_WRONLY | os.O_CREAT, 0666)
+        try:
+            _lock_file(fd)
+        except:
+            os.close(fd)
+            raise
+    except:
+        _write_lock.release()
+        raise
+    return fd
+
+
+def _unlock_comment_dir(fd):
+    try:
+        _unlock_file(fd)
+        os.close(fd)
+    finally:
+        _write_lock.release()
+
+
+def append_to_journal(filename, data):
+    """
+    Appends a comment to a comment journal.  Each comment is stored
+    as a line with the length of the comment XML followed by the
+    comment XML.
+
+    @param filename: the journal filename
+    @param data: the comment XML as a string
+
+    @returns: the size of the journal after the append
+    """
+    record = "%d\n%s" % (len(data), data)
+    while 1:
+        fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+        try:
+            _lock_file(fd)
+            if os.fstat(fd).st_nlink == 0:
+                # the journal was compacted while we were waiting for
+                # the lock, so try again with a new one
+                continue
+            os.write(fd, record)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+
+def _read_journal_records(data):
+    records = []
+    pos = 0
+    while pos < len(data):
+        end = data.find('\n', pos)
+        if end == -1:
+            break
+        try:
+            length = int(data[pos:end])
+        except ValueError:
+            break
+        record = data[end + 1:end + 1 + length]
+        if len(record) < length:
+            # a partial write
+            break
+        records.append(record)
+        pos = end + 1 + length
+    return records
+
+
+def read_journal(filename, config):
+    """
+    Reads the comments in a comment journal.
+
+    @param filename: the journal filename
+    @type filename: string
+
+    @param config: the pyblosxom configuration settings
+    @type config: dictionary
+
+    @returns: a list of comment dicts
+    """
+    try:
+        f = open(filename, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except IOError:
+        return []
+
+    import cStringIO
+    cmts = []
+    for record in _read_journal_records(data):
+        cmts += read_file(cStringIO.StringIO(record), config)
+    return cmts
+
+
+def compact_journal(cdir, fn, config):
+    """
+    Moves the comments in the journal for the entry with this fn into
+    the entry's fn-all comment file (the same file
+    ``compact_comments.sh`` writes) and removes the journal.
+
+    @param cdir: the comment directory
+    @param fn: the fn of the entry
+    @param config: the pyblosxom configuration settings
+
+    @returns: True if the journal was compacted
+    """
+    filename = get_journal_filename(cdir, fn, config)
+    all_filename = os.path.join(cdir, fn + '-all.' + config['comment_ext'])
+    encoding = config.get('blog_encoding', 'utf-8')
+
+    try:
+        fd = os.open(filename, os.O_RDWR)
+    except OSError:
+        return False
+
+    try:
+        _lock_file(fd)
+        if os.fstat(fd).st_nlink == 0:
+            return False
+
+        data = []
+        while 1:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            data.append(chunk)
+        records = _read_journal_records("".join(data))
+
+        items = []
+        if os.path.exists(all_filename):
+            f = open(all_filename, 'rb')
+            try:
+                old = f.read()
+            finally:
+                f.close()
+            start = old.find('<items>')
+            end = old.rfind('</items>')
+            if start == -1 or end == -1:
+                tools.get_logger().error(
+                    "can't compact journal into %s" % all_filename)
+                return False
+            items.append(old[start + len('<items>'):end].strip('\n'))
+
+        for record in records:
+            # drop the <?xml ...?> line
+            items.append(record.split('\n', 1)[-1].strip('\n'))
+
+        tmp = tools.get_temp_filename(all_filename)
+        f = open(tmp, 'wb')
+        try:
+            f.write('<?xml version="1.0" encoding="%s"?>\n' % encoding)
+            f.write('<items>\n')
+            f.write('\n'.join(items) + '\n')
+            f.write('</items>\n')
+        finally:
+            f.close()
+        os.rename(tmp, all_filename)
+        os.remove(filename)
+        return True
+    finally:
+        os.close(fd)
+
+
+def compact_comments(command, argv):
+    """Command for compacting all the comment journals."""
+    import config
+
+    if not "comment_dir" in config.py:
+        cfg = {"comment_dir": os.path.join(config.py["datadir"], "comments")}
+    else:
+        cfg = {"comment_dir": config.py["comment_dir"]}
+    cfg["comment_ext"] = config.py.get("comment_ext", "cmt")
+    cfg["blog_encoding"] = config.py.get("blog_encoding", "utf-8")
+
+    suffix = '.' + cfg["comment_ext"] + JOURNAL_SUFFIX
+    count = 0
+    for root, dirs, files in os.walk(cfg["comment_dir"]):
+        for name in files:
+            if name.endswith(suffix):
+                if compact_journal(root, name[:-len(suffix)], cfg):
+                    count += 1
+
+    print "Compacted %d comment journals." % count
+    return 0
+
+
+def cb_commandline(args):
+    args["compactcomments"] = (compact_comments,
+                               "compacts the comment journals")
+    return args
+
+
 def write_comment(request, config, data, comment, encoding):
     """
     Write a comment
@@ -709,8 +1372,15 @@ def write_comment(request, config, data, comment, encoding):
     entry = data['entry_list'][0]
     cdir = os.path.join(config['comment_dir'], entry['absolute_path'])
     cdir = os.path.normpath(cdir)
+    new_dir = False
     if not os.path.isdir(cdir):
-        os.makedirs(cdir)
+        try:
+            os.makedirs(cdir)
+            new_dir = True
+        except OSError:
+            # another writer made it first
+            if not os.path.isdir(cdir):
+                raise
 
     cfn = os.path.join(cdir, entry['fn'] + "-" + comment['pubDate'] + "." + config['comment_draft_ext'])
 
@@ -723,38 +1393,85 @@ def write_comment(request, config, data, comment, encoding):
         filedata += make_xml_field(key, comment)
     filedata += "</item>\n"
 
-    try :
-        cfile = codecs.open(cfn, "w", encoding)
-    except IOError:
+    # comments are written and added to the comment index and counts
+    # one at a time.  otherwise two writers could each add their own
+    # comment to the index and counts and lose the other one.
+    try:
+        lock = _lock_comment_dir(cdir)
+    except (IOError, OSError):
         logger = tools.get_logger()
-        logger.error("couldn't open comment file '%s' for writing" % cfn)
+        logger.error("couldn't lock comment directory '%s'" % cdir)
         return "Internal error: Your comment could not be saved."
 
-    cfile.write(filedata)
-    cfile.close()
-
-    # write latest pickle
-    latest = None
-    latest_filename = os.path.join(config['comment_dir'], LATEST_PICKLE_FILE)
     try:
-        latest = open(latest_filename, "w")
-    except IOError:
-        logger = tools.get_logger()
-        logger.error("couldn't open latest comment pickle for writing")
-        return "Couldn't open latest comment pickle for writing."
-    else:
-        mod_time = float(comment['pubDate'])
+        if new_dir:
+            # start counting.  other writers may have written comments
+            # since we made the directory, so we can't assume it's
+            # empty.
+            counts = build_comment_counts(request, cdir)
+            mtime = _write_counts_file(cdir, counts)
+            if mtime is not None:
+                _comment_counts[cdir] = (mtime, counts)
+
+        stamp = _comment_dir_stamp(cdir)
+
+        use_journal = (config.get('comment_journal', False) and
+                       config["comment_ext"] == config["comment_draft_ext"])
+
+        if use_journal:
+            if isinstance(filedata, unicode):
+                filedata = filedata.encode(encoding)
+            cfn = get_journal_filename(cdir, entry['fn'], config)
+            try:
+                size = append_to_journal(cfn, filedata)
+            except (IOError, OSError):
+                logger = tools.get_logger()
+                logger.error("couldn't append to comment journal '%s'" % cfn)
+                return "Internal error: Your comment could not be saved."
 
-    try:
-        cPickle.dump(mod_time, latest)
-        latest.close()
-    except IOError:
-        if latest:
-            latest.close()
+            import cStringIO
+            new_comments = read_file(cStringIO.StringIO(filedata), config)
 
-        logger = tools.get_logger()
-        logger.error("comment may not have been saved to pickle file.")
-        return "Internal error: Your comment may not have been saved."
+            if size > config.get('comment_journal_max_size', 65536):
+                compact_journal(cdir, entry['fn'], config)
+
+            # appending doesn't change the directory mtime which is what
+            # the comment index and counts are checked against
+            try:
+                os.utime(cdir, None)
+            except OSError:
+                pass
+
+        else:
+            new_comments = None
+            try :
+                cfile = codecs.open(cfn, "w", encoding)
+            except IOError:
+                logger = tools.get_logger()
+                logger.error("couldn't open comment file '%s' for writing" %
+                             cfn)
+                return "Internal error: Your comment could not be saved."
+
+            cfile.write(filedata)
+            cfile.close()
+
+        # write latest comment time
+        mod_time = float(comment['pubDate'])
+        try:
+            tools.write_latest_comment_time(config['comment_dir'], mod_time)
+        except (IOError, OSError):
+            logger = tools.get_logger()
+            logger.error("couldn't write latest comment file.")
+            return "Internal error: Your comment may not have been saved."
+
+        if stamp is not None:
+            fn = None
+            if config["comment_ext"] == config["comment_draft_ext"]:
+                fn = entry['fn']
+            add_to_comment_counts(request, cdir, fn, mod_time, stamp[0])
+            add_to_comment_index(request, cdir, cfn, stamp, new_comments)
+    finally:
+        _unlock_comment_dir(lock)
 
     if ((('comment_mta_cmd' in config
           or 'comment_smtp_server' in config)
@@ -788,7 +1505,6 @@ def send_email(config, entry, comment, comment_dir, comment_filename):
     @param comment_filename: file name of current comment
     @type comment_filename: string
     """
-    import smtplib
     # import the formatdate function which is in a different
     # place in Python 2.3 and up.
     try:
@@ -818,11 +1534,19 @@ def send_email(config, entry, comment, comment_dir, comment_filename):
             message.append("Email: %s" % comment['email'])
         if 'link' in comment:
             message.append("URL: %s" % comment['link'])
-        try:
-            host_name = gethostbyaddr(ipaddress)[0]
+        # when mail is spooled, don't hold up the request with a
+        # reverse lookup
+        queue = mailqueue.get_mail_queue(config)
+        host_name = None
+        if queue is None:
+            try:
+                host_name = gethostbyaddr(ipaddress)[0]
+            # FIXME - bare except here--bad!
+            except:
+                pass
+        if host_name:
             message.append("Hostname: %s (%s)" % (host_name, ipaddress))
-        # FIXME - bare except here--bad!
-        except:
+        else:
             message.append("IP: %s" % ipaddress)
         message.append("Entry URL: %s" % curl)
         message.append("Comment location: %s" % comment_filename)
@@ -843,23 +1567,13 @@ def send_email(config, entry, comment, comment_dir, comment_filename):
                     '"comment on %s"' % curl,
                     config['comment_smtp_to']]
 
-            process = subprocess.Popen(
-                argv, stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            process.stdin.write(body)
-            process.stdin.close()
-            process.wait()
-            stdout = process.stdout.read()
-            stderr = process.stderr.read()
-            tools.get_logger().debug('Ran MTA command: ' + ' '.join(argv))
-            tools.get_logger().debug('Received stdout: ' + stdout)
-            tools.get_logger().debug('Received stderr: ' + stderr)
-            # the except clause below will catch this
-            assert stderr == '', stderr
+            if queue is not None:
+                queue.enqueue_mta(argv, body)
+            else:
+                mailqueue.send_mta(argv, body)
 
         else:
             assert 'comment_smtp_server' in config
-            server = smtplib.SMTP(config['comment_smtp_server'])
             mimemsg = MIMEText("\n".join(message).encode("utf-8"), 'plain', 'utf-8')
 
             # set the message headers
@@ -868,11 +1582,16 @@ def send_email(config, entry, comment, comment_dir, comment_filename):
             mimemsg["Date"] = formatdate(float(comment["pubDate"]))
             mimemsg["Subject"] = ("comment on %s" % curl)
 
-            # send the message via smtp
-            server.sendmail(from_addr=email,
-                            to_addrs=config['comment_smtp_to'],
-                            msg=mimemsg.as_string())
-            server.quit()
+            if queue is not None:
+                queue.enqueue_smtp(config['comment_smtp_server'], email,
+                                   config['comment_smtp_to'],
+                                   mimemsg.as_string())
+            else:
+                errors = mailqueue.send_smtp(
+                    config['comment_smtp_server'],
+                    [(email, config['comment_smtp_to'], mimemsg.as_string())])
+                # the except clause below will catch this
+                assert errors == [None], errors[0]
 
     except Exception, e:
         tools.get_logger().error("error sending email: %s" %
@@ -1282,17 +2001,36 @@ def cb_story(args):
     config = request.get_configuration()
     # FIXME - entry is currently broken and doesn't support "in"
     if entry.has_key('absolute_path') and not entry.has_key('nocomments'):
-        entry['comments'] = read_comments(entry, config)
-        entry['num_comments'] = len(entry['comments'])
         if ((len(renderer.get_content()) == 1
              and 'comment-story' in renderer.flavour
              and data['display_comment_default'])):
+            entry['comments'] = read_comments(entry, config, request)
+            entry['num_comments'] = len(entry['comments'])
             template = renderer.flavour.get('comment-story', '')
             args['template'] = args['template'] + template
+        else:
+            # we're not showing comments, so just count them
+            entry['num_comments'] = get_comment_count(request, entry)
 
     return template
 
 
+def cb_story_cache_key(args):
+    """Rendered stories show the number of comments, so they're stale
+    once a comment is written.
+    """
+    key = args["key"]
+    if key is None:
+        return
+
+    config = args["request"].get_configuration()
+    latest = os.path.join(config['comment_dir'], LATEST_PICKLE_FILE)
+    try:
+        key.append(os.stat(latest).st_mtime)
+    except OSError:
+        pass
+
+
 def build_preview_comment(form, entry, config):
     """Build a prevew comment by brute force
 
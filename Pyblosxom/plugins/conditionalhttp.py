@@ -18,6 +18,26 @@ This is done by output-ing cache friendly HTTP header tags like Last-Modified
 and ETag. These values are calculated from the first entry returned by
 ``entry_list``.
 
+Conditional GET requests for the front page, categories, dates, single
+entries, and tags are answered in ``cb_handle`` using the entry index,
+so a ``304 Not Modified`` doesn't cost parsing entries and building
+the entry list.  If you're using the ``pagecache`` plugin, put
+``conditionalhttp`` before it in ``load_plugins``.
+
+The entry index has to be refreshed to tell whether the page changed.
+That's a walk of the datadir and a stat of every entry.  Unless you
+set ``entryindex_interval``, this happens on every conditional
+request.  To answer conditional requests without walking the datadir,
+set ``entryindex_interval`` to the number of seconds a change may take
+to show up, and under CGI set ``entryindex_filename``, too, so
+processes share the index.  For example::
+
+   py["entryindex_interval"] = 60
+   py["entryindex_filename"] = "/path/to/entryindex.pickle"
+
+The latest entry mtime for each page is worked out once per change
+to the entry index, not once per request.
+
 
 Install
 =======
@@ -26,6 +46,43 @@ This plugin comes with Pyblosxom.  To install, do the following:
 
 1. In your ``config.py`` file, add ``Pyblosxom.plugins.conditionalhttp`` to
    the ``load_plugins`` variable.
+
+
+Configuration
+=============
+
+``conditionalhttp_etag``
+
+   Either ``"mtime"`` or ``"hash"``.  Defaults to ``"mtime"``.
+
+   With ``"mtime"``, the ETag is the mtime of the latest entry on the
+   page.  With ``"hash"``, the ETag is a hash of the filenames and
+   mtimes of all the entries on the page, the latest comment time,
+   and a fingerprint of the flavour templates and configuration.  The
+   hash changes when templates change or when entries drop off the
+   page, so it's safe to use with a reverse proxy.
+
+   With ``"hash"``, conditional GET requests that come with an
+   ``If-None-Match`` header are answered in ``cb_prepare`` after the
+   entry list is built, but before rendering.
+
+``conditionalhttp_cache_control``
+
+   The value of the ``Cache-Control`` header for pages that get an
+   ETag.  For example::
+
+      py["conditionalhttp_cache_control"] = "public, max-age=300"
+
+   Defaults to not sending a ``Cache-Control`` header.
+
+``conditionalhttp_vary``
+
+   The value of the ``Vary`` header for pages that get an ETag.  For
+   example::
+
+      py["conditionalhttp_vary"] = "Accept-Encoding"
+
+   Defaults to not sending a ``Vary`` header.
 """
 
 __author__ = "Wari Wahab"
@@ -40,10 +97,16 @@ __registrytags__ = "1.4, 1.5, core"
 
 import time
 import os
-import cPickle
 import calendar
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 from Pyblosxom import tools
+from Pyblosxom.entryindex import get_entry_index
+from Pyblosxom.renderers.blosxom import get_fingerprint, NoSuchFlavourException
 
 
 def verify_installation(request):
@@ -51,6 +114,275 @@ def verify_installation(request):
     return True
 
 
+def get_latest_comment_mtime(config):
+    """Returns the time of the latest comment or -1 if there are no
+    comments.
+    """
+    if 'comment_dir' not in config:
+        return -1
+
+    return tools.get_latest_comment_time(config['comment_dir'])
+
+
+def get_entry_scope(request):
+    """Figures out which entries the page for this request is built
+    from by looking at ``PATH_INFO`` the way
+    ``blosxom_process_path_info`` does.
+
+    :returns: tuple of (path, datestr) where path is either the
+              filename of an entry or a directory ending in os.sep
+              and datestr is the start of the ``%Y%m%d`` date entries
+              must match.  Returns None if this isn't a url we
+              understand.
+    """
+    config = request.get_configuration()
+    data = request.get_data()
+    extensions = data.get("extensions", {}).keys()
+    datadir = config["datadir"]
+
+    path_info = request.get_http().get("PATH_INFO", "")
+    path_info = path_info.strip("/")
+
+    # tag pages can show any entry in the blog
+    trigger = config.get("tags_trigger", "tag")
+    if path_info == trigger or path_info.startswith(trigger + "/"):
+        return (os.path.join(datadir, ""), "")
+
+    new_path, ext = os.path.splitext(path_info)
+    if (new_path == "index" or new_path.endswith("/index")) and ext:
+        path_info = new_path
+
+    absolute_path = os.path.join(datadir, path_info)
+    if absolute_path.endswith("/index"):
+        absolute_path = absolute_path[:-6]
+
+    if os.path.isdir(absolute_path):
+        return (os.path.join(absolute_path, ""), "")
+
+    ext = tools.what_ext(extensions, absolute_path)
+    if not ext:
+        new_path, flav = os.path.splitext(absolute_path)
+        if flav:
+            ext = tools.what_ext(extensions, new_path)
+            absolute_path = new_path
+    if ext:
+        return (absolute_path + "." + ext, "")
+
+    # category followed by a date
+    parts = path_info.split("/")
+    category = []
+    while parts and not (len(parts[0]) == 4 and parts[0].isdigit()):
+        category.append(parts.pop(0))
+
+    root = os.path.join(datadir, *category)
+    if not parts or not os.path.isdir(root):
+        return None
+
+    datestr = parts.pop(0)
+    if parts:
+        month = tools.month2num.get(parts[0], parts[0])
+        if not (len(month) == 2 and month.isdigit()):
+            return None
+        datestr += month
+        parts.pop(0)
+
+        if parts and len(parts[0]) == 2 and parts[0].isdigit():
+            datestr += parts.pop(0)
+
+    if parts and parts[0] == "index":
+        parts.pop(0)
+    if parts:
+        return None
+
+    return (os.path.join(root, ""), datestr)
+
+
+# datadir -> (entry index generation, dict of scope -> mtime of the
+# latest entry in that scope)
+_latest_mtimes = {}
+
+
+def get_latest_entry_mtime(index, scope):
+    """Returns the mtime of the latest entry in the index that's in
+    scope or -1 if there isn't one.  The mtimes are kept until the
+    generation of the index changes.
+
+    :param index: the EntryIndex
+    :param scope: tuple of (path, datestr) as returned by
+                  ``get_entry_scope``
+    """
+    # read the generation before the entries--if the index is
+    # refreshed in between, we cache under the old generation which
+    # won't match again
+    generation = index.generation
+    entries = index.entries
+
+    cached = _latest_mtimes.get(index.datadir)
+    if cached is None or cached[0] != generation:
+        cached = (generation, {})
+        _latest_mtimes[index.datadir] = cached
+    latest = cached[1].get(scope)
+    if latest is not None:
+        return latest
+
+    path, datestr = scope
+    latest = -1
+    for filename, (stamp, mtime) in entries.iteritems():
+        if mtime <= latest:
+            continue
+        if filename != path and not (path.endswith(os.sep) and
+                                     filename.startswith(path)):
+            continue
+        if ((datestr and not time.strftime(
+                    "%Y%m%d", time.localtime(mtime)).startswith(datestr))):
+            continue
+        latest = mtime
+
+    cached[1][scope] = latest
+    return latest
+
+
+def get_latest_mtime(request):
+    """Returns the mtime of the latest entry or comment that shows up
+    on the page for this request or None if we can't tell.
+    """
+    scope = get_entry_scope(request)
+    if scope is None:
+        return None
+
+    latest = get_latest_entry_mtime(get_entry_index(request), scope)
+    if latest == -1:
+        return None
+
+    return max(latest,
+               get_latest_comment_mtime(request.get_configuration()))
+
+
+def get_etag(request, entry_list, mtime):
+    """Returns the ETag for a page showing entry_list.
+
+    With ``conditionalhttp_etag`` set to ``"hash"``, this is a hash
+    of the filenames and mtimes of the entries, mtime, and the
+    fingerprint of the flavour and configuration.  Otherwise it's the
+    mtime.
+    """
+    config = request.get_configuration()
+    if config.get("conditionalhttp_etag", "mtime") != "hash":
+        return '"%s"' % mtime
+
+    data = request.get_data()
+    flavour = data.get("flavour", config.get("default_flavour", "html"))
+    try:
+        templates = data["renderer"].get_flavour(flavour)
+    except (AttributeError, KeyError, NoSuchFlavourException):
+        templates = {}
+
+    digest = md5()
+    digest.update("%s\0%r\0%s\0%s\n" % (flavour, mtime,
+                                          get_fingerprint(templates),
+                                          get_fingerprint(config)))
+    for entry in entry_list:
+        if hasattr(entry, "get_id"):
+            digest.update("%s\0%r\n" % (entry.get_id(), entry["mtime"]))
+    return '"%s"' % digest.hexdigest()
+
+
+def get_etags(http):
+    """Returns the list of ETags in the ``If-None-Match`` header of the
+    request.  Weak ETags are returned without the ``W/`` and the ETags
+    of gzip-compressed responses (see ``tools.gzip_etag``) without the
+    ``-gzip``, so they match the ETag of the uncompressed page.
+    """
+    etags = []
+    for mem in http.get('HTTP_IF_NONE_MATCH', '').split(","):
+        mem = mem.strip()
+        if mem.startswith("W/"):
+            mem = mem[2:]
+        if mem.endswith('-gzip"'):
+            mem = mem[:-6] + '"'
+        elif mem.endswith("-gzip"):
+            mem = mem[:-5]
+        if mem:
+            etags.append(mem)
+    return etags
+
+
+def add_cache_headers(request, add_header):
+    """Adds the configured ``Cache-Control`` and ``Vary`` headers."""
+    config = request.get_configuration()
+    if config.get("conditionalhttp_cache_control"):
+        add_header('Cache-Control', config["conditionalhttp_cache_control"])
+    if config.get("conditionalhttp_vary"):
+        add_header('Vary', config["conditionalhttp_vary"])
+
+
+def is_not_modified(http, mtime, etag=None):
+    """Returns True if the conditional headers of the request say the
+    client has the version of the page as of mtime.  If the request
+    has an ``If-None-Match`` header and etag is given, only the ETag
+    is checked.
+    """
+    etags = get_etags(http)
+    if etag is not None and etags:
+        return (etag in etags or etag.strip('"') in etags or
+                "*" in etags)
+
+    if ('"%s"' % mtime) in etags or ('%s' % mtime) in etags:
+        return True
+
+    modified_since = http.get('HTTP_IF_MODIFIED_SINCE', '')
+    if not modified_since:
+        return False
+
+    try:
+        modified_since = calendar.timegm(
+            time.strptime(modified_since, '%a, %d %b %Y %H:%M:%S GMT'))
+    except ValueError:
+        return False
+    return modified_since >= int(mtime)
+
+
+def cb_handle(args):
+    request = args["request"]
+    http = request.get_http()
+
+    if request.get_data().get("STATIC"):
+        return
+
+    if http.get("REQUEST_METHOD", "GET") not in ("GET", "HEAD"):
+        return
+
+    # hash ETags need the entry list, so those are checked in
+    # cb_prepare
+    hash_etags = (request.get_configuration().get(
+            "conditionalhttp_etag", "mtime") == "hash")
+    if hash_etags and http.get('HTTP_IF_NONE_MATCH'):
+        return
+
+    if ((not http.get('HTTP_IF_NONE_MATCH') and
+         not http.get('HTTP_IF_MODIFIED_SINCE'))):
+        return
+
+    mtime = get_latest_mtime(request)
+    if mtime is None or not is_not_modified(http, mtime):
+        return
+
+    response = request.get_response()
+    response.set_status('304 Not Modified')
+    if not hash_etags:
+        response.add_header('ETag', '"%s"' % mtime)
+    response.add_header('Last-Modified', time.strftime(
+            '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(mtime)))
+    add_cache_headers(request, response.add_header)
+
+    tools.run_callback("logrequest",
+                       {'filename': request.get_configuration().get(
+                            'logfile', ''),
+                        'return_code': '304',
+                        'request': request})
+    return 1
+
+
 def cb_prepare(args):
     request = args["request"]
 
@@ -64,14 +396,7 @@ def cb_prepare(args):
         # FIXME - this should be generalized to a callback for updated
         # things.
         mtime = entry_list[0]['mtime']
-        latest_cmtime = - 1
-        if 'comment_dir' in config:
-            latest_filename = os.path.join(config['comment_dir'], 'LATEST.cmt')
-
-            if os.path.exists(latest_filename):
-                latest = open(latest_filename)
-                latest_cmtime = cPickle.load(latest)
-                latest.close()
+        latest_cmtime = get_latest_comment_mtime(config)
 
         if latest_cmtime > mtime:
             mtime = latest_cmtime
@@ -81,15 +406,13 @@ def cb_prepare(args):
         # ETag: "2bdc4-7b5-3ddb5f0c"
         last_modified = time.strftime(
             '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(mtime))
-        modified_since = http.get('HTTP_IF_MODIFIED_SINCE', '')
-
-        if ((http.get('HTTP_IF_NONE_MATCH', '') == '"%s"' % mtime) or
-             (http.get('HTTP_IF_NONE_MATCH', '') == '%s' % mtime) or
-             (modified_since and calendar.timegm(time.strptime(modified_since,'%a, %d %b %Y %H:%M:%S GMT' )) >= int(mtime))):
+        etag = get_etag(request, entry_list, mtime)
 
+        if is_not_modified(http, mtime, etag):
             renderer.add_header('Status', '304 Not Modified')
-            renderer.add_header('ETag', '"%s"' % mtime)
+            renderer.add_header('ETag', etag)
             renderer.add_header('Last-Modified', '%s' % last_modified)
+            add_cache_headers(request, renderer.add_header)
 
             # whack the content here so that we don't then go render it
             renderer.set_content(None)
@@ -104,5 +427,6 @@ def cb_prepare(args):
 
             return
 
-        renderer.add_header('ETag', '"%s"' % mtime)
+        renderer.add_header('ETag', etag)
         renderer.add_header('Last-Modified', '%s' % last_modified)
+        add_cache_headers(request, renderer.add_header)
@@ -45,6 +45,11 @@ Additionally, you can do this on an entry-by-entry basis by adding a
    #parser markdown
    My main story...
 
+Each thread converts with its own Markdown instance, so this works
+with threaded WSGI servers.
+
+Set ``preformatcache_backend`` to cache the converted HTML.  See the
+documentation for ``preformatcache_backend`` for details.
 """
 
 __author__ = (
@@ -61,11 +66,30 @@ __registrytags__ = "1.5, core"
 PREFORMATTER_ID = "markdown"
 FILENAME_EXTENSIONS = ("markdown", "md", "mkd")
 
+import threading
+
 import markdown
 from Pyblosxom import tools
+from Pyblosxom.cache.preformat import cached_preformat
+
+OUTPUT_FORMAT = "html4"
+EXTENSIONS = ["footnotes", "codehilite"]
+
+# Markdown instances keep state while converting, so each thread gets
+# its own
+_local = threading.local()
 
-md = markdown.Markdown(output_format="html4",
-                       extensions=["footnotes", "codehilite"])
+
+def get_markdown():
+    """Returns the Markdown instance for this thread creating it (and
+    loading the extensions) the first time it's needed.
+    """
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = markdown.Markdown(output_format=OUTPUT_FORMAT,
+                               extensions=EXTENSIONS)
+        _local.md = md
+    return md
 
 
 def verify_installation(args):
@@ -84,10 +108,20 @@ def cb_preformat(args):
         return parse("".join(args["story"]), args["request"])
 
 
+def _parse(story):
+    md = get_markdown()
+    try:
+        return md.convert(story.decode("utf-8")).encode("utf-8")
+    finally:
+        md.reset()
+
+
 def parse(story, request):
-    body = md.convert(story.decode("utf-8")).encode("utf-8")
-    md.reset()
-    return body
+    settings = {"output_format": OUTPUT_FORMAT,
+                "extensions": EXTENSIONS,
+                "markdown": getattr(markdown, "version", "")}
+    return cached_preformat(request.get_configuration(), PREFORMATTER_ID,
+                            settings, story, lambda: _parse(story))
 
 
 def readfile(filename, request):
@@ -0,0 +1,264 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2003-2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+"""
+Summary
+=======
+
+Caches fully rendered pages so that repeated GET requests for the
+same url don't go through file listing and rendering again.
+
+A cached page holds the status, headers, and body of the response.
+It's keyed by the ``PATH_INFO``, the normalized query string, the
+flavour, and the host the request was made for.  Pages are
+invalidated when entries in the datadir are added, changed, or
+removed (tracked by the entry index) or when a comment is written.
+
+Requests that aren't a GET or a HEAD, requests that preview a
+comment, and requests that come with an ``Authorization`` header
+bypass the cache.  Only ``200 OK`` responses that don't set cookies
+are cached.
+
+If ``wsgi_gzip`` is set, the gzip-compressed body is cached along with
+the page so it's only compressed once.
+
+
+Install
+=======
+
+This plugin comes with Pyblosxom.  To install, do the following:
+
+1. Add ``Pyblosxom.plugins.pagecache`` to the ``load_plugins`` list
+   in your ``config.py`` file.
+
+   The page cache handles requests in ``cb_handle``, so put it after
+   plugins that handle requests themselves (``flavourfiles``,
+   ``trackback``, ...) in the ``load_plugins`` list.
+
+2. Configure as documented below.
+
+
+Configuration
+=============
+
+``pagecache_backend``
+
+   Either ``"memory"`` or ``"disk"``.  Defaults to ``"memory"``.
+
+   The memory backend keeps pages for the life of the process and
+   is best for WSGI and FastCGI deployments.  The disk backend keeps
+   pages in ``pagecache_dir`` and is shared between processes, so
+   it's the one to use with CGI.
+
+``pagecache_dir``
+
+   The directory the disk backend stores pages in.  Defaults to
+   datadir + os.pardir + ``pagecache``.
+
+``pagecache_max_entries``
+
+   The maximum number of pages to keep.  When there are more, the
+   least recently used pages are evicted.  Defaults to 500.
+
+``pagecache_ttl``
+
+   The number of seconds a cached page is good for regardless of
+   whether anything changed.  This is useful when you have plugins
+   that show things that change with time.  Defaults to 0 which
+   means pages don't expire.
+
+
+.. Note::
+
+   Changes to flavour templates and ``config.py`` don't invalidate
+   cached pages.  Restart your WSGI process or remove the
+   ``pagecache_dir`` after changing them.
+
+   Detecting datadir changes requires a walk of the datadir on every
+   request.  If that's too slow, set ``entryindex_interval`` to the
+   number of seconds between walks.
+"""
+
+__author__ = "Pyblosxom team"
+__email__ = "pyblosxom-devel at sourceforge dot net"
+__version__ = "2013-09-01"
+__url__ = "http://pyblosxom.github.com/"
+__description__ = "Caches rendered pages."
+__category__ = "cache"
+__license__ = "MIT"
+__registrytags__ = "1.5, core"
+
+
+import cgi
+import os
+import time
+
+from Pyblosxom import tools
+from Pyblosxom.cache.store import get_store
+from Pyblosxom.entryindex import get_entry_index
+
+
+# form fields that mark a request as one that shouldn't be cached
+BYPASS_FIELDS = ("preview", "ajax")
+
+
+def verify_installation(request):
+    config = request.get_configuration()
+    backend = config.get("pagecache_backend", "memory")
+    if backend not in ("memory", "disk"):
+        tools.pwrap_error("pagecache_backend must be 'memory' or 'disk'.")
+        return False
+    return True
+
+
+def get_cache_store(cfg):
+    """Returns the store pages are cached in."""
+    backend = cfg.get("pagecache_backend", "memory")
+    path = None
+    if backend == "disk":
+        path = cfg.get("pagecache_dir",
+                       os.path.join(cfg["datadir"], os.pardir, "pagecache"))
+    return get_store("pagecache", backend, path,
+                     cfg.get("pagecache_max_entries", 500))
+
+
+def get_cache_key(request):
+    """Returns the cache key for this request or None if this request
+    shouldn't be cached.
+    """
+    http = request.get_http()
+    config = request.get_configuration()
+
+    if http.get("REQUEST_METHOD", "GET") not in ("GET", "HEAD"):
+        return None
+
+    if http.get("HTTP_AUTHORIZATION"):
+        return None
+
+    form = request.get_form()
+    for mem in BYPASS_FIELDS:
+        if form.has_key(mem):
+            return None
+
+    query = cgi.parse_qsl(http.get("QUERY_STRING", ""))
+    query.sort()
+    query = "&".join(["%s=%s" % (k, v) for k, v in query])
+
+    flavour = config.get("default_flavour", "html")
+    if form.has_key("flav"):
+        flavour = form["flav"].value
+
+    # base_url is built from the environment if it's not set in
+    # config.py, so the host is part of the key
+    host = "%s://%s%s" % (http.get("wsgi.url_scheme", ""),
+                          http.get("HTTP_HOST", ""),
+                          http.get("SCRIPT_NAME", ""))
+
+    return "\n".join([host, http.get("PATH_INFO", ""), query, flavour])
+
+
+def get_generation(request):
+    """Returns the generation cached pages must match to be fresh.
+
+    This is the entry index generation plus the mtime of the latest
+    comment marker.
+    """
+    config = request.get_configuration()
+    generation = get_entry_index(request).generation
+
+    if "comment_dir" in config:
+        latest = os.path.join(config["comment_dir"],
+                              tools.LATEST_COMMENT_FILE)
+        try:
+            generation = "%s-%r" % (generation, os.stat(latest).st_mtime)
+        except OSError:
+            pass
+
+    return generation
+
+
+def cb_handle(args):
+    request = args["request"]
+    data = request.get_data()
+    config = request.get_configuration()
+
+    # static rendering writes files--there's nothing to gain here
+    if data.get("STATIC"):
+        return
+
+    key = get_cache_key(request)
+    if key is None:
+        return
+
+    generation = get_generation(request)
+    store = get_cache_store(config)
+    page = store.get(key)
+
+    if page is not None:
+        ttl = config.get("pagecache_ttl", 0)
+        if ((page["generation"] == generation and
+             (not ttl or time.time() - page["time"] < ttl))):
+            response = request.get_response()
+            response.set_status(page["status"])
+            for k, v in page["headers"].items():
+                response.add_header(k, v)
+            response.write(page["body"])
+            response.gzip_body = page.get("body_gzip")
+
+            tools.run_callback("logrequest",
+                               {'filename': config.get('logfile', ''),
+                                'return_code': page["status"][:3],
+                                'request': request})
+            return 1
+
+        store.delete(key)
+
+    # remember the key so cb_end can cache the rendered page
+    data["pagecache_key"] = (key, generation)
+
+
+def cb_end(args):
+    request = args["request"]
+    data = request.get_data()
+
+    if not "pagecache_key" in data:
+        return
+    key, generation = data.pop("pagecache_key")
+
+    response = request.get_response()
+    if not response.status.startswith("200"):
+        return
+
+    headers = dict(response.headers)
+    for k in headers.keys():
+        if k.lower() == "set-cookie":
+            return
+
+    pos = response.tell()
+    response.seek(0)
+    body = response.read()
+    response.seek(pos)
+
+    # if the WSGI app compresses responses, keep the compressed body so
+    # it's compressed once per page rather than once per request
+    config = request.get_configuration()
+    body_gzip = None
+    if config.get("wsgi_gzip", False):
+        if response.gzip_body is None:
+            response.gzip_body = tools.gzip_string(
+                body, config.get("wsgi_gzip_level", 6))
+        body_gzip = response.gzip_body
+
+    store = get_cache_store(config)
+    store.set(key, {"generation": generation,
+                    "time": time.time(),
+                    "status": response.status,
+                    "headers": headers,
+                    "body": body,
+                    "body_gzip": body_gzip})
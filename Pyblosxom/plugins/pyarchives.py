@@ -73,8 +73,7 @@ __category__ = "archives"
 __license__ = "MIT"
 __registrytags__ = "1.4, 1.5, core"
 
-from Pyblosxom import tools
-from Pyblosxom.memcache import memcache_decorator
+from Pyblosxom.entryindex import get_archive_index
 from Pyblosxom.tools import pwrap
 import time
 
@@ -94,7 +93,6 @@ class PyblArchives:
         self._request = request
         self._archives = None
 
-    @memcache_decorator('pyarchives', True)
     def __str__(self):
         if self._archives == None:
             self.gen_linear_archive()
@@ -103,31 +101,23 @@ class PyblArchives:
     def gen_linear_archive(self):
         config = self._request.get_configuration()
         data = self._request.get_data()
-        root = config["datadir"]
-        archives = {}
-        archive_list = tools.walk(self._request, root)
+        archive = get_archive_index(self._request)
         full_dict = {}
         full_dict.update(config)
         full_dict.update(data)
 
         template = config.get('archive_template',
                               '<a href="%(base_url)s/%(Y)s/%(b)s">%(Y)s-%(b)s</a><br />')
-        for mem in archive_list:
-            timetuple = tools.filestat(self._request, mem)
-            time_dict = {}
-            for x in ["B", "b", "m", "Y", "y"]:
-                time_dict[x] = time.strftime("%" + x, timetuple)
 
-            full_dict.update(time_dict)
-            if not (time_dict['Y'] + time_dict['m']) in archives:
-                archives[time_dict['Y'] + time_dict['m']] = (template % full_dict)
+        months = list(archive.get_months())
+        months.reverse()
 
-        arc_keys = archives.keys()
-        arc_keys.sort()
-        arc_keys.reverse()
         result = []
-        for key in arc_keys:
-            result.append(archives[key])
+        for year, month in months:
+            timetuple = (year, month, 1, 0, 0, 0, 0, 1, -1)
+            for x in ["B", "b", "m", "Y", "y"]:
+                full_dict[x] = time.strftime("%" + x, timetuple)
+            result.append(template % full_dict)
         self._archives = '\n'.join(result)
 
 
@@ -74,10 +74,9 @@ __registrytags__ = "1.4, 1.5, core"
 
 import time
 import calendar
-import string
 
 from Pyblosxom import tools
-from Pyblosxom.memcache import memcache_decorator
+from Pyblosxom.entryindex import get_archive_index
 
 
 def verify_installation(request):
@@ -96,7 +95,6 @@ class PyblCalendar:
 
         self._entries = {}
 
-    @memcache_decorator('pycalendar', True)
     def __str__(self):
         """
         Returns the on-demand generated string.
@@ -108,8 +106,8 @@ class PyblCalendar:
 
     def generate_calendar(self):
         """
-        Generates the calendar.  We'd like to walk the archives
-        for things that happen in this month and mark the dates
+        Generates the calendar.  We look up the days in this month
+        that have entries in the archive index and mark the dates
         accordingly.  After doing that we pass it to a formatting
         method which turns the thing into HTML.
         """
@@ -117,7 +115,6 @@ class PyblCalendar:
         data = self._request.get_data()
         entry_list = data["entry_list"]
 
-        root = config["datadir"]
         baseurl = config.get("base_url", "")
 
         self._today = time.localtime()
@@ -161,35 +158,18 @@ class PyblCalendar:
                                  int(mon),
                                  int(data.get("pi_da", self._today[2])))
 
-        archive_list = tools.walk(self._request, root)
+        archive = get_archive_index(self._request)
 
-        yearmonth = {}
-
-        for mem in archive_list:
-            timetuple = tools.filestat(self._request, mem)
-
-            # if we already have an entry for this date, we skip to the
-            # next one because we've already done this processing
-            day = str(timetuple[2]).rjust(2)
-            if day in self._entries:
-                continue
-
-            # add an entry for yyyymm so we can figure out next/previous
-            year = str(timetuple[0])
-            dayzfill = string.zfill(timetuple[1], 2)
-            yearmonth[year + dayzfill] = time.strftime("%b", timetuple)
-
-            # if the entry isn't in the year/month we're looking at with
-            # the calendar, then we skip to the next one
-            if timetuple[0:2] != view[0:2]:
-                continue
-
-            # mark the entry because it's one we want to show
-            if config.get("static_monthnumbers"):
-                datepiece = time.strftime("%Y/%m/%d", timetuple)
-            else:
-                datepiece = time.strftime("%Y/%b/%d", timetuple)
-            self._entries[day] = (baseurl + "/" + datepiece, day)
+        # mark the days in the month we're looking at that have entries
+        if config.get("static_monthnumbers"):
+            datefmt = "%Y/%m/%d"
+        else:
+            datefmt = "%Y/%b/%d"
+        for mem in archive.get_days(view[0], view[1]):
+            day = str(mem).rjust(2)
+            timetuple = (view[0], view[1], mem, 0, 0, 0, 0, 1, -1)
+            self._entries[day] = (
+                baseurl + "/" + time.strftime(datefmt, timetuple), day)
 
         # Set the first day of the week (Sunday by default)
         first = config.get('calendar_firstweekday', 6)
@@ -201,45 +181,24 @@ class PyblCalendar:
         # insert the days of the week
         cal.insert(0, calendar.weekheader(2).split())
 
-        # figure out next and previous links by taking the dict of
-        # yyyymm strings we created, turning it into a list, sorting
-        # them, and then finding "today"'s entry.  then the one before
-        # it (index-1) is prev, and the one after (index+1) is next.
-        keys = yearmonth.keys()
-        keys.sort()
-        thismonth = time.strftime("%Y%m", view)
-
-        # do some quick adjustment to make sure we didn't pick a
-        # yearmonth that's outside the yearmonths of the entries we
-        # know about.
-        if thismonth in keys:
-            index = keys.index(thismonth)
-        elif len(keys) == 0 or keys[0] > thismonth:
-            index = 0
-        else:
-            index = len(keys) - 1
-
-        # build the prev link
-        if index == 0 or len(keys) == 0:
-            prev = None
-        else:
-            prev = ("%s/%s/%s" % (baseurl, keys[index - 1][:4],
-                                  yearmonth[keys[index - 1]]),
-                    "&lt;")
-
-        # build the next link
-        if index == len(yearmonth) - 1 or len(keys) == 0:
-            next = None
-        else:
-            next = ("%s/%s/%s" % (baseurl, keys[index + 1][:4],
-                                  yearmonth[keys[index + 1]]),
-                    "&gt;")
+        # figure out next and previous links from the closest months
+        # before and after this one that have entries
+        prev, next = archive.get_adjacent_months(view[0], view[1])
+        if prev is not None:
+            prev = ("%s/%d/%s" % (baseurl, prev[0],
+                                  self._month_abbr(prev)), "&lt;")
+        if next is not None:
+            next = ("%s/%d/%s" % (baseurl, next[0],
+                                  self._month_abbr(next)), "&gt;")
 
         # insert the month name and next/previous links
         cal.insert(0, [prev, time.strftime("%B %Y", view), next])
 
         self._cal = self.format_with_css(cal)
 
+    def _month_abbr(self, yearmonth):
+        return time.strftime("%b", yearmonth + (1, 0, 0, 0, 0, 1, -1))
+
     def _fixlink(self, link):
         if link:
             return "<a href=\"%s\">%s</a>" % (link[0], link[1])
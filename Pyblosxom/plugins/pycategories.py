@@ -16,6 +16,10 @@ and how many entries are in each category.  It generates html with
 this information and stores it in the ``$(categorylinks)`` variable
 which you can use in your head or foot templates.
 
+The counts come from the entry index, so this doesn't cost a walk of
+the datadir of its own.  The html is built once per flavour and is
+rebuilt only when entries are added or removed.
+
 
 Install
 =======
@@ -96,7 +100,7 @@ __registrytags__ = "1.4, 1.5, core"
 
 
 from Pyblosxom import tools
-from Pyblosxom.memcache import memcache_decorator
+from Pyblosxom.entryindex import get_entry_index
 from Pyblosxom.tools import pwrap
 import os
 
@@ -121,123 +125,131 @@ def verify_installation(request):
     return True
 
 
+def build_categories_html(config, counts, flavour):
+    """Builds the category listing.
+
+    :param config: the config.py dict
+    :param counts: dict of category -> number of entries in it and
+                   its subcategories as returned by
+                   ``EntryIndex.get_category_counts``
+    :param flavour: the flavour to link to
+
+    :returns: the html string
+    """
+    start_t = config.get("category_start", DEFAULT_START)
+    begin_t = config.get("category_begin", DEFAULT_BEGIN)
+    item_t = config.get("category_item", DEFAULT_ITEM)
+    end_t = config.get("category_end", DEFAULT_END)
+    finish_t = config.get("category_finish", DEFAULT_FINISH)
+
+    baseurl = config.get("base_url", "")
+
+    # sort the categories alphabetically so that subcategories
+    # follow their parents
+    clist = counts.keys()
+    clist.sort()
+
+    output = []
+    indent = 0
+
+    output.append(start_t)
+    # then we generate each item in the list
+    for item in clist:
+        itemlist = item.split(os.sep)
+
+        if not item:
+            tab = ""
+        else:
+            tab = len(itemlist) * "&nbsp;&nbsp;"
+
+        if itemlist != ['']:
+            if indent > len(itemlist):
+                for i in range(indent - len(itemlist)):
+                    output.append(end_t)
+
+            elif indent < len(itemlist):
+                for i in range(len(itemlist) - indent):
+                    output.append(begin_t)
+
+        # now we build the dict with the values for substitution
+        d = {"base_url": baseurl,
+             "fullcategory": item + "/",
+             "category": itemlist[-1] + "/",
+             "flavour": flavour,
+             "count": counts[item],
+             "indent": tab}
+
+        # this prevents a double / in the root category url
+        if item == "":
+            d["fullcategory"] = item
+
+        # this adds urlencoded versions
+        d["fullcategory_urlencoded"] = (
+            tools.urlencode_text(d["fullcategory"]))
+        d["category_urlencoded"] = tools.urlencode_text(d["category"])
+
+        # and we toss it in the thing
+        output.append(item_t % d)
+
+        if itemlist != ['']:
+            indent = len(itemlist)
+
+    output.append(end_t * indent)
+    output.append(finish_t)
+
+    # then we join the list and that's the final string
+    return "\n".join(output)
+
+
+# the config properties the category listing depends on
+HTML_CONFIG = ("base_url", "category_start", "category_begin",
+               "category_item", "category_end", "category_finish")
+
+# datadir -> {(flavour, generation, config values...) -> html}
+_categories_html = {}
+
+
+def get_categories_html(request):
+    """Returns the category listing for this request.  It's built at
+    most once per flavour and entry index generation for this
+    process.
+    """
+    config = request.get_configuration()
+    index = get_entry_index(request)
+
+    form = request.get_form()
+    if form.has_key('flav'):
+        flavour = form['flav'].value
+    else:
+        flavour = config.get('default_flavour', 'html')
+
+    key = ((flavour, index.generation) +
+           tuple([config.get(mem) for mem in HTML_CONFIG]))
+    cache = _categories_html.setdefault(index.datadir, {})
+    html = cache.get(key)
+    if html is None:
+        html = build_categories_html(
+            config, index.get_category_counts(), flavour)
+        # drop html for old generations
+        for mem in cache.keys():
+            if mem[1] != index.generation:
+                cache.pop(mem, None)
+        cache[key] = html
+    return html
+
+
 class PyblCategories:
     def __init__(self, request):
         self._request = request
         self._categories = None
 
-    @memcache_decorator('pycategories', True)
     def __str__(self):
         if self._categories is None:
             self.gen_categories()
         return self._categories
 
     def gen_categories(self):
-        config = self._request.get_configuration()
-        root = config["datadir"]
-
-        start_t = config.get("category_start", DEFAULT_START)
-        begin_t = config.get("category_begin", DEFAULT_BEGIN)
-        item_t = config.get("category_item", DEFAULT_ITEM)
-        end_t = config.get("category_end", DEFAULT_END)
-        finish_t = config.get("category_finish", DEFAULT_FINISH)
-
-        self._baseurl = config.get("base_url", "")
-
-        form = self._request.get_form()
-
-        if form.has_key('flav'):
-            flavour = form['flav'].value
-        else:
-            flavour = config.get('default_flavour', 'html')
-
-        # build the list of all entries in the datadir
-        elist = tools.walk(self._request, root)
-
-        # peel off the root dir from the list of entries
-        elist = [mem[len(root) + 1:] for mem in elist]
-
-        # go through the list of entries and build a map that
-        # maintains a count of how many entries are in each category
-        elistmap = {}
-        for mem in elist:
-            mem = os.path.dirname(mem)
-            elistmap[mem] = 1 + elistmap.get(mem, 0)
-        self._elistmap = elistmap
-
-        # go through the elistmap keys (which is the list of
-        # categories) and for each piece in the key (i.e. the key
-        # could be "dev/pyblosxom/releases" and the pieces would be
-        # "dev", "pyblosxom", and "releases") we build keys for the
-        # category list map (i.e. "dev", "dev/pyblosxom",
-        # "dev/pyblosxom/releases")
-        clistmap = {}
-        for mem in elistmap.keys():
-            mem = mem.split(os.sep)
-            for index in range(len(mem) + 1):
-                p = os.sep.join(mem[0:index])
-                clistmap[p] = 0
-
-        # then we take the category list from the clistmap and sort it
-        # alphabetically
-        clist = clistmap.keys()
-        clist.sort()
-
-        output = []
-        indent = 0
-
-        output.append(start_t)
-        # then we generate each item in the list
-        for item in clist:
-            itemlist = item.split(os.sep)
-
-            num = 0
-            for key in self._elistmap.keys():
-                if item == '' or key == item or key.startswith(item + os.sep):
-                    num = num + self._elistmap[key]
-
-            if not item:
-                tab = ""
-            else:
-                tab = len(itemlist) * "&nbsp;&nbsp;"
-
-            if itemlist != ['']:
-                if indent > len(itemlist):
-                    for i in range(indent - len(itemlist)):
-                        output.append(end_t)
-
-                elif indent < len(itemlist):
-                    for i in range(len(itemlist) - indent):
-                        output.append(begin_t)
-
-            # now we build the dict with the values for substitution
-            d = {"base_url": self._baseurl,
-                 "fullcategory": item + "/",
-                 "category": itemlist[-1] + "/",
-                 "flavour": flavour,
-                 "count": num,
-                 "indent": tab}
-
-            # this prevents a double / in the root category url
-            if item == "":
-                d["fullcategory"] = item
-
-            # this adds urlencoded versions
-            d["fullcategory_urlencoded"] = (
-                tools.urlencode_text(d["fullcategory"]))
-            d["category_urlencoded"] = tools.urlencode_text(d["category"])
-
-            # and we toss it in the thing
-            output.append(item_t % d)
-
-            if itemlist != ['']:
-                indent = len(itemlist)
-
-        output.append(end_t * indent)
-        output.append(finish_t)
-
-        # then we join the list and that's the final string
-        self._categories = "\n".join(output)
+        self._categories = get_categories_html(self._request)
 
 
 def cb_prepare(args):
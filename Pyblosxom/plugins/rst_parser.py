@@ -66,6 +66,11 @@ control over the rendered HTML::
    py['reST_transform_doctitle'] = 1
 
 
+Converting reST is slow.  Set ``preformatcache_backend`` to cache the
+converted HTML.  See the documentation for ``preformatcache_backend``
+for details.
+
+
 .. Note::
 
    If you're not seeing headings that you think should be there, try
@@ -82,10 +87,11 @@ __license__ = "MIT"
 __registrytags__ = "1.5, core"
 
 
+import docutils
 from docutils.core import publish_parts
 
 from Pyblosxom import tools
-from Pyblosxom.memcache import memcache_decorator
+from Pyblosxom.cache.preformat import cached_preformat
 
 
 PREFORMATTER_ID = 'reST'
@@ -106,7 +112,7 @@ def cb_preformat(args):
     if args.get("parser", None) == PREFORMATTER_ID:
         return parse(''.join(args['story']), args['request'])
 
-@memcache_decorator('rst_parser')
+
 def _parse(initial_header_level, transform_doctitle, story):
     parts = publish_parts(
         story,
@@ -124,7 +130,12 @@ def parse(story, request):
     initial_header_level = config.get('reST_initial_header_level', 1)
     transform_doctitle = config.get('reST_transform_doctitle', 1)
 
-    return _parse(initial_header_level, transform_doctitle, story)
+    settings = {"initial_header_level": initial_header_level,
+                "transform_doctitle": transform_doctitle,
+                "docutils": docutils.__version__}
+    return cached_preformat(
+        config, PREFORMATTER_ID, settings, story,
+        lambda: _parse(initial_header_level, transform_doctitle, story))
 
 
 def readfile(filename, request):
@@ -86,6 +86,11 @@ how tag metadata is formatted, and how tag lists triggered.
     This is the url trigger to indicate that the tags plugin should
     handle the file list based on the tag.  Defaults to ``tag``.
 
+    ``/tag/weather`` lists the entries tagged ``weather``.
+    ``/tag/weather+boston`` lists the entries tagged with both
+    ``weather`` and ``boston``.  ``/tag/weather,boston`` lists the
+    entries tagged with either one.
+
 ``truncate_tags``
 
     If this is True, then tags index listings will get passed through
@@ -201,7 +206,20 @@ configuration property:
 Creating the tags index file
 ============================
 
-Run::
+The tags index is kept up to date as entries are added, changed, and
+removed.  The tags plugin uses the entry index (see
+``entryindex_interval`` and ``entryindex_filename``) to find out
+which entries changed and only parses those entries to update their
+tags.  The first request after installing the plugin builds the
+index from scratch.
+
+The tags index is updated whenever the entry index is refreshed.
+Tag pages refresh it, as do plugins that use the entry index such as
+pagecache, pycategories, and the archive plugins.  Other pages don't,
+so they don't pay for a walk of the datadir, and the tags list they
+show can lag behind until the next refresh.
+
+To rebuild the tags index from scratch, run::
 
     pyblosxom-cmd buildtags
 
@@ -211,17 +229,17 @@ from the directory your ``config.py`` is in or::
 
 from anywhere.
 
-This builds the tags index file that the tags plugin requires to
-generate tags-based bits for the request.
-
-Until you rebuild the tags index file, the entry will not have its
-tags indexed.  Thus you should either rebuild the tags file after writing
-or updating an entry or you should rebuild the tags file as a cron job.
+The index file holds the list of tags with their counts followed by
+the entries for each tag sorted newest first.  Rendering the tags list
+only reads the list of tags and a tag page only reads the entries for
+that tag.  When running as a WSGI application, the index is kept in
+memory and is re-read only when the index file changes.
 
 .. Note::
 
-   If you're using static rendering, you need to build the tags
-   index before you statically render your blog.
+   The process that runs your blog needs to be able to write to the
+   tags index file so it can update it.  If it can't, tags for new
+   entries won't show up until you run ``pyblosxom-cmd buildtags``.
 
 
 Converting from categories to tags
@@ -262,28 +280,13 @@ __registrytags__ = "1.5, core"
 
 
 import os
+import heapq
+import threading
 import cPickle as pickle
 import shutil
 
-from Pyblosxom.memcache import memcache_decorator
-
-
-def savefile(path, tagdata):
-    """Saves tagdata to file at path."""
-    fp = open(path + ".new", "w")
-    pickle.dump(tagdata, fp)
-    fp.close()
-
-    shutil.move(path + ".new", path)
-
-
-@memcache_decorator('tags')
-def loadfile(path):
-    """Loads tagdata from file at path."""
-    fp = open(path, "r")
-    tagdata = pickle.load(fp)
-    fp.close()
-    return tagdata
+from Pyblosxom import tools
+from Pyblosxom.entryindex import EntryIndex, get_entry_index
 
 
 def get_tagsfile(cfg):
@@ -294,6 +297,408 @@ def get_tagsfile(cfg):
     return tagsfile
 
 
+# first line of a tags index file
+TAGS_MAGIC = "PYBLOSXOM-TAGS 2\n"
+
+
+class TagIndex(object):
+    """Index of tags and the entries tagged with them.
+
+    The postings for a tag are a list of (mtime, filename) tuples sorted
+    newest first.  ``generation`` goes up every time the index
+    changes.  ``entry_generation`` is the generation of the entry
+    index the tags index was last brought up to date with.
+
+    The index file is ``TAGS_MAGIC``, the length of the header, the
+    pickled header, and then one pickle for the postings of each tag
+    and one for the files map.  The header holds the count and the
+    offset of the postings of each tag and the entry generation, so
+    listing tags, reading the postings for one tag, or finding out
+    the index is up to date doesn't read the whole file.
+
+    The index file is kept open from the time its header is read, so
+    the offsets always point into the file they came from even if
+    another process replaces it in between.
+
+    Old index files that are a pickled dict of tag to list of
+    filenames are read as well.  They don't have mtimes, so the
+    postings aren't sorted newest first until the index is updated
+    and saved in the new format, which ``cb_start`` does right away.
+
+    TagIndex works like a read-only dict of tag to list of filenames.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        self.stamp = None
+        self.generation = 0
+        self.entry_generation = None
+        self._offsets = {}
+        self._files_offset = None
+        self._data_start = 0
+        self._postings = {}
+        self._files = None
+        self._fp = None
+        self._old_format = False
+        self._lock = threading.RLock()
+
+    def _read_block(self, offset):
+        self._fp.seek(self._data_start + offset[0])
+        return pickle.loads(self._fp.read(offset[1]))
+
+    def _load_postings(self):
+        # reads the postings of all the tags we haven't read, yet,
+        # opening the index file once
+        offsets = [(self._offsets[tag], tag) for tag in self._offsets
+                   if tag not in self._postings]
+        if not offsets:
+            return
+        offsets.sort()
+        for offset, tag in offsets:
+            self._postings[tag] = self._read_block(offset)
+
+    def _set_file(self, fp):
+        if self._fp is not None:
+            self._fp.close()
+        self._fp = fp
+
+    def load(self):
+        """Reads the header of the index file if it changed since we
+        last read it.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                stamp = os.stat(self.path).st_mtime
+            except OSError:
+                stamp = None
+            if stamp == self.stamp:
+                return
+
+            self.generation += 1
+            self.entry_generation = None
+            self.counts = {}
+            self._offsets = {}
+            self._files_offset = None
+            self._postings = {}
+            self._files = {}
+            self._old_format = False
+            self._set_file(None)
+            self.stamp = stamp
+            if stamp is None:
+                return
+
+            try:
+                fp = open(self.path, "rb")
+                # the file may have been replaced since we stat'ed it
+                self.stamp = os.fstat(fp.fileno()).st_mtime
+                try:
+                    if fp.readline() != TAGS_MAGIC:
+                        fp.seek(0)
+                        self._load_old(pickle.load(fp))
+                        fp.close()
+                        return
+                    length = int(fp.readline())
+                    header = pickle.loads(fp.read(length))
+                    self._data_start = fp.tell()
+                except:
+                    fp.close()
+                    raise
+            except (IOError, ValueError, EOFError, pickle.UnpicklingError):
+                tools.get_logger().warning(
+                    "tags: couldn't read tags index %s" % self.path)
+                return
+
+            self._set_file(fp)
+
+            self.counts = header["counts"]
+            self.entry_generation = header.get("entry_generation")
+            self._offsets = header["offsets"]
+            self._files_offset = header["files"]
+            self._files = None
+        finally:
+            self._lock.release()
+
+    def _load_old(self, tagsdata):
+        # tags index files from before the index was incremental don't
+        # have mtimes, so the entries get re-parsed on the next update
+        files = {}
+        for tag, filenames in tagsdata.items():
+            self.counts[tag] = len(filenames)
+            postings = [(0, fn) for fn in filenames]
+            postings.sort()
+            postings.reverse()
+            self._postings[tag] = postings
+            for fn in filenames:
+                files.setdefault(fn, (None, 0, []))[2].append(tag)
+        self._files = files
+        self._old_format = True
+
+    def get_postings(self, tag):
+        """Returns the list of (mtime, filename) tuples for tag sorted
+        newest first.
+        """
+        self._lock.acquire()
+        try:
+            if tag not in self._postings:
+                if tag not in self._offsets:
+                    return []
+                self._postings[tag] = self._read_block(self._offsets[tag])
+            return self._postings[tag]
+        finally:
+            self._lock.release()
+
+    def get_files(self):
+        """Returns the dict of filename to (stamp, mtime, tags) for all
+        the entries in the index.
+        """
+        self._lock.acquire()
+        try:
+            if self._files is None:
+                self._files = {}
+                if self._files_offset is not None:
+                    self._files = self._read_block(self._files_offset)
+            return self._files
+        finally:
+            self._lock.release()
+
+    def update(self, request, entries, entry_generation=None):
+        """Brings the index up to date with entries.  Entries whose
+        stamp differs from the one in the index are parsed for their
+        tags.
+
+        :param request: the Request object
+        :param entries: dict of filename to (stamp, mtime) tuples as
+                        kept by the entry index
+        :param entry_generation: the generation of the entry index
+                                 entries comes from.  If the tags index
+                                 was last updated with this generation,
+                                 it's up to date and the files map
+                                 isn't read.
+
+        :returns: True if the index changed and False otherwise
+        """
+        from Pyblosxom.entries import fileentry
+
+        config = request.get_configuration()
+        datadir = config["datadir"]
+        sep = config.get("tags_separator", ",")
+
+        self._lock.acquire()
+        try:
+            if ((entry_generation is not None
+                 and entry_generation == self.entry_generation
+                 and self._files_offset is not None)):
+                return False
+
+            files = self.get_files()
+            touched = {}
+            dirty = self._files_offset is None
+
+            for fn in files.keys():
+                if fn not in entries:
+                    for tag in files[fn][2]:
+                        touched[tag] = 1
+                    del files[fn]
+                    dirty = True
+
+            for fn, (stamp, mtime) in entries.items():
+                prev = files.get(fn)
+                if prev is not None and prev[0] == stamp:
+                    continue
+
+                try:
+                    entry = fileentry.FileEntry(request, fn, datadir)
+                    tagsline = entry["tags"]
+                except (IOError, OSError):
+                    continue
+
+                tags = []
+                if tagsline:
+                    tags = [t.strip() for t in tagsline.split(sep)]
+                    tags = [t for t in tags if t]
+
+                # entries without tags are recorded, too, so they
+                # aren't parsed again until they change
+                files[fn] = (stamp, mtime, tags)
+                dirty = True
+                for tag in tags:
+                    touched[tag] = 1
+                if prev is not None:
+                    for tag in prev[2]:
+                        touched[tag] = 1
+
+            if entry_generation != self.entry_generation:
+                self.entry_generation = entry_generation
+                dirty = True
+
+            if not dirty:
+                return False
+
+            # load the postings we're keeping before rebuilding the
+            # ones that changed
+            self._load_postings()
+
+            for tag in touched:
+                self._postings[tag] = []
+            for fn, (stamp, mtime, tags) in files.items():
+                for tag in tags:
+                    if tag in touched:
+                        self._postings[tag].append((mtime, fn))
+
+            for tag in touched:
+                postings = self._postings[tag]
+                if not postings:
+                    del self._postings[tag]
+                    self.counts.pop(tag, None)
+                    continue
+                postings.sort()
+                postings.reverse()
+                self.counts[tag] = len(postings)
+
+            # the entries from an old index file have no stamp, so
+            # they've all been parsed and every tag has been rebuilt
+            self._old_format = False
+            self.generation += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """Writes the index to a temporary file and moves it into
+        place.
+        """
+        self._lock.acquire()
+        try:
+            files = self.get_files()
+            self._load_postings()
+
+            blocks = []
+            offsets = {}
+            pos = 0
+            for tag in self.counts:
+                block = pickle.dumps(self._postings[tag],
+                                     pickle.HIGHEST_PROTOCOL)
+                offsets[tag] = (pos, len(block))
+                pos += len(block)
+                blocks.append(block)
+
+            block = pickle.dumps(files, pickle.HIGHEST_PROTOCOL)
+            files_offset = (pos, len(block))
+            blocks.append(block)
+
+            # offsets are relative to the end of the header
+            header = pickle.dumps({"counts": self.counts,
+                                   "offsets": offsets,
+                                   "files": files_offset,
+                                   "entry_generation":
+                                       self.entry_generation},
+                                  pickle.HIGHEST_PROTOCOL)
+
+            tmp = tools.get_temp_filename(self.path)
+            fp = open(tmp, "wb")
+            try:
+                fp.write(TAGS_MAGIC)
+                fp.write("%d\n" % len(header))
+                fp.write(header)
+                for block in blocks:
+                    fp.write(block)
+            finally:
+                fp.close()
+
+            # we read the blocks from the file we wrote, not whatever
+            # is at self.path by the time we read them
+            fp = open(tmp, "rb")
+            try:
+                shutil.move(tmp, self.path)
+            except:
+                fp.close()
+                raise
+            self._set_file(fp)
+
+            self._data_start = (len(TAGS_MAGIC) + len("%d\n" % len(header)) +
+                                len(header))
+            self._offsets = offsets
+            self._files_offset = files_offset
+            self.stamp = os.fstat(fp.fileno()).st_mtime
+        finally:
+            self._lock.release()
+
+    def has_mtimes(self):
+        """Returns False if the index came from an old index file and
+        hasn't been updated, so the postings aren't sorted by mtime.
+        """
+        return not self._old_format
+
+    def keys(self):
+        return self.counts.keys()
+
+    def __contains__(self, tag):
+        return tag in self.counts
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __getitem__(self, tag):
+        if tag not in self.counts:
+            raise KeyError(tag)
+        return [fn for mtime, fn in self.get_postings(tag)]
+
+    def get(self, tag, default=None):
+        if tag not in self.counts:
+            return default
+        return self[tag]
+
+    def items(self):
+        return [(tag, self[tag]) for tag in self.counts]
+
+
+# this holds the TagIndex instances for this process keyed by path.
+_tag_indexes = {}
+
+_tag_indexes_lock = threading.Lock()
+
+
+def get_tag_index(request):
+    """Returns the TagIndex for this blog.  The index is kept in memory
+    for the life of the process and re-read when the index file
+    changes.
+    """
+    path = get_tagsfile(request.get_configuration())
+
+    _tag_indexes_lock.acquire()
+    try:
+        index = _tag_indexes.get(path)
+        if index is None:
+            index = TagIndex(path)
+            _tag_indexes[path] = index
+    finally:
+        _tag_indexes_lock.release()
+
+    index.load()
+    return index
+
+
+def update_tag_index(request, entry_index):
+    """Updates the tags index with the entries in entry_index and saves
+    it if it changed.
+    """
+    index = get_tag_index(request)
+    if not index.update(request, entry_index.entries,
+                        entry_index.generation):
+        return
+    try:
+        index.save()
+    except (IOError, OSError), e:
+        tools.get_logger().warning(
+            "tags: couldn't save tags index %s: %s" % (index.path, e))
+
+
 def buildtags(command, argv):
     """Command for building the tags index."""
     import config
@@ -302,12 +707,9 @@ def buildtags(command, argv):
     if not datadir:
         raise ValueError("config.py has no datadir property.")
 
-    sep = config.py.get("tags_separator", ",")
     tagsfile = get_tagsfile(config.py)
 
     from Pyblosxom.pyblosxom import Pyblosxom
-    from Pyblosxom import tools
-    from Pyblosxom.entries import fileentry
 
     # build a Pyblosxom object, initialize it, and run the start
     # callback.  this gives entry parsing related plugins a chance to
@@ -317,20 +719,14 @@ def buildtags(command, argv):
     req = p.get_request()
     tools.run_callback("start", {"request": req})
 
-    # grab all the entries in the datadir
-    filelist = tools.walk(req, datadir)
-    entrylist = [fileentry.FileEntry(req, e, datadir) for e in filelist]
+    # grab all the entries in the datadir and rebuild the index from
+    # scratch
+    entry_index = EntryIndex(datadir)
+    entry_index.scan(req)
 
-    tags_to_files = {}
-    for mem in entrylist:
-        tagsline = mem["tags"]
-        if not tagsline:
-            continue
-        tagsline = [t.strip() for t in tagsline.split(sep)]
-        for t in tagsline:
-            tags_to_files.setdefault(t, []).append(mem["filename"])
-
-    savefile(tagsfile, tags_to_files)
+    index = TagIndex(tagsfile)
+    index.update(req, entry_index.entries, entry_index.generation)
+    index.save()
     return 0
 
 
@@ -406,20 +802,137 @@ def cb_commandline(args):
 def cb_start(args):
     request = args["request"]
     data = request.get_data()
-    tagsfile = get_tagsfile(request.get_configuration())
-    if os.path.exists(tagsfile):
-        try:
-            tagsdata = loadfile(tagsfile)
-        except IOError:
-            tagsdata = {}
-    else:
-        tagsdata = {}
-    data["tagsdata"] = tagsdata
+
+    # the tags index is updated in cb_entryindex_update whenever
+    # something refreshes the entry index.  we only refresh it here
+    # if there's no tags index, yet, or it's in the old format
+    # without mtimes, so pages that don't need the entry index don't
+    # pay for a walk of the datadir.
+    index = get_tag_index(request)
+    if index.stamp is None or not index.has_mtimes():
+        update_tag_index(request, get_entry_index(request))
+
+    data["tagsdata"] = index
+
+
+def cb_entryindex_update(args):
+    update_tag_index(args["request"], args["index"])
+
+
+def get_tag_counts(tagsdata):
+    """Returns a dict of tag to the number of entries with that tag."""
+    if isinstance(tagsdata, TagIndex):
+        return tagsdata.counts
+    return dict([(tag, len(files)) for tag, files in tagsdata.items()])
+
+
+def intersect_postings(lists, limit=0):
+    """Returns the postings that are in all of the lists.
+
+    :param lists: lists of (mtime, filename) tuples sorted newest first
+    :param limit: stop after this many postings; 0 means no limit
+
+    :returns: list of (mtime, filename) tuples sorted newest first
+    """
+    if not lists:
+        return []
+
+    lists = sorted(lists, key=len)
+    positions = [0] * len(lists)
+    result = []
+    for posting in lists[0]:
+        for i in range(1, len(lists)):
+            other = lists[i]
+            pos = positions[i]
+            # skip the postings that are newer than this one
+            while pos < len(other) and other[pos] > posting:
+                pos += 1
+            positions[i] = pos
+            if pos == len(other) or other[pos] != posting:
+                break
+        else:
+            result.append(posting)
+            if limit and len(result) >= limit:
+                break
+    return result
+
+
+def union_postings(lists, limit=0):
+    """Returns the postings that are in any of the lists.
+
+    :param lists: lists of (mtime, filename) tuples sorted newest first
+    :param limit: stop after this many postings; 0 means no limit
+
+    :returns: list of (mtime, filename) tuples sorted newest first
+    """
+    heap = []
+    for i, mem in enumerate(lists):
+        if mem:
+            heap.append(((-mem[0][0], mem[0][1]), i, 0))
+    heapq.heapify(heap)
+
+    result = []
+    seen = {}
+    while heap:
+        (negmtime, filename), i, pos = heapq.heappop(heap)
+        if filename not in seen:
+            seen[filename] = 1
+            result.append((-negmtime, filename))
+            if limit and len(result) >= limit:
+                break
+        pos += 1
+        if pos < len(lists[i]):
+            posting = lists[i][pos]
+            heapq.heappush(heap, ((-posting[0], posting[1]), i, pos))
+    return result
+
+
+def parse_tag_query(tagsdata, query):
+    """Parses a tag query into a list of groups of tags.  Entries must
+    have all the tags of at least one group to match.
+
+    ``a+b`` matches entries that have both tags ``a`` and ``b``.
+    ``a,b`` matches entries that have tag ``a`` or tag ``b``.  ``+``
+    binds tighter than ``,``.  If query is itself a tag, then it's not
+    split.
+
+    :returns: list of lists of tags or None if none of the tags exist
+    """
+    if query in tagsdata:
+        return [[query]]
+
+    groups = []
+    found = False
+    for mem in query.split(","):
+        if mem in tagsdata:
+            group = [mem]
+        else:
+            group = [t for t in mem.split("+") if t]
+        if not group:
+            continue
+        for tag in group:
+            if tag in tagsdata:
+                found = True
+        groups.append(group)
+
+    if not found:
+        return None
+    return groups
+
+
+def get_postings(tagsdata, tag):
+    """Returns the list of (mtime, filename) postings for tag."""
+    if isinstance(tagsdata, TagIndex):
+        return tagsdata.get_postings(tag)
+    postings = [(0, fn) for fn in tagsdata.get(tag, [])]
+    postings.sort()
+    postings.reverse()
+    return postings
 
 
 def cb_filelist(args):
     from Pyblosxom.blosxom import blosxom_truncate_list_handler
-    from Pyblosxom import tools
+    from Pyblosxom import plugin_utils
 
     # handles /trigger/tag to show all the entries tagged that
     # way
@@ -433,20 +946,52 @@ def cb_filelist(args):
     if not pyhttp["PATH_INFO"].startswith(trigger):
         return
 
+    # tag pages list the entries with the tags, so we make sure the
+    # tags index is up to date.  refreshing the entry index updates
+    # it in cb_entryindex_update if entries changed.
+    get_entry_index(req)
+
     datadir = config["datadir"]
-    tagsfile = get_tagsfile(config)
-    tagsdata = loadfile(tagsfile)
-
-    tag = pyhttp["PATH_INFO"][len(trigger) + 1:]
-    filelist = tagsdata.get(tag, [])
-    if not filelist:
-        tag, ext = os.path.splitext(tag)
-        filelist = tagsdata.get(tag, [])
-        if filelist:
+    tagsdata = data.get("tagsdata")
+    if tagsdata is None:
+        tagsdata = get_tag_index(req)
+
+    data["truncate"] = config.get("truncate_tags", True)
+
+    query = pyhttp["PATH_INFO"][len(trigger) + 1:]
+    groups = parse_tag_query(tagsdata, query)
+
+    # if some of the tags don't exist, the query might end with a
+    # flavour
+    query, ext = os.path.splitext(query)
+    if ext and (groups is None or
+                [t for g in groups for t in g if t not in tagsdata]):
+        flavour_groups = parse_tag_query(tagsdata, query)
+        if flavour_groups is not None:
+            groups = flavour_groups
             data["flavour"] = ext[1:]
 
+    # if nothing else truncates the list, we only need the first
+    # num_entries entries, so we stop merging once we have them.
+    # postings that don't come from a TagIndex with mtimes aren't
+    # sorted by mtime, so we can't do that for those.
+    limit = 0
+    if ((data["truncate"] and isinstance(tagsdata, TagIndex)
+         and tagsdata.has_mtimes()
+         and not plugin_utils.get_callback_chain("truncatelist",
+                                                 load=False))):
+        limit = config.get("num_entries", 5)
+
+    postings = []
+    if groups:
+        postings = union_postings(
+            [intersect_postings([get_postings(tagsdata, tag)
+                                 for tag in group], limit)
+             for group in groups], limit)
+
     from Pyblosxom.entries import fileentry
-    entrylist = [fileentry.FileEntry(req, e, datadir) for e in filelist]
+    entrylist = [fileentry.FileEntry(req, fn, datadir)
+                 for mtime, fn in postings]
 
     # sort the list by mtime
     entrylist = [(e._mtime, e) for e in entrylist]
@@ -454,8 +999,6 @@ def cb_filelist(args):
     entrylist.reverse()
     entrylist = [e[1] for e in entrylist]
 
-    data["truncate"] = config.get("truncate_tags", True)
-
     args = {"request": req, "entry_list": entrylist}
     entrylist = tools.run_callback("truncatelist",
                                    args,
@@ -503,16 +1046,25 @@ def cb_story(args):
     return args
 
 
-def cb_head(args):
-    # adds a taglist to header/footer
-    request = args["request"]
-    entry = args["entry"]
-    data = request.get_data()
-    config = request.get_configuration()
-    tagsdata = data.get("tagsdata", {})
+# the count the tag cloud size classes start at.  tags with this
+# many entries or fewer are "smallestTag" and the range from here to
+# the count of the most popular tag is split into the other classes.
+# it's a constant rather than the smallest count so the classes don't
+# shift around as tags are added.
+TAG_CLOUD_MIN_COUNT = 2
+
+
+def build_tags_html(config, counts, flavour):
+    """Builds the tags list and the tag cloud.
 
+    :param config: the config.py dict
+    :param counts: dict of tag to number of entries with that tag
+    :param flavour: the flavour being rendered
+
+    :returns: tuple of (tagslist, tagcloud) strings
+    """
     # first, build the tags list
-    tags = tagsdata.keys()
+    tags = counts.keys()
     tags.sort()
 
     start_t = config.get("tags_list_start", '<p>')
@@ -521,11 +1073,6 @@ def cb_head(args):
 
     output = []
 
-    form = request.get_form()
-    try:
-        flavour = form["flav"].value
-    except KeyError:
-        flavour = config.get("default_flavour", "html")
     baseurl = config.get("base_url", "")
     trigger = config.get("tags_trigger", "tag")
 
@@ -534,16 +1081,14 @@ def cb_head(args):
         d = {"base_url": baseurl,
              "flavour": flavour,
              "tag": item,
-             "count": len(tagsdata[item]),
+             "count": counts[item],
              "tagurl": "/".join([baseurl, trigger, item])}
         output.append(item_t % d)
     output.append(finish_t)
 
-    entry["tagslist"] = "\n".join(output)
+    tagslist = "\n".join(output)
 
     # second, build the tags cloud
-    tags_by_file = tagsdata.items()
-
     start_t = config.get("tags_cloud_start", "<p>")
     item_t = config.get("tags_cloud_item",
                         '<a class="%(class)s" href="%(tagurl)s">%(tag)s</a>')
@@ -551,12 +1096,10 @@ def cb_head(args):
 
     tagcloud = [start_t]
 
-    if len(tags_by_file) > 0:
-        tags_by_file.sort(key=lambda x: len(x[1]))
-        # the most popular tag is at the end--grab the number of files
-        # that have that tag
-        max_count = len(tags_by_file[-1][1])
-        min_count = len(tags_by_file[0])
+    if len(tags) > 0:
+        # grab the number of files that have the most popular tag
+        max_count = max(counts.values())
+        min_count = TAG_CLOUD_MIN_COUNT
 
         # figure out the bin size for the tag size classes
         b = (max_count - min_count) / 5
@@ -569,11 +1112,9 @@ def cb_head(args):
             (0, "smallestTag")
             )
 
-        # sorts it alphabetically
-        tags_by_file.sort()
-
-        for tag, files in tags_by_file:
-            len_files = len(files)
+        # tags is sorted alphabetically
+        for tag in tags:
+            len_files = counts[tag]
             for tag_range, tag_size_class in range_and_class:
                 if len_files > tag_range:
                     tag_class = tag_size_class
@@ -583,14 +1124,69 @@ def cb_head(args):
                  "flavour": flavour,
                  "class": tag_class,
                  "tag": tag,
-                 "count": len(tagsdata[tag]),
+                 "count": len_files,
                  "tagurl": "/".join([baseurl, trigger, tag])}
 
             tagcloud.append(item_t % d)
 
     tagcloud.append(finish_t)
-    entry["tagcloud"] = "\n".join(tagcloud)
 
+    return tagslist, "\n".join(tagcloud)
+
+
+# config properties that change the tags list and cloud
+HTML_CONFIG = ("base_url", "tags_trigger",
+               "tags_list_start", "tags_list_item", "tags_list_finish",
+               "tags_cloud_start", "tags_cloud_item", "tags_cloud_finish")
+
+# this holds the tags list and cloud for this process keyed by tags
+# index path and then by flavour, generation, and config
+_tags_html = {}
+
+
+def get_tags_html(request):
+    """Returns the tags list and cloud for this request.  They're
+    built at most once per request and, if ``tagsdata`` is a TagIndex,
+    once per flavour and tags index generation for this process.
+
+    :returns: tuple of (tagslist, tagcloud) strings
+    """
+    data = request.get_data()
+    if "tags_html" in data:
+        return data["tags_html"]
+
+    config = request.get_configuration()
+    tagsdata = data.get("tagsdata", {})
+
+    form = request.get_form()
+    try:
+        flavour = form["flav"].value
+    except KeyError:
+        flavour = config.get("default_flavour", "html")
+
+    if isinstance(tagsdata, TagIndex):
+        key = ((flavour, tagsdata.generation) +
+               tuple([config.get(mem) for mem in HTML_CONFIG]))
+        cache = _tags_html.setdefault(tagsdata.path, {})
+        html = cache.get(key)
+        if html is None:
+            html = build_tags_html(config, tagsdata.counts, flavour)
+            # drop html for old generations
+            for mem in cache.keys():
+                if mem[1] != tagsdata.generation:
+                    cache.pop(mem, None)
+            cache[key] = html
+    else:
+        html = build_tags_html(config, get_tag_counts(tagsdata), flavour)
+
+    data["tags_html"] = html
+    return html
+
+
+def cb_head(args):
+    # adds a taglist to header/footer
+    entry = args["entry"]
+    entry["tagslist"], entry["tagcloud"] = get_tags_html(args["request"])
     return args
 
 
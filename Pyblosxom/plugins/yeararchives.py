@@ -64,8 +64,13 @@ The vars available with typical example values are::
 
     Y      4-digit year   ex: '1978'
     y      2-digit year   ex: '78'
+    m      2-digit month  ex: '09'
+    d      2-digit day    ex: '13'
     f      the flavour    ex: 'html'
 
+``m`` and ``d`` are the month and day of the newest entry in the
+year.
+
 .. Note::
 
    The ``archive_template`` variable value is formatted using Python
@@ -83,8 +88,8 @@ __license__ = "MIT"
 __registrytags__ = "1.4, 1.5, core"
 
 
-from Pyblosxom import tools, entries
-from Pyblosxom.memcache import memcache_decorator
+from Pyblosxom import entries
+from Pyblosxom.entryindex import get_archive_index
 from Pyblosxom.tools import pwrap
 import time
 
@@ -104,9 +109,7 @@ class YearArchives:
     def __init__(self, request):
         self._request = request
         self._archives = None
-        self._items = None
 
-    @memcache_decorator('yeararchives', True)
     def __str__(self):
         if self._archives is None:
             self.gen_linear_archive()
@@ -115,11 +118,7 @@ class YearArchives:
     def gen_linear_archive(self):
         config = self._request.get_configuration()
         data = self._request.get_data()
-        root = config["datadir"]
-
-        archives = {}
-        archive_list = tools.walk(self._request, root)
-        items = []
+        archive = get_archive_index(self._request)
 
         fulldict = {}
         fulldict.update(config)
@@ -132,34 +131,19 @@ class YearArchives:
             'archive_template',
             '<a href="%(base_url)s/%(Y)s/index.%(f)s">%(Y)s</a><br />')
 
-        for mem in archive_list:
-            timetuple = tools.filestat(self._request, mem)
-
-            timedict = {}
-            for x in ["m", "Y", "y", "d"]:
-                timedict[x] = time.strftime("%" + x, timetuple)
-
-            fulldict.update(timedict)
-            fulldict["f"] = flavour
-            year = fulldict["Y"]
-
-            if not year in archives:
-                archives[year] = template % fulldict
-            items.append(
-                ["%(Y)s-%(m)s" % fulldict,
-                 "%(Y)s-%(m)s-%(d)s" % fulldict,
-                 time.mktime(timetuple),
-                 mem])
-
-        arc_keys = archives.keys()
-        arc_keys.sort()
-        arc_keys.reverse()
+        years = list(archive.get_years())
+        years.reverse()
 
         result = []
-        for key in arc_keys:
-            result.append(archives[key])
+        for year in years:
+            month, day = archive.get_last_day(year)
+            fulldict["Y"] = "%04d" % year
+            fulldict["y"] = "%02d" % (year % 100)
+            fulldict["m"] = "%02d" % month
+            fulldict["d"] = "%02d" % day
+            fulldict["f"] = flavour
+            result.append(template % fulldict)
         self._archives = '\n'.join(result)
-        self._items = items
 
 
 def new_entry(request, yearmonth, body):
@@ -254,16 +238,15 @@ def cb_filelist(args):
 
     data[INIT_KEY] = 1
 
-    # get all the entries
-    wa = YearArchives(request)
-    wa.gen_linear_archive()
-    items = wa._items
-
-    # peel off the items for this year
-    items = [m for m in items if m[0].startswith(year)]
-
-    items.sort()
-    items.reverse()
+    # get the entries for this year newest first
+    archive = get_archive_index(request)
+    items = []
+    for mtime, filename in archive.get_entries(int(year)):
+        timetuple = time.localtime(mtime)
+        items.append([time.strftime("%Y-%m", timetuple),
+                      time.strftime("%Y-%m-%d", timetuple),
+                      mtime,
+                      filename])
 
     # Set and use current (or default) flavour for permalinks
     if not flavour:
@@ -19,6 +19,7 @@ import cgi
 import locale
 import os
 import sys
+import threading
 import time
 from Pyblosxom.blosxom import blosxom_entry_parser, blosxom_handler
 
@@ -37,6 +38,105 @@ from Pyblosxom import plugin_utils
 VERSION = __version__
 
 
+# the locale set from config.py and the lock for setting it.  the
+# locale is process-wide, so it's set once rather than for every
+# request.
+_locale = None
+_locale_lock = threading.Lock()
+
+
+def set_locale(name):
+    """Sets the locale for the process to name unless it's already
+    set to it.  Fails silently if the locale isn't available.
+
+    :param name: the locale name, e.g. ``"de_DE.UTF-8"``
+    """
+    global _locale
+    if name == _locale:
+        return
+
+    _locale_lock.acquire()
+    try:
+        if name != _locale:
+            try:
+                locale.setlocale(locale.LC_ALL, name)
+            except locale.Error:
+                # invalid locale
+                pass
+            _locale = name
+    finally:
+        _locale_lock.release()
+
+
+def prepare_config(config):
+    """Does the part of initialization that's the same for every
+    request with this config: sets the locale, takes the trailing
+    slash off ``base_url`` and ``datadir``, and imports and
+    initializes the plugins.
+
+    This only changes config the first time it's called, so a
+    prepared config can be shared by requests.
+
+    :param config: the config.py dict
+
+    :returns: config
+    """
+    # initialize the locale, if wanted (will silently fail if locale
+    # is not available)
+    if config.get('locale', None):
+        set_locale(config['locale'])
+
+    # take off the trailing slash for base_url
+    base_url = config.get('base_url')
+    if base_url and base_url.endswith("/"):
+        config['base_url'] = base_url[:-1]
+
+    data_dir = config["datadir"]
+    if data_dir.endswith("/") or data_dir.endswith("\\"):
+        config['datadir'] = data_dir[:-1]
+
+    # import and initialize plugins
+    plugin_utils.initialize_plugins(config.get("plugin_dirs", []),
+                                    config.get("load_plugins", None),
+                                    config.get("plugin_snapshot_filename"),
+                                    config.get("lazy_load_plugins", False),
+                                    config.get("config_filename"))
+    return config
+
+
+# (entryparser callback chain, extension -> parser dict) from the last
+# run of the entryparser callback
+_entryparsers = (None, None)
+
+
+def get_entryparsers():
+    """Returns a dict of file extension -> entry parser function built
+    by the entryparser callback.
+
+    The callback is only run again when the entryparser callback
+    chain changes.  If the plugins were loaded from a startup
+    snapshot, the dict comes from the snapshot.
+    """
+    global _entryparsers
+    # (without importing lazily loaded plugins--the snapshot has
+    # their entryparsers)
+    chain = tuple(plugin_utils.get_callback_chain("entryparser",
+                                                  load=False))
+    cached_chain, extensions = _entryparsers
+    if chain != cached_chain:
+        extensions = plugin_utils.get_snapshot_entryparsers()
+        if extensions is None:
+            extensions = tools.run_callback("entryparser",
+                                            {'txt': blosxom_entry_parser},
+                                            mappingfunc=lambda x, y: y,
+                                            defaultfunc=lambda x: x)
+            plugin_utils.save_snapshot(extensions)
+        _entryparsers = (chain, extensions)
+
+    # plugins can add to the dict for their request
+    return dict(extensions)
+
+
 class Pyblosxom:
     """Main class for Pyblosxom functionality.  It handles
     initialization, defines default behavior, and also pushes the
@@ -53,8 +153,11 @@ class Pyblosxom:
         :param data: dict containing data variables.
         """
         # FIXME: These shouldn't be here.
-        config['pyblosxom_name'] = "pyblosxom"
-        config['pyblosxom_version'] = __version__
+        # (only set if they differ so a shared config isn't copied)
+        if config.get('pyblosxom_name') != "pyblosxom":
+            config['pyblosxom_name'] = "pyblosxom"
+        if config.get('pyblosxom_version') != __version__:
+            config['pyblosxom_version'] = __version__
 
         self._config = config
         self._request = Request(config, environ, data)
@@ -68,15 +171,6 @@ class Pyblosxom:
         py_http = self._request.get_http()
         config = self._request.get_configuration()
 
-        # initialize the locale, if wanted (will silently fail if locale
-        # is not available)
-        if config.get('locale', None):
-            try:
-                locale.setlocale(locale.LC_ALL, config['locale'])
-            except locale.Error:
-                # invalid locale
-                pass
-
         # initialize the tools module
         tools.initialize(config)
 
@@ -96,25 +190,14 @@ class Pyblosxom:
             else:
                 config["base_url"] = ""
 
-        # take off the trailing slash for base_url
-        if config['base_url'].endswith("/"):
-            config['base_url'] = config['base_url'][:-1]
-
-        data_dir = config["datadir"]
-        if data_dir.endswith("/") or data_dir.endswith("\\"):
-            data_dir = data_dir[:-1]
-            config['datadir'] = data_dir
-
-        # import and initialize plugins
-        plugin_utils.initialize_plugins(config.get("plugin_dirs", []),
-                                        config.get("load_plugins", None))
+        # set the locale, normalize base_url and datadir, and import
+        # and initialize plugins.  this is a no-op for a config that's
+        # been prepared already.
+        prepare_config(config)
 
         # entryparser callback is run here first to allow other
         # plugins register what file extensions can be used
-        data['extensions'] = tools.run_callback("entryparser",
-                                                {'txt': blosxom_entry_parser},
-                                                mappingfunc=lambda x, y: y,
-                                                defaultfunc=lambda x: x)
+        data['extensions'] = get_entryparsers()
 
     def cleanup(self):
         """This cleans up Pyblosxom after a run.
@@ -408,6 +491,99 @@ class Pyblosxom:
         # we're done, clean up
         self.cleanup()
 
+    def run_warm_cache(self, jobs=1, force=False):
+        """Parses entries in the datadir through the entryparsers and
+        saves them in the cache driver so requests don't have to.
+
+        Entries are parsed in a pool of ``jobs`` processes.  The
+        parsed entries are saved in the cache by this process, so
+        cache drivers don't need to handle several writers.
+
+        :param jobs: the number of processes to parse entries in
+        :param force: whether (True) or not (False) to parse entries
+                      that are already cached
+
+        :returns: list of (filename, seconds, error) tuples for the
+                  parsed entries.  error is None if the entry parsed
+                  fine.
+        """
+        self.initialize()
+
+        # run the start callback like a request does, so entries are
+        # parsed with what plugins set up there
+        tools.run_callback("start", {'request': self._request})
+
+        config = self._request.get_configuration()
+        data = self._request.get_data()
+        cache = tools.get_cache(self._request)
+
+        filenames = []
+        for mem in tools.walk(self._request, config["datadir"]):
+            ext = os.path.splitext(mem)[1][1:]
+            if not ext in data["extensions"]:
+                continue
+            mem = mem.replace(os.sep, "/")
+            if not force and cache.has_key(mem):
+                continue
+            filenames.append(mem)
+
+        if jobs > 1 and len(filenames) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs, _init_warm_cache_worker,
+                                        (config,))
+            try:
+                parsed = pool.imap_unordered(_warm_cache_entry, filenames)
+                results = self._save_warm_cache(cache, parsed)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            global _warm_cache_request
+            _warm_cache_request = self._request
+            parsed = [_warm_cache_entry(mem) for mem in filenames]
+            results = self._save_warm_cache(cache, parsed)
+
+        cache.close()
+        self.cleanup()
+        return results
+
+    def _save_warm_cache(self, cache, parsed):
+        results = []
+        for filename, seconds, entry_dict, error in parsed:
+            if entry_dict is not None:
+                # see EntryBase.add_to_cache
+                entry_dict.pop("date", None)
+                cache[filename] = entry_dict
+            results.append((filename, seconds, error))
+        return results
+
+
+# the request run_warm_cache workers parse entries with
+_warm_cache_request = None
+
+
+def _init_warm_cache_worker(config):
+    global _warm_cache_request
+    p = Pyblosxom(config, {})
+    p.initialize()
+    _warm_cache_request = p.get_request()
+    tools.run_callback("start", {'request': _warm_cache_request})
+
+
+def _warm_cache_entry(filename):
+    request = _warm_cache_request
+    eparser = request.get_data()["extensions"][
+        os.path.splitext(filename)[1][1:]]
+
+    start = time.time()
+    try:
+        entry_dict = eparser(filename, request)
+        error = None
+    except Exception, e:
+        entry_dict = None
+        error = "%s: %s" % (e.__class__.__name__, e)
+    return filename, time.time() - start, entry_dict, error
+
 
 Pyblosxom = Pyblosxom
 
@@ -442,9 +618,38 @@ class PyblosxomWSGIApp:
         self.config = dict(config.py)
 
         self.config.update(_config)
+        self.config.setdefault("config_filename",
+                               tools.get_config_filename(config))
         if "codebase" in _config:
             sys.path.insert(0, _config["codebase"])
 
+        # the prepared config shared by all requests
+        self._base_config = None
+        self._base_config_lock = threading.Lock()
+
+    def get_base_config(self):
+        """Returns the config with everything that's the same for every
+        request set up.  This is done once per process.  Requests
+        read it through a ``tools.ConfigOverlay``, so it's not
+        changed by them.
+        """
+        config = self._base_config
+        if config is None:
+            self._base_config_lock.acquire()
+            try:
+                if self._base_config is None:
+                    config = dict(self.config)
+                    config['pyblosxom_name'] = "pyblosxom"
+                    config['pyblosxom_version'] = __version__
+                    tools.initialize(config)
+                    prepare_config(config)
+                    get_entryparsers()
+                    self._base_config = config
+                config = self._base_config
+            finally:
+                self._base_config_lock.release()
+        return config
+
     def run_pyblosxom(self, env, start_response):
         """
         Executes a single run of Pyblosxom wrapped in the crash handler.
@@ -455,7 +660,8 @@ class PyblosxomWSGIApp:
             if "PATH_INFO" not in env:
                 env["PATH_INFO"] = ""
 
-            p = Pyblosxom(dict(self.config), env)
+            config = tools.ConfigOverlay(self.get_base_config())
+            p = Pyblosxom(config, env)
             p.run()
 
             response = p.get_response()
@@ -464,9 +670,70 @@ class PyblosxomWSGIApp:
             ch = crashhandling.CrashHandler(True, env)
             response = ch.handle_by_response(*sys.exc_info())
 
+        body = self.compress_response(env, response)
         start_response(response.status, list(response.headers.items()))
+        return body
+
+    def compress_response(self, env, response):
+        """
+        Returns the body of the response.  If ``wsgi_gzip`` is set in
+        the config and the client accepts gzip, the body is compressed
+        and the headers are adjusted accordingly.  The compressed body
+        gets its own ETag (see ``tools.gzip_etag``).
+
+        :param env: the WSGI environment
+        :param response: the Response object
+
+        :returns: the body string
+        """
         response.seek(0)
-        return response.read()
+        body = response.read()
+
+        if not self.config.get("wsgi_gzip", False):
+            return body
+
+        headers = dict([(k.lower(), k) for k in response.headers.keys()])
+        accepts_gzip = tools.accepts_gzip(env.get("HTTP_ACCEPT_ENCODING", ""))
+
+        # a 304 has to carry the ETag of the variant the client has
+        if response.status.startswith("304"):
+            if accepts_gzip and "etag" in headers:
+                response.headers[headers["etag"]] = tools.gzip_etag(
+                    response.headers[headers["etag"]])
+            return body
+
+        if not response.status.startswith("200"):
+            return body
+
+        if "content-encoding" in headers:
+            return body
+
+        content_type = response.headers.get(headers.get("content-type"), "")
+        if not is_compressible(content_type):
+            return body
+
+        if "vary" in headers:
+            vary = response.headers[headers["vary"]]
+            if "accept-encoding" not in vary.lower():
+                response.headers[headers["vary"]] = vary + ", Accept-Encoding"
+        else:
+            response.headers["Vary"] = "Accept-Encoding"
+
+        if not accepts_gzip:
+            return body
+
+        if response.gzip_body is None:
+            response.gzip_body = tools.gzip_string(
+                body, self.config.get("wsgi_gzip_level", 6))
+        body = response.gzip_body
+
+        response.headers["Content-Encoding"] = "gzip"
+        if "etag" in headers:
+            response.headers[headers["etag"]] = tools.gzip_etag(
+                response.headers[headers["etag"]])
+        if "content-length" in headers:
+            response.headers[headers["content-length"]] = str(len(body))
+        return body
 
     def __call__(self, env, start_response):
         return [self.run_pyblosxom(env, start_response)]
@@ -479,6 +746,18 @@ class PyblosxomWSGIApp:
 PyblosxomWSGIApp = PyblosxomWSGIApp
 
 
+def is_compressible(content_type):
+    """Returns True if responses of this content type are worth
+    compressing.
+
+    :param content_type: the value of the ``Content-Type`` header
+    """
+    content_type = content_type.split(";")[0].strip().lower()
+    return (content_type.startswith("text/") or
+            content_type.endswith("xml") or
+            content_type in ("application/json", "application/javascript"))
+
+
 def pyblosxom_app_factory(global_config, **local_config):
     """App factory for paste.
 
@@ -736,6 +1015,10 @@ class Response(object):
 
     This class is basically a wrapper arround a ``StringIO`` instance.
     It also provides methods for managing http headers.
+
+    ``gzip_body`` is None or the gzip-compressed body of the response.
+    Caches that hold compressed bodies set it so the WSGI app doesn't
+    have to compress the body again.
     """
 
     def __init__(self, request):
@@ -747,6 +1030,7 @@ class Response(object):
         self._headers_sent = False
         self.headers = {}
         self.status = "200 OK"
+        self.gzip_body = None
 
         self.close = self._out.close
         self.flush = self._out.flush
@@ -859,7 +1143,9 @@ def run_pyblosxom():
     """Executes Pyblosxom either as a commandline script or CGI
     script.
     """
-    from config import py as cfg
+    import config
+    cfg = config.py
+    cfg.setdefault("config_filename", tools.get_config_filename(config))
 
     env = {}
 
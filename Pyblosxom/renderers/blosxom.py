@@ -15,7 +15,13 @@ of the blosxom renderer.
 import os
 import sys
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 from Pyblosxom import tools
+from Pyblosxom.cache.store import get_store
 from Pyblosxom.renderers.base import RendererBase
 
 
@@ -96,6 +102,91 @@ def get_flavour_from_dir(path, taste):
     return None
 
 
+_PLAIN_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+def _is_plain(value):
+    if isinstance(value, (list, tuple)):
+        for mem in value:
+            if not isinstance(mem, _PLAIN_TYPES):
+                return False
+        return True
+    return isinstance(value, _PLAIN_TYPES)
+
+
+def _digest(plain):
+    items = plain.items()
+    items.sort()
+    return md5(repr(items)).hexdigest()[:16]
+
+
+# (base config, its plain items, their digest) for the config shared
+# by the requests of this process
+_base_fingerprint = (None, None, None)
+
+
+def get_fingerprint(d):
+    """
+    Returns a short digest of the plain values in a dict: strings,
+    numbers, booleans, None, and lists and tuples of those.  This is
+    used to tell whether flavour templates or configuration changed.
+
+    Other values (loggers, functions, ...) are left out.  Their repr
+    has addresses in it, which would change the digest from process
+    to process.
+
+    For a ``tools.ConfigOverlay``, the plain values of the shared base
+    config are only collected once.
+
+    :param d: the dict to fingerprint
+
+    :returns: hex digest string
+    """
+    global _base_fingerprint
+
+    if not isinstance(d, tools.ConfigOverlay):
+        return _digest(dict([(key, value) for key, value in d.iteritems()
+                             if _is_plain(value)]))
+
+    base, plain, digest = _base_fingerprint
+    if base is not d.base:
+        base = d.base
+        plain = dict([(key, value) for key, value in base.iteritems()
+                      if _is_plain(value)])
+        digest = _digest(plain)
+        _base_fingerprint = (base, plain, digest)
+
+    if not d.changes:
+        return digest
+
+    plain = plain.copy()
+    for key in d.changes:
+        if key in d and _is_plain(d[key]):
+            plain[key] = d[key]
+        else:
+            plain.pop(key, None)
+    return _digest(plain)
+
+
+def get_story_cache(cfg):
+    """
+    Returns the store rendered stories are cached in or None if the
+    story cache isn't enabled.
+
+    :param cfg: the config.py dict
+    """
+    backend = cfg.get("storycache_backend", None)
+    if not backend:
+        return None
+
+    path = None
+    if backend == "disk":
+        path = cfg.get("storycache_dir",
+                       os.path.join(cfg["datadir"], os.pardir, "storycache"))
+    return get_store("storycache", backend, path,
+                     cfg.get("storycache_max_entries", 1000))
+
+
 class BlosxomRenderer(RendererBase):
     """
     This is the default blosxom renderer.  It tries to match the behavior
@@ -106,6 +197,7 @@ class BlosxomRenderer(RendererBase):
         config = request.get_configuration()
         self._request = request
         self.flavour = None
+        self._fingerprint = None
 
     def get_parse_vars(self):
         """Returns a dict starting with standard filters, config
@@ -114,8 +206,14 @@ class BlosxomRenderer(RendererBase):
         should be adding to the data dict which will override
         stuff in the config dict.
         """
+        config = self._request.config
         parsevars = dict(tools.STANDARD_FILTERS)
-        parsevars.update(self._request.config)
+        if isinstance(config, tools.ConfigOverlay):
+            # dict.update goes through a ConfigOverlay one key at a
+            # time
+            config.update_dict(parsevars)
+        else:
+            parsevars.update(config)
         parsevars.update(self._request.data)
         return parsevars
 
@@ -199,6 +297,58 @@ class BlosxomRenderer(RendererBase):
 
         return template_d
 
+    def get_flavour_fingerprint(self):
+        """
+        Returns a digest of the flavour templates being rendered with
+        and the configuration.  Anything cached from the output of
+        this renderer should be keyed on this.
+
+        :returns: hex digest string
+        """
+        if self._fingerprint is None:
+            self._fingerprint = "%s-%s" % (
+                get_fingerprint(self.flavour or {}),
+                get_fingerprint(self._request.get_configuration()))
+        return self._fingerprint
+
+    def get_story_cache_key(self, entry):
+        """
+        Returns the key the rendered story for this entry is cached
+        under or None if it shouldn't be cached.
+
+        The key is made up of the entry id, the entry mtime, the
+        flavour, and the flavour fingerprint.  Plugins whose story
+        output depends on other things add to the key or opt out of
+        caching by implementing ``cb_story_cache_key``.
+
+        :param entry: the entry being rendered
+
+        :returns: key string or None
+        """
+        if not hasattr(entry, "get_id") or not entry.get_id():
+            return None
+        entry_id = entry.get_id()
+
+        # the entry mtime can come from somewhere other than the file
+        # (pyfilenamemtime, ...), so we also use the file mtime to
+        # notice edits
+        try:
+            stamp = os.stat(entry_id).st_mtime
+        except OSError:
+            stamp = None
+
+        data = self._request.get_data()
+        args = self._run_callback(
+            "story_cache_key",
+            {"entry": entry,
+             "key": [entry_id, repr(entry["mtime"]), repr(stamp),
+                     data.get("flavour", ""),
+                     self.get_flavour_fingerprint()]})
+
+        if args["key"] is None:
+            return None
+        return "\n".join([str(mem) for mem in args["key"]])
+
     def render_content(self, content):
         """
         Processes the content for the story portion of a page.
@@ -229,6 +379,14 @@ class BlosxomRenderer(RendererBase):
             if len(content) > 0:
                 current_date = content[0]["date"]
 
+                # single entry pages show comments, comment previews,
+                # and such, so only stories on pages with more than
+                # one entry get cached
+                story_cache = None
+                if len(content) > 1:
+                    story_cache = get_story_cache(
+                        self._request.get_configuration())
+
                 if current_date and "date_head" in self.flavour:
                     parse_vars = self.get_parse_vars()
                     parse_vars.update({"date": current_date,
@@ -270,8 +428,19 @@ class BlosxomRenderer(RendererBase):
                     parse_vars = self.get_parse_vars()
                     parse_vars.update(entry)
 
-                    outputbuffer.append(
-                        self.render_template(parse_vars, "story", override=1))
+                    key = story = None
+                    if story_cache is not None:
+                        key = self.get_story_cache_key(entry)
+                        if key is not None:
+                            story = story_cache.get(key)
+
+                    if story is None:
+                        story = self.render_template(parse_vars, "story",
+                                                     override=1)
+                        if key is not None:
+                            story_cache.set(key, story)
+
+                    outputbuffer.append(story)
 
                     args = {"entry": parse_vars, "template": ""}
                     args = self._run_callback("story_end", args)
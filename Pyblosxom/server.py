@@ -0,0 +1,601 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+"""
+A small HTTP/1.1 server for running Pyblosxom without a separate web
+server.  This is what ``pyblosxom-cmd serve`` runs.
+
+Requests are handled by a pool of threads.  On posix systems the
+server can also fork several worker processes that share the
+listening socket.  Connections are kept alive between requests, so
+clients that fetch a page and its feeds don't pay for a new
+connection each time.  An idle connection holds its thread, so
+idle connections are closed when other connections are waiting for a
+thread.
+
+Plugins and the entry index are loaded once at startup, before the
+worker processes are forked, so workers start out warm.
+
+When ``config.py`` changes (or the server gets a ``SIGHUP``), the
+server stops accepting connections, lets the requests in flight
+finish, and re-executes itself.  The listening socket is handed to
+the new process, so connections made during the reload wait in the
+socket's backlog instead of being refused.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import socket
+import Queue
+import threading
+import BaseHTTPServer
+from wsgiref import simple_server
+
+from Pyblosxom import __version__
+from Pyblosxom import entryindex
+from Pyblosxom import tools
+from Pyblosxom.pyblosxom import Pyblosxom, PyblosxomWSGIApp
+
+# the environment variable the listening socket's file descriptor is
+# passed in when the server re-executes itself
+LISTEN_FD_VAR = "PYBLOSXOM_SERVE_FD"
+
+
+class RequestInput:
+    """Wraps the connection's input stream so the application can't
+    read past the request body into the next request on the
+    connection.
+    """
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def _size(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        size = self._size(size)
+        if size <= 0:
+            return ""
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        size = self._size(size)
+        if size <= 0:
+            return ""
+        data = self.stream.readline(size)
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        lines = []
+        while True:
+            line = self.readline()
+            if not line:
+                return lines
+            lines.append(line)
+
+    def __iter__(self):
+        return iter(self.readlines())
+
+    def drain(self, limit):
+        """Reads and drops what the application didn't read of the
+        request body.
+
+        :returns: True if the whole body was read, False if there was
+                  more than limit bytes left or the client went away
+        """
+        if self.remaining > limit:
+            return False
+        try:
+            while self.remaining > 0:
+                if not self.read(min(self.remaining, 8192)):
+                    return False
+        except socket.error:
+            return False
+        return True
+
+
+class ServerHandler(simple_server.ServerHandler):
+    """Runs the application for one request on a connection that may
+    be kept alive.
+    """
+    http_version = "1.1"
+    server_software = "Pyblosxom/%s" % __version__
+
+    keep_alive = False
+
+    def cleanup_headers(self):
+        simple_server.ServerHandler.cleanup_headers(self)
+
+        # without a Content-Length, the client can only tell where the
+        # body ends when the connection closes
+        self.keep_alive = (not self.request_handler.close_connection and
+                           self.headers.get("Content-Length") is not None)
+        if not self.keep_alive:
+            self.headers["Connection"] = "close"
+        elif self.environ.get("SERVER_PROTOCOL") == "HTTP/1.0":
+            self.headers["Connection"] = "keep-alive"
+
+    def write(self, data):
+        if self.environ.get("REQUEST_METHOD") == "HEAD":
+            # send the headers (including the Content-Length of the
+            # body) but not the body
+            if not self.headers_sent:
+                self.bytes_sent = len(data)
+                self.send_headers()
+            return
+        simple_server.ServerHandler.write(self, data)
+
+    def handle_error(self):
+        # the response is cut short, so the connection can't be reused
+        if self.headers_sent:
+            self.keep_alive = False
+        simple_server.ServerHandler.handle_error(self)
+
+
+class WSGIRequestHandler(simple_server.WSGIRequestHandler):
+    """Handles the requests on one connection.
+    """
+    protocol_version = "HTTP/1.1"
+
+    # responses are buffered and flushed once they're complete
+    wbufsize = -1
+
+    # request bodies the application didn't read are read and dropped
+    # so the connection can be reused--up to this size
+    max_drain = 64 * 1024
+
+    # how often an idle connection checks whether other connections
+    # are waiting for a thread
+    idle_poll_interval = 0.1
+
+    requests_handled = 0
+
+    def setup(self):
+        # how long an idle connection is kept open
+        self.timeout = self.server.keepalive_timeout
+        simple_server.WSGIRequestHandler.setup(self)
+
+    def handle(self):
+        # wsgiref only handles one request per connection
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def wait_for_request(self):
+        """Waits for the next request on a kept-alive connection.
+
+        :returns: False if the connection should be closed because it
+                  stayed idle for the keep-alive timeout or it's idle
+                  while other connections are waiting for a thread
+        """
+        # a pipelined request may already be read into the buffer
+        if getattr(self.rfile, "_rbuf", None) and self.rfile._rbuf.tell():
+            return True
+
+        deadline = time.time() + self.server.keepalive_timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                ready = select.select([self.connection], [], [],
+                                      min(remaining,
+                                          self.idle_poll_interval))[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                return False
+            if ready:
+                return True
+            if self.server.has_waiting_connections():
+                return False
+
+    def handle_one_request(self):
+        if self.requests_handled and not self.wait_for_request():
+            self.close_connection = 1
+            return
+        self.requests_handled += 1
+
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (socket.timeout, socket.error):
+            self.close_connection = 1
+            return
+
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            self.close_connection = 1
+            return
+
+        if not self.parse_request():
+            return
+
+        self.run_application()
+        self.wfile.flush()
+
+    def run_application(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.send_error(400, "Bad Content-Length")
+            self.close_connection = 1
+            return
+
+        # we don't handle chunked request bodies, so there's no telling
+        # where the next request starts
+        if self.headers.get("Transfer-Encoding"):
+            self.close_connection = 1
+
+        stdin = RequestInput(self.rfile, length)
+        handler = ServerHandler(stdin, self.wfile, self.get_stderr(),
+                                self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+        if (not handler.keep_alive or self.server.stopping
+                or not stdin.drain(self.max_drain)):
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            simple_server.WSGIRequestHandler.log_message(self, format, *args)
+
+
+class PooledWSGIServer(simple_server.WSGIServer):
+    """A WSGI server that handles connections in a pool of threads.
+    """
+    request_queue_size = 64
+
+    def __init__(self, address, app, threads=10, keepalive_timeout=5,
+                 sock=None, quiet=False):
+        """
+        :param address: the (host, port) to listen on; ignored if sock
+                        is given
+        :param app: the WSGI application
+        :param threads: the number of threads to handle connections in
+        :param keepalive_timeout: the number of seconds an idle
+                                  connection is kept open
+        :param sock: an already listening socket to use
+        :param quiet: whether to not log requests
+        """
+        self.keepalive_timeout = keepalive_timeout
+        self.quiet = quiet
+        self.stopping = False
+
+        if sock is None:
+            simple_server.WSGIServer.__init__(self, address,
+                                              WSGIRequestHandler)
+        else:
+            simple_server.WSGIServer.__init__(self, address,
+                                              WSGIRequestHandler, False)
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+            host, port = self.server_address[:2]
+            self.server_name = socket.getfqdn(host)
+            self.server_port = port
+            self.setup_environ()
+
+        # when several processes share the socket, a connection one of
+        # them sees may be accepted by another first--don't block on
+        # accept then
+        self.socket.setblocking(0)
+
+        self.set_app(app)
+
+        self._connections = Queue.Queue()
+        self._workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self._work)
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        self._connections.put((request, client_address))
+
+    def has_waiting_connections(self):
+        """Returns whether there are accepted connections waiting for
+        a thread.
+        """
+        return not self._connections.empty()
+
+    def _work(self):
+        while True:
+            item = self._connections.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            self.close_request(request)
+
+    def stop(self):
+        """Waits for the connections that have been accepted to be
+        handled and stops the threads.  Call ``shutdown`` first to stop
+        accepting connections.
+        """
+        self.stopping = True
+        for worker in self._workers:
+            self._connections.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+
+def bind(host, port, backlog=PooledWSGIServer.request_queue_size):
+    """Returns a socket listening on host and port.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def get_inherited_socket():
+    """Returns the listening socket passed on by the process that
+    re-executed us or None.
+    """
+    fd = os.environ.pop(LISTEN_FD_VAR, None)
+    if fd is None:
+        return None
+    fd = int(fd)
+    # fromfd returns a bare _socket.socket, whose connections don't
+    # get the socket module's makefile
+    sock = socket.socket(_sock=socket.fromfd(fd, socket.AF_INET,
+                                             socket.SOCK_STREAM))
+    os.close(fd)
+    return sock
+
+
+def initialize_app(app):
+    """Loads the plugins and entryparsers and builds the entry index
+    so requests don't have to.
+
+    :param app: the PyblosxomWSGIApp
+    """
+    p = Pyblosxom(tools.ConfigOverlay(app.get_base_config()), {})
+    p.initialize()
+    entryindex.get_entry_index(p.get_request())
+
+
+def get_config_filename():
+    """Returns the filename of the ``config.py`` file in use.
+    """
+    import config
+    return tools.get_config_filename(config)
+
+
+def get_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+
+def _wait(pid):
+    while True:
+        try:
+            return os.waitpid(pid, 0)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                return None
+            raise
+
+
+class Server:
+    """Serves the WSGI application in one or more processes until it
+    gets stopped and re-executes itself when ``config.py`` changes.
+    """
+    # how often to check for signals and config.py changes
+    poll_interval = 0.5
+
+    def __init__(self, app, sock, threads=10, processes=1,
+                 keepalive_timeout=5, reload=True, quiet=False, argv=None):
+        self.app = app
+        self.argv = argv or sys.argv
+        self.sock = sock
+        self.threads = threads
+        self.processes = processes
+        self.keepalive_timeout = keepalive_timeout
+        self.quiet = quiet
+
+        self.config_filename = None
+        if reload:
+            self.config_filename = get_config_filename()
+            self.config_mtime = get_mtime(self.config_filename)
+
+        # set by the signal handlers: "stop" or "reload"
+        self.action = None
+
+    def _on_signal(self, signum, frame):
+        if signum == getattr(signal, "SIGHUP", None):
+            self.action = "reload"
+        else:
+            self.action = "stop"
+
+    def _install_signals(self):
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._on_signal)
+
+    def check(self):
+        """Returns ``"stop"``, ``"reload"`` or None if we should keep
+        serving.
+        """
+        if self.action:
+            return self.action
+        if (self.config_filename and
+                get_mtime(self.config_filename) != self.config_mtime):
+            return "reload"
+        return None
+
+    def log(self, message):
+        if not self.quiet:
+            print >> sys.stderr, message
+
+    def run(self):
+        """Serves until we're stopped.  If we're told to reload, this
+        doesn't return.
+        """
+        self._install_signals()
+        if self.processes > 1:
+            action = self.run_processes()
+        else:
+            action = self.serve()
+
+        if action == "reload":
+            self.reexec()
+
+    def serve(self):
+        """Serves in this process until we're told to stop or reload.
+
+        :returns: ``"stop"`` or ``"reload"``
+        """
+        server = PooledWSGIServer(None, self.app, self.threads,
+                                  self.keepalive_timeout, self.sock,
+                                  self.quiet)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+        try:
+            while True:
+                action = self.check()
+                if action:
+                    return action
+                time.sleep(self.poll_interval)
+        finally:
+            # stop accepting and finish what's been accepted
+            server.shutdown()
+            server.stop()
+
+    def run_processes(self):
+        """Forks the worker processes, replaces the ones that die, and
+        stops them when we're told to stop or reload.
+
+        :returns: ``"stop"`` or ``"reload"``
+        """
+        children = set()
+        try:
+            while True:
+                while len(children) < self.processes:
+                    pid = os.fork()
+                    if pid == 0:
+                        self._run_child()
+                    children.add(pid)
+
+                action = self.check()
+                if action:
+                    return action
+                time.sleep(self.poll_interval)
+
+                while children:
+                    try:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                    except OSError:
+                        break
+                    if not pid:
+                        break
+                    children.discard(pid)
+                    self.log("Worker %d exited with status %d." %
+                             (pid, status))
+        finally:
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in children:
+                _wait(pid)
+
+    def _run_child(self):
+        code = 0
+        try:
+            try:
+                # the parent handles ctrl-c, reloads and config.py
+                # changes
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                if hasattr(signal, "SIGHUP"):
+                    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                self.config_filename = None
+                self.serve()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+        finally:
+            os._exit(code)
+
+    def reexec(self):
+        """Replaces this process with a new one that takes over the
+        listening socket.
+        """
+        self.log("Reloading....")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.environ[LISTEN_FD_VAR] = str(self.sock.fileno())
+        os.execv(sys.executable, [sys.executable] + self.argv)
+
+
+def serve(host="127.0.0.1", port=8000, threads=10, processes=1,
+          keepalive_timeout=5, reload=True, quiet=False, argv=None):
+    """Serves the blog whose ``config.py`` is importable until the
+    process is stopped.
+
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param threads: the number of threads handling connections in
+                    each process
+    :param processes: the number of worker processes
+    :param keepalive_timeout: the number of seconds an idle connection
+                              is kept open
+    :param reload: whether to reload when ``config.py`` changes
+    :param quiet: whether to not log requests
+    :param argv: the command line to run to reload; defaults to
+                 ``sys.argv``
+    """
+    # reloading relies on handing the socket to a new process
+    if os.name != "posix":
+        reload = False
+
+    sock = get_inherited_socket()
+    if sock is None:
+        sock = bind(host, port)
+
+    app = PyblosxomWSGIApp()
+    initialize_app(app)
+
+    server = Server(app, sock, threads, processes, keepalive_timeout,
+                    reload, quiet, argv)
+    host, port = sock.getsockname()[:2]
+    server.log("Serving on http://%s:%d/ (%d processes, %d threads each)." %
+               (host, port, processes, threads))
+    server.run()
@@ -25,6 +25,9 @@ import time
 import urllib
 import shutil
 import unittest
+import smtpd
+import asyncore
+import threading
 
 
 def req_():
@@ -315,3 +318,55 @@ class PluginTest(unittest.TestCase):
 
     # allows us to use shorthand
     eq_ = unittest.TestCase.assertEquals
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """
+    An SMTP server that runs in a thread and keeps the messages it
+    receives in ``messages`` as ``(mailfrom, rcpttos, data)`` tuples.
+
+    Set ``reject`` to the number of messages to reject with a
+    temporary failure before accepting messages again.
+
+    Example::
+
+        server = LocalSMTPServer()
+        server.start()
+        try:
+            mailqueue.send_smtp(server.address, ...)
+        finally:
+            server.stop()
+    """
+    def __init__(self, host="127.0.0.1", port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        host, port = self.socket.getsockname()
+        self.address = "%s:%d" % (host, port)
+        self.messages = []
+        self.reject = 0
+        self._running = False
+        self._thread = None
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.reject > 0:
+            self.reject -= 1
+            return "451 try again later"
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def start(self):
+        """Starts serving in a thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.05, count=1)
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close()
@@ -86,3 +86,60 @@ class Test_acronyms(PluginTest):
         self.assertEquals(
             args["entry"]["body"],
             "<FOO>This is <acronym title=\"bar\">FOO</acronym>!</FOO>")
+
+        # acronyms in tag attributes are left alone
+        args = {"request": req,
+                "entry": {"body": "<a title=\"FOO\">FOO</a>"}}
+
+        ret = acronyms.cb_story(args)
+
+        self.assertEquals(
+            args["entry"]["body"],
+            "<a title=\"FOO\"><acronym title=\"bar\">FOO</acronym></a>")
+
+    def test_build_trie_pattern(self):
+        pattern = acronyms.build_trie_pattern(["CSS", "CGI", "CGIs", "XML"])
+        self.assertEquals(pattern, "(?:C(?:GI(?:s)?|SS)|XML)")
+
+        matcher = re.compile("\\b%s\\b" % pattern)
+        for word in ("CSS", "CGI", "CGIs", "XML"):
+            self.assertEquals(matcher.match(word).group(0), word)
+        self.assertEquals(matcher.match("CG"), None)
+
+    def test_matcher(self):
+        matcher = acronyms.AcronymMatcher(acronyms.build_acronyms(
+            ["HTML = Hypertext Markup Language",
+             "XHTML = Extensible Hypertext Markup Language",
+             "UTF\\-?8 = abbr|Unicode Transformation Format"]))
+
+        self.assertEquals(
+            matcher.sub("XHTML and HTML in UTF-8 or UTF8"),
+            "<acronym title=\"Extensible Hypertext Markup Language\">XHTML"
+            "</acronym> and <acronym title=\"Hypertext Markup Language\">"
+            "HTML</acronym> in <abbr title=\"Unicode Transformation Format\">"
+            "UTF-8</abbr> or <abbr title=\"Unicode Transformation Format\">"
+            "UTF8</abbr>")
+
+        # no acronyms, no changes
+        self.assertEquals(acronyms.AcronymMatcher([]).sub("HTML"), "HTML")
+
+    def test_cb_start_caches(self):
+        filename = os.path.join(self.datadir, "acronyms.txt")
+        self.config["acronym_file"] = filename
+        fp = open(filename, "w")
+        fp.write("FOO = bar\n")
+        fp.close()
+
+        acronyms.cb_start(self.args)
+        matcher = self.request.get_data()["acronyms_matcher"]
+        acronyms.cb_start(self.args)
+        self.assert_(self.request.get_data()["acronyms_matcher"] is matcher)
+
+        # a change to the file gets a new matcher
+        fp = open(filename, "w")
+        fp.write("FOO = bar\nBAR = baz\n")
+        fp.close()
+
+        acronyms.cb_start(self.args)
+        self.assert_(self.request.get_data()["acronyms_matcher"]
+                     is not matcher)
@@ -67,3 +67,186 @@ class TestBlogTest(BlogTest):
             self.cleanup_blog()
             self.eq_(1, 1)
 
+
+class WarmCacheTest(BlogTest):
+    blog = [{"category": "cat%d" % (i % 2),
+             "filename": "entry%d.txt" % i,
+             "mtime": gen_time("2007/02/%02d 14:14" % (i + 1)),
+             "title": "Entry %d" % i,
+             "metadata": {},
+             "body": "<p>Body %d</p>" % i} for i in range(4)]
+
+    def get_config(self):
+        return {"datadir": self.get_datadir(),
+                "base_url": "http://example.com",
+                "cacheDriver": "entrypickle",
+                "cacheConfig": os.path.join(self.get_temp_dir(), "cache")}
+
+    def test_warm_cache(self):
+        from Pyblosxom.pyblosxom import Pyblosxom
+        from Pyblosxom.cache.entrypickle import BlosxomCache
+
+        self.setup_blog(WarmCacheTest.blog)
+        try:
+            cfg = self.get_config()
+            results = Pyblosxom(cfg, {}).run_warm_cache()
+            self.eq_(len(results), 4)
+            self.eq_([error for filename, seconds, error in results],
+                     [None] * 4)
+
+            filename = os.path.join(self.get_datadir(), "cat1", "entry1.txt")
+            cache = BlosxomCache(None, cfg["cacheConfig"])
+            self.eq_(cache[filename]["title"], "Entry 1")
+
+            # everything is cached, so there's nothing to do
+            self.eq_(Pyblosxom(cfg, {}).run_warm_cache(), [])
+
+            # unless we force it
+            results = Pyblosxom(cfg, {}).run_warm_cache(jobs=2, force=True)
+            self.eq_(sorted([filename for filename, s, e in results]),
+                     sorted([os.path.join(self.get_datadir(), mem["category"],
+                                          mem["filename"])
+                             for mem in WarmCacheTest.blog]))
+        finally:
+            self.cleanup_blog()
+
+    def test_warm_cache_runs_start(self):
+        import sys
+        from Pyblosxom import plugin_utils
+        from Pyblosxom.pyblosxom import Pyblosxom
+        from Pyblosxom.cache.entrypickle import BlosxomCache
+
+        plugin_dir = os.path.join(self.get_temp_dir(), "plugins")
+        os.mkdir(plugin_dir)
+        fp = open(os.path.join(plugin_dir, "warmplug.py"), "w")
+        fp.write("""
+import os
+
+# the pid of the process cb_start ran in
+state = {}
+
+def cb_start(args):
+    state["pid"] = os.getpid()
+
+def parse_warm(filename, request):
+    return {"title": str(state.get("pid") == os.getpid()), "body": ""}
+
+def cb_entryparser(args):
+    args["warm"] = parse_warm
+    return args
+""")
+        fp.close()
+
+        datadir = self.get_datadir()
+        os.makedirs(datadir)
+        for i in range(2):
+            fp = open(os.path.join(datadir, "entry%d.warm" % i), "w")
+            fp.close()
+
+        saved = (plugin_utils.plugins[:], plugin_utils.callbacks.copy(),
+                 plugin_utils.bad_plugins[:], sys.path[:])
+        del plugin_utils.plugins[:]
+        plugin_utils.callbacks.clear()
+        try:
+            cfg = self.get_config()
+            cfg["plugin_dirs"] = [plugin_dir]
+            cfg["load_plugins"] = ["warmplug"]
+            cache = BlosxomCache(None, cfg["cacheConfig"])
+
+            for jobs in (1, 2):
+                Pyblosxom(cfg, {}).run_warm_cache(jobs=jobs, force=True)
+                for i in range(2):
+                    filename = os.path.join(datadir, "entry%d.warm" % i)
+                    self.eq_(cache[filename]["title"], "True")
+        finally:
+            plugins, callbacks, bad_plugins, path = saved
+            plugin_utils.plugins[:] = plugins
+            plugin_utils.callbacks.clear()
+            plugin_utils.callbacks.update(callbacks)
+            plugin_utils.bad_plugins[:] = bad_plugins
+            sys.path[:] = path
+            sys.modules.pop("warmplug", None)
+            self.cleanup_blog()
+
+
+class ConcurrentRenderTest(BlogTest):
+    """Renders the same pages in several threads at once and checks
+    they come out the same as when they're rendered one at a time.
+    """
+    blog = WarmCacheTest.blog
+
+    paths = ["/", "/cat0", "/cat1/entry1.html", "/2007/Feb",
+             "/index.rss20", "/index.atom"]
+
+    def get_config(self):
+        return {"datadir": self.get_datadir(),
+                "base_url": "http://example.com/",
+                "blog_title": "Test blog"}
+
+    def render(self, path_info, cfg=None):
+        from StringIO import StringIO
+        from Pyblosxom.pyblosxom import Pyblosxom
+
+        if cfg is None:
+            cfg = self.get_config()
+        env = {"PATH_INFO": path_info,
+               "REQUEST_METHOD": "GET",
+               "QUERY_STRING": "",
+               "wsgi.input": StringIO("")}
+        p = Pyblosxom(cfg, env)
+        p.run()
+        response = p.get_response()
+        response.seek(0)
+        return response.read()
+
+    def test_concurrent_render(self):
+        import threading
+
+        self.setup_blog(ConcurrentRenderTest.blog)
+        try:
+            expected = dict([(path, self.render(path))
+                             for path in self.paths])
+            for path in self.paths:
+                assert "Entry" in expected[path], path
+
+            failures = []
+
+            def worker(offset):
+                try:
+                    for i in range(len(self.paths) * 3):
+                        path = self.paths[(i + offset) % len(self.paths)]
+                        if self.render(path) != expected[path]:
+                            failures.append(path)
+                except Exception, e:
+                    failures.append(repr(e))
+
+            threads = [threading.Thread(target=worker, args=(i,))
+                       for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.eq_(failures, [])
+        finally:
+            self.cleanup_blog()
+
+    def test_shared_config(self):
+        from Pyblosxom import tools
+        from Pyblosxom.pyblosxom import prepare_config
+
+        self.setup_blog(ConcurrentRenderTest.blog)
+        try:
+            base = prepare_config(self.get_config())
+            self.eq_(base["base_url"], "http://example.com")
+            snapshot = dict(base)
+
+            for path in self.paths:
+                self.eq_(self.render(path, tools.ConfigOverlay(base)),
+                         self.render(path))
+
+            # requests don't change the shared config
+            self.eq_(base, snapshot)
+        finally:
+            self.cleanup_blog()
+
@@ -7,6 +7,7 @@
 # LICENSE for distribution details.
 #######################################################################
 
+import os
 from StringIO import StringIO
 
 from Pyblosxom.tests import UnitTestBase
@@ -48,3 +49,84 @@ class TestBlosxomRenderer(UnitTestBase):
 
         self.eq_(renderer.render_template(vardict, "date_head"),
                  "2011 01 25 Tue, 25 Jan 2011")
+
+    def test_story_cache(self):
+        from Pyblosxom.entries.base import EntryBase
+        from Pyblosxom.cache import store
+
+        request = self.build_request(
+            cfg={"storycache_backend": "memory"},
+            data={"content-type": "text/html", "flavour": "html"})
+        store._stores.clear()
+
+        def build_entry(name, body):
+            filename = os.path.join(self.get_temp_dir(), name)
+            open(filename, "w").write(body)
+            entry = EntryBase(request)
+            entry._id = filename
+            entry.update({"mtime": 1.0, "date": "", "body": body})
+            return entry
+
+        calls = []
+
+        def run_callback(chain, args):
+            if chain == "story":
+                calls.append(args["entry"]["body"])
+            return args
+
+        def render(content):
+            renderer = blosxom.BlosxomRenderer(request, StringIO())
+            renderer.flavour = {"story": "<p>$(body)</p>"}
+            renderer._run_callback = run_callback
+            return "".join(renderer.render_content(content))
+
+        content = [build_entry("a.txt", "a"), build_entry("b.txt", "b")]
+        self.eq_(render(content), "<p>a</p><p>b</p>")
+        self.eq_(calls, ["a", "b"])
+
+        # second time around comes out of the cache
+        self.eq_(render(content), "<p>a</p><p>b</p>")
+        self.eq_(calls, ["a", "b"])
+
+        # single entry pages aren't cached
+        self.eq_(render(content[:1]), "<p>a</p>")
+        self.eq_(calls, ["a", "b", "a"])
+
+        # changing the entry mtime changes the key
+        content[0]["mtime"] = 2.0
+        self.eq_(render(content), "<p>a</p><p>b</p>")
+        self.eq_(calls, ["a", "b", "a", "a"])
+
+    def test_fingerprint(self):
+        import logging
+        from Pyblosxom import tools
+
+        config = {"blog_title": "Blog", "num_entries": 5,
+                  "plugin_dirs": ["/plugins"], "tags": ("a", "b")}
+        fingerprint = blosxom.get_fingerprint(config)
+
+        # values whose repr changes from process to process are left
+        # out
+        config2 = dict(config)
+        config2.update({"logger": logging.getLogger("test"),
+                        "func": lambda: None,
+                        "handlers": [object()]})
+        self.eq_(blosxom.get_fingerprint(config2), fingerprint)
+
+        # a ConfigOverlay fingerprints the same as the config it
+        # stands for
+        overlay = tools.ConfigOverlay(config2)
+        self.eq_(blosxom.get_fingerprint(overlay), fingerprint)
+
+        overlay["blog_title"] = "Another blog"
+        config["blog_title"] = "Another blog"
+        self.eq_(blosxom.get_fingerprint(overlay),
+                 blosxom.get_fingerprint(config))
+        assert blosxom.get_fingerprint(overlay) != fingerprint
+
+        del overlay["num_entries"]
+        del config["num_entries"]
+        overlay["func"] = 1
+        config["func"] = 1
+        self.eq_(blosxom.get_fingerprint(overlay),
+                 blosxom.get_fingerprint(config))
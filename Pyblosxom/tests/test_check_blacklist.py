@@ -35,3 +35,38 @@ class TestCheckBlacklist(PluginTest):
         cfg["comment_rejected_words"] = ["this"]
         ret = check_blacklist.cb_comment_reject(self.args)
         self.assertEquals(True, ret[0])
+
+        # matching is case-insensitive
+        cfg["comment_rejected_words"] = ["HAPPY"]
+        ret = check_blacklist.cb_comment_reject(self.args)
+        self.assertEquals(True, ret[0])
+
+    def test_word_boundaries(self):
+        comment = {"body": "I like crosswords"}
+        self.args['comment'] = comment
+        cfg = self.args["request"].get_configuration()
+        cfg["comment_rejected_words"] = ["word"]
+
+        # substrings match by default
+        ret = check_blacklist.cb_comment_reject(self.args)
+        self.assertEquals(True, ret[0])
+
+        cfg["comment_rejected_words_boundaries"] = True
+        ret = check_blacklist.cb_comment_reject(self.args)
+        self.assertEquals(False, ret)
+
+        comment["body"] = "a word, here"
+        ret = check_blacklist.cb_comment_reject(self.args)
+        self.assertEquals(True, ret[0])
+
+    def test_matcher(self):
+        matcher = check_blacklist.WordMatcher(
+            ["he", "she", "his", "hers", "192.168.1.1"])
+        self.assertEquals("she", matcher.search("ushers"))
+        self.assertEquals("his", matcher.search("this"))
+        self.assertEquals(None, matcher.search("hix"))
+        self.assertEquals("192.168.1.1", matcher.search("from 192.168.1.1"))
+
+        matcher = check_blacklist.WordMatcher(["he", "hers"], boundaries=True)
+        self.assertEquals("hers", matcher.search("it's hers."))
+        self.assertEquals(None, matcher.search("ushers"))
@@ -11,11 +11,11 @@
 Tests for the comments plugin.
 """
 
-from Pyblosxom.tests import PluginTest, FrozenTime, TIMESTAMP
+from Pyblosxom.tests import PluginTest, FrozenTime, TIMESTAMP, LocalSMTPServer
 from Pyblosxom.plugins import comments
+from Pyblosxom import tools
 
 import cgi
-import cPickle
 import os
 
 
@@ -357,8 +357,74 @@ class TestComments(PluginTest):
         self.comment()
         latest_path = os.path.join(self.config['comment_dir'],
                                    comments.LATEST_PICKLE_FILE)
-        timestamp = cPickle.load(open(latest_path))
-        self.assertEquals(self.timestamp, timestamp)
+        self.assertEquals(self.timestamp,
+                          float(open(latest_path).read()))
+        self.assertEquals(
+            self.timestamp,
+            tools.get_latest_comment_time(self.config['comment_dir']))
+
+    def test_comment_journal(self):
+        """With comment_journal set, comments are appended to a
+        journal that's compacted when it gets too big."""
+        self.config['comment_journal'] = True
+        self.data['display_comment_default'] = True
+
+        for i in range(3):
+            self.comment(body='body %d' % i)
+            self.frozen_time.timestamp += 1
+
+        cdir = self.config['comment_dir']
+        journal = comments.get_journal_filename(cdir, self.entry_name,
+                                                self.config)
+        self.assert_(os.path.exists(journal))
+        self.assertEquals([], [mem for mem in os.listdir(cdir)
+                               if mem.endswith('.cmt') and '-' in mem])
+
+        comments.cb_story(self.args)
+        self.assertEquals(3, self.entry['num_comments'])
+        self.assertEquals(['body 0', 'body 1', 'body 2'],
+                          [c['cmt_description']
+                           for c in self.entry['comments']])
+
+        # the next comment goes over the limit and compacts the journal
+        self.config['comment_journal_max_size'] = 1
+        self.comment(body='body 3')
+        self.assert_(not os.path.exists(journal))
+        self.assert_(os.path.exists(
+            os.path.join(cdir, self.entry_name + '-all.cmt')))
+
+        comments._comment_indexes.clear()
+        self.assertEquals(
+            ['body 0', 'body 1', 'body 2', 'body 3'],
+            [c['cmt_description']
+             for c in comments.read_comments(self.entry, self.config)])
+        self.assertEquals(4, comments.get_comment_count(self.request,
+                                                        self.entry))
+
+    def test_mail_spool(self):
+        """With mail_spool_dir set, notifications are spooled rather
+        than sent while the comment is posted."""
+        from Pyblosxom import mailqueue
+        server = LocalSMTPServer()
+        server.start()
+        try:
+            self.config['comment_smtp_server'] = server.address
+            self.config['comment_smtp_to'] = 'joe@example.com'
+            self.config['mail_spool_dir'] = os.path.join(self.datadir,
+                                                         'spool')
+            self.comment(email='jane@example.com', body='spooled')
+
+            queue = mailqueue.get_mail_queue(self.config)
+            self.assertEquals(1, len(queue))
+            self.assertEquals([], server.messages)
+
+            self.assertEquals((1, 0), queue.process())
+            self.assertEquals(1, len(server.messages))
+            mailfrom, rcpttos, data = server.messages[0]
+            self.assertEquals(['joe@example.com'], rcpttos)
+            self.assert_('Subject: comment on' in data)
+        finally:
+            server.stop()
 
     def test_cb_prepare_draft(self):
         """For draft support, comment_draft_ext should override comment_ext."""
@@ -439,6 +505,124 @@ class TestComments(PluginTest):
         self.comment()
         check_num_comments(2)
 
+    def test_comment_index(self):
+        """Comment files are only parsed when the comment directory
+        changes and writes update the index."""
+        self.data['display_comment_default'] = True
+        self.comment()
+        comments.cb_story(self.args)
+        self.assertEquals(1, self.entry['num_comments'])
+
+        parsed = []
+        read_file = comments.read_file
+        def counting_read_file(filename, config):
+            parsed.append(filename)
+            return read_file(filename, config)
+        comments.read_file = counting_read_file
+        try:
+            comments.cb_story(self.args)
+            self.assertEquals(1, self.entry['num_comments'])
+            self.assertEquals([], parsed)
+
+            # writing a comment parses just the new comment
+            self.frozen_time.timestamp += 1
+            self.comment()
+            self.assertEquals(1, len(parsed))
+            self.assert_(parsed[0].endswith(
+                '-%0.1f.cmt' % self.frozen_time.timestamp))
+
+            comments.cb_story(self.args)
+            self.assertEquals(2, self.entry['num_comments'])
+            self.assertEquals(1, len(parsed))
+
+            index = comments.get_comment_index(self.request, self.entry)
+            self.assertEquals(2, index['count'])
+            self.assertEquals(self.frozen_time.timestamp, index['latest'])
+        finally:
+            comments.read_file = read_file
+
+    def test_comment_index_entry_names(self):
+        """Writing a comment only updates the index of its entry, even
+        if the entry name has glob characters or is a prefix of
+        another entry name."""
+        cdir = os.path.join(self.datadir, 'comments')
+        os.makedirs(cdir)
+        names = ['foo', 'foo-bar', 'a[1]', 'a1']
+        record = {'stamp': comments._comment_dir_stamp(cdir),
+                  'settings': comments._comment_index_settings(self.config),
+                  'entries': dict([(name, comments.make_comment_index([]))
+                                   for name in names])}
+        comments._save_comment_record(self.request, cdir, record)
+
+        for name in ('foo-bar', 'a[1]'):
+            cfn = os.path.join(cdir, '%s-%0.1f.cmt' % (name, TIMESTAMP))
+            comments.add_to_comment_index(
+                self.request, cdir, cfn,
+                comments._comment_indexes[cdir]['stamp'],
+                [{'cmt_time': TIMESTAMP}])
+
+        entries = comments._comment_indexes[cdir]['entries']
+        self.assertEquals({'foo': 0, 'foo-bar': 1, 'a[1]': 1, 'a1': 0},
+                          dict([(name, entries[name]['count'])
+                                for name in names]))
+
+    def test_comment_counts(self):
+        """Listing pages count comments without reading comment files."""
+        self.comment()
+        self.frozen_time.timestamp += 1
+        self.comment()
+
+        self.renderer.set_content([self.entry, self.entry])
+        read_file = comments.read_file
+        def fail_read_file(filename, config):
+            self.fail("read %s" % filename)
+        comments.read_file = fail_read_file
+        try:
+            comments.cb_story(self.args)
+            self.assertEquals(2, self.entry['num_comments'])
+            self.assert_(not self.entry.has_key('comments'))
+        finally:
+            comments.read_file = read_file
+
+        # removing a comment by hand makes the counts stale
+        cdir = self.config['comment_dir']
+        os.remove(os.path.join(cdir, '%s-%0.1f.cmt' % (self.entry_name,
+                                                      self.timestamp)))
+        os.utime(cdir, (self.timestamp, self.timestamp))
+        comments._comment_counts.clear()
+
+        comments.cb_story(self.args)
+        self.assertEquals(1, self.entry['num_comments'])
+
+    def test_concurrent_writers(self):
+        """Comments written at the same time all make it into the
+        comment index and counts."""
+        import threading
+        self.comment()
+        comments.get_comment_index(self.request, self.entry)
+        comments.get_comment_count(self.request, self.entry)
+
+        def write(i):
+            for j in range(10):
+                comment = {'title': 'title', 'author': 'author', 'link': '',
+                           'description': 'body %d %d' % (i, j),
+                           'pubDate': '%0.1f' % (self.timestamp + 1 +
+                                                 i * 10 + j)}
+                comments.write_comment(self.request, self.config, self.data,
+                                       comment, 'utf-8')
+
+        threads = [threading.Thread(target=write, args=(i,))
+                   for i in range(4)]
+        for mem in threads:
+            mem.start()
+        for mem in threads:
+            mem.join()
+
+        index = comments.get_comment_index(self.request, self.entry)
+        self.assertEquals(41, index['count'])
+        self.assertEquals(41, comments.get_comment_count(self.request,
+                                                         self.entry))
+
     def test_when_to_render_comments(self):
         # cb_story[_end]() should only render comment templates when
         # appropriate
@@ -0,0 +1,160 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+import time
+
+from Pyblosxom import tools
+from Pyblosxom.tests import UnitTestBase
+from Pyblosxom.plugins import conditionalhttp
+
+
+def http_date(mtime):
+    return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(mtime))
+
+
+class ConditionalHTTPTest(UnitTestBase):
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        tools.initialize({})
+
+    def setup_entries(self):
+        self.entries = {
+            "a.txt": time.mktime((2011, 1, 5, 12, 0, 0, 0, 0, -1)),
+            "cat/b.txt": time.mktime((2011, 2, 5, 12, 0, 0, 0, 0, -1)),
+            "cat/c.txt": time.mktime((2011, 3, 5, 12, 0, 0, 0, 0, -1)),
+            }
+        datadir = os.path.join(self.get_temp_dir(), "entries")
+        for name, mtime in self.entries.items():
+            filename = os.path.join(datadir, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            fp = open(filename, "w")
+            fp.write("Title\nbody\n")
+            fp.close()
+            os.utime(filename, (mtime, mtime))
+
+    def build_get_request(self, path_info, http=None):
+        _http = {"REQUEST_METHOD": "GET", "PATH_INFO": path_info}
+        if http:
+            _http.update(http)
+        return self.build_request(http=_http)
+
+    def test_latest_mtime(self):
+        self.setup_entries()
+        for path_info, name in (("/", "cat/c.txt"),
+                                ("/index.rss", "cat/c.txt"),
+                                ("/cat", "cat/c.txt"),
+                                ("/cat/b.html", "cat/b.txt"),
+                                ("/cat/b", "cat/b.txt"),
+                                ("/2011/01", "a.txt"),
+                                ("/cat/2011/Feb", "cat/b.txt"),
+                                ("/tag/foo", "cat/c.txt")):
+            req = self.build_get_request(path_info)
+            self.eq_(conditionalhttp.get_latest_mtime(req),
+                     self.entries[name], path_info)
+
+    def test_latest_mtime_cached(self):
+        from Pyblosxom.entryindex import EntryIndex
+        self.setup_entries()
+        datadir = os.path.join(self.get_temp_dir(), "entries")
+        req = self.build_get_request("/")
+        index = EntryIndex(datadir)
+        index.scan(req)
+
+        scope = (os.path.join(datadir, ""), "")
+        latest = self.entries["cat/c.txt"]
+        self.eq_(conditionalhttp.get_latest_entry_mtime(index, scope), latest)
+
+        # the mtimes are kept for the generation of the index
+        conditionalhttp._latest_mtimes[datadir][1][scope] = 1
+        self.eq_(conditionalhttp.get_latest_entry_mtime(index, scope), 1)
+
+        index.generation = "new"
+        self.eq_(conditionalhttp.get_latest_entry_mtime(index, scope), latest)
+
+    def test_latest_mtime_unknown(self):
+        self.setup_entries()
+        for path_info in ("/flavourfiles/html/style.css",
+                          "/nothere/2011",
+                          "/2010"):
+            req = self.build_get_request(path_info)
+            self.eq_(conditionalhttp.get_latest_mtime(req), None, path_info)
+
+    def test_handle_not_modified(self):
+        self.setup_entries()
+        mtime = self.entries["cat/b.txt"]
+        req = self.build_get_request(
+            "/cat/b.html", {"HTTP_IF_MODIFIED_SINCE": http_date(mtime)})
+        self.eq_(conditionalhttp.cb_handle({"request": req}), 1)
+        self.eq_(req.get_response().status, "304 Not Modified")
+
+        req = self.build_get_request(
+            "/cat", {"HTTP_IF_NONE_MATCH": '"%s"' % mtime})
+        self.eq_(conditionalhttp.cb_handle({"request": req}), None)
+
+    def test_handle_no_conditional_headers(self):
+        self.setup_entries()
+        req = self.build_get_request("/")
+        self.eq_(conditionalhttp.cb_handle({"request": req}), None)
+        assert "entry_index" not in req.get_data()
+
+    def test_hash_etag(self):
+        from Pyblosxom.entries.base import EntryBase
+
+        req = self.build_request(cfg={"conditionalhttp_etag": "hash"})
+
+        def build_entry(name, mtime):
+            entry = EntryBase(req)
+            entry._id = name
+            entry["mtime"] = mtime
+            return entry
+
+        entries = [build_entry("b.txt", 2.0), build_entry("a.txt", 1.0)]
+        etag = conditionalhttp.get_etag(req, entries, 2.0)
+        self.eq_(etag, conditionalhttp.get_etag(req, entries, 2.0))
+
+        # an entry dropping off the page changes the etag even though
+        # the latest mtime is the same
+        assert etag != conditionalhttp.get_etag(req, entries[:1], 2.0)
+
+        # so does a change in configuration
+        req.get_configuration()["blog_title"] = "Another blog"
+        assert etag != conditionalhttp.get_etag(req, entries, 2.0)
+
+    def test_is_not_modified(self):
+        http = {"HTTP_IF_NONE_MATCH": 'W/"abc", "def"'}
+        self.eq_(conditionalhttp.is_not_modified(http, 1.0, '"abc"'), True)
+        self.eq_(conditionalhttp.is_not_modified(http, 1.0, '"def"'), True)
+        self.eq_(conditionalhttp.is_not_modified(http, 1.0, '"xyz"'), False)
+
+        # If-Modified-Since is ignored when there's an If-None-Match
+        http["HTTP_IF_MODIFIED_SINCE"] = http_date(2.0)
+        self.eq_(conditionalhttp.is_not_modified(http, 1.0, '"xyz"'), False)
+
+        del http["HTTP_IF_NONE_MATCH"]
+        self.eq_(conditionalhttp.is_not_modified(http, 1.0, '"xyz"'), True)
+
+    def test_is_not_modified_gzip_etag(self):
+        # the ETag of the compressed response matches, too
+        for etag in ('"abc-gzip"', 'W/"abc-gzip"', '"abc"'):
+            http = {"HTTP_IF_NONE_MATCH": etag}
+            self.eq_(conditionalhttp.is_not_modified(http, 1.0, '"abc"'),
+                     True, etag)
+        http = {"HTTP_IF_NONE_MATCH": '"1.0-gzip"'}
+        self.eq_(conditionalhttp.is_not_modified(http, 1.0), True)
+
+    def test_cache_headers(self):
+        req = self.build_request(
+            cfg={"conditionalhttp_cache_control": "public, max-age=60",
+                 "conditionalhttp_vary": "Accept-Encoding"})
+        response = req.get_response()
+        conditionalhttp.add_cache_headers(req, response.add_header)
+        self.eq_(response.headers["Cache-Control"], "public, max-age=60")
+        self.eq_(response.headers["Vary"], "Accept-Encoding")
@@ -0,0 +1,99 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+import time
+
+from Pyblosxom.tests import UnitTestBase
+from Pyblosxom.entryindex import EntryIndex, ArchiveIndex
+
+
+def mktime(year, month, day):
+    return time.mktime((year, month, day, 12, 0, 0, 0, 1, -1))
+
+
+class ArchiveIndexTest(UnitTestBase):
+    def build_archive(self):
+        archive = ArchiveIndex()
+        archive.add("a", mktime(2010, 1, 17))
+        archive.add("b", mktime(2010, 1, 17) + 60)
+        archive.add("c", mktime(2010, 3, 2))
+        archive.add("d", mktime(2011, 7, 4))
+        return archive
+
+    def test_years_and_months(self):
+        archive = self.build_archive()
+        self.eq_(archive.get_years(), [2010, 2011])
+        self.eq_(archive.get_months(), [(2010, 1), (2010, 3), (2011, 7)])
+        self.eq_(archive.get_days(2010, 1), {17: 2})
+        self.eq_(archive.get_days(2010, 2), {})
+        self.eq_(archive.get_last_day(2010), (3, 2))
+        self.eq_(archive.get_last_day(2012), None)
+
+    def test_counts_and_entries(self):
+        archive = self.build_archive()
+        self.eq_(archive.count(2010), 3)
+        self.eq_(archive.count(2010, 1), 2)
+        self.eq_(archive.count(2010, 1, 18), 0)
+        self.eq_([mem[1] for mem in archive.get_entries(2010)],
+                 ["c", "b", "a"])
+
+    def test_adjacent_months(self):
+        archive = self.build_archive()
+        self.eq_(archive.get_adjacent_months(2010, 3),
+                 ((2010, 1), (2011, 7)))
+        self.eq_(archive.get_adjacent_months(2010, 1), (None, (2010, 3)))
+        self.eq_(archive.get_adjacent_months(2010, 6),
+                 ((2010, 3), (2011, 7)))
+        self.eq_(archive.get_adjacent_months(2012, 1), ((2011, 7), None))
+
+    def test_remove(self):
+        archive = self.build_archive()
+        archive.remove("d", mktime(2011, 7, 4))
+        self.eq_(archive.get_years(), [2010])
+        self.eq_(archive.get_months(), [(2010, 1), (2010, 3)])
+
+        # removing something that isn't there is fine
+        archive.remove("d", mktime(2011, 7, 4))
+
+
+class EntryIndexTest(UnitTestBase):
+    def write_entry(self, datadir, filename, mtime):
+        filename = os.path.join(datadir, filename)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        fp = open(filename, "w")
+        fp.write("Title\nbody\n")
+        fp.close()
+        os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_categories_and_archive(self):
+        datadir = os.path.join(self.get_temp_dir(), "entries")
+        self.write_entry(datadir, "a.txt", mktime(2010, 1, 17))
+        b = self.write_entry(datadir, "dev/b.txt", mktime(2010, 3, 2))
+        self.write_entry(datadir, "dev/py/c.txt", mktime(2011, 7, 4))
+
+        req = self.build_request(cfg={"datadir": datadir})
+        index = EntryIndex(datadir)
+        index.scan(req)
+
+        self.eq_(index.get_category_counts(),
+                 {"": 3, "dev": 2, os.path.join("dev", "py"): 1})
+        archive = index.get_archive_index()
+        self.eq_(archive.get_months(), [(2010, 1), (2010, 3), (2011, 7)])
+
+        # the archive is kept up to date as entries change
+        os.utime(b, (mktime(2010, 5, 1), mktime(2010, 5, 1)))
+        self.write_entry(datadir, "dev/py/d.txt", mktime(2011, 8, 1))
+        index.scan(self.build_request(cfg={"datadir": datadir}))
+
+        self.eq_(index.get_category_counts()["dev"], 3)
+        self.eq_(archive.get_months(),
+                 [(2010, 1), (2010, 5), (2011, 7), (2011, 8)])
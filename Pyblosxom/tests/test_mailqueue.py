@@ -0,0 +1,98 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+import time
+
+from Pyblosxom.tests import UnitTestBase, LocalSMTPServer
+from Pyblosxom import mailqueue
+
+
+class MailQueueTest(UnitTestBase):
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.server = LocalSMTPServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        UnitTestBase.tearDown(self)
+
+    def get_queue(self):
+        return mailqueue.MailQueue(os.path.join(self.get_temp_dir(), "spool"))
+
+    def enqueue(self, queue, n):
+        for i in range(n):
+            queue.enqueue_smtp(self.server.address, "joe@example.com",
+                               ["jane@example.com"],
+                               "Subject: %d\n\nbody %d\n" % (i, i))
+
+    def test_send_smtp(self):
+        errors = mailqueue.send_smtp(
+            self.server.address,
+            [("joe@example.com", "jane@example.com", "Subject: hi\n\nhi\n")])
+        self.eq_(errors, [None])
+        self.eq_(len(self.server.messages), 1)
+        mailfrom, rcpttos, data = self.server.messages[0]
+        self.eq_(mailfrom, "joe@example.com")
+        self.eq_(rcpttos, ["jane@example.com"])
+        assert "Subject: hi" in data
+
+    def test_send_smtp_connection_error(self):
+        address = self.server.address
+        self.server.stop()
+        self.assertRaises(mailqueue.MailError, mailqueue.send_smtp,
+                          address, [("a@example.com", "b@example.com", "x")])
+        # so tearDown has something to stop
+        self.server = LocalSMTPServer()
+
+    def test_process(self):
+        queue = self.get_queue()
+        self.enqueue(queue, 5)
+        self.eq_(len(queue), 5)
+        self.eq_(self.server.messages, [])
+
+        self.eq_(queue.process(batch_size=2), (5, 0))
+        self.eq_(len(queue), 0)
+        self.eq_(len(self.server.messages), 5)
+
+        # nothing left to do
+        self.eq_(queue.process(), (0, 0))
+
+    def test_retry_with_backoff(self):
+        queue = self.get_queue()
+        self.enqueue(queue, 1)
+        self.server.reject = 2
+
+        now = time.time()
+        self.eq_(queue.process(backoff=10, now=now), (0, 1))
+        self.eq_(len(queue), 1)
+
+        # not due yet
+        self.eq_(queue.process(backoff=10, now=now + 5), (0, 0))
+
+        # the second failure doubles the wait
+        self.eq_(queue.process(backoff=10, now=now + 11), (0, 1))
+        self.eq_(queue.process(backoff=10, now=now + 25), (0, 0))
+        self.eq_(queue.process(backoff=10, now=now + 40), (1, 0))
+        self.eq_(len(queue), 0)
+        self.eq_(len(self.server.messages), 1)
+
+    def test_gives_up(self):
+        queue = self.get_queue()
+        self.enqueue(queue, 1)
+        self.server.reject = 5
+
+        now = time.time()
+        for i in range(3):
+            self.eq_(queue.process(max_attempts=3, backoff=1,
+                                   now=now + i * 10), (0, 1))
+        self.eq_(len(queue), 0)
+        failed = os.listdir(os.path.join(queue.path, "failed"))
+        self.eq_(len(failed), 1)
@@ -0,0 +1,167 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+import time
+
+from Pyblosxom.tests import UnitTestBase
+from Pyblosxom.plugins import pagecache
+from Pyblosxom.cache.store import MemoryStore, DiskStore
+
+
+class StoreTest(UnitTestBase):
+    def test_memory_store(self):
+        store = MemoryStore(max_entries=10)
+        store.set("a", 1)
+        self.eq_(store.get("a"), 1)
+        self.eq_(store.get("b"), None)
+        self.eq_(store.get("b", 2), 2)
+
+        store.delete("a")
+        self.eq_(store.get("a"), None)
+
+    def test_memory_store_evicts_least_recently_used(self):
+        store = MemoryStore(max_entries=10)
+        for i in range(10):
+            store.set(str(i), i)
+
+        # touch 0 so it's the most recently used
+        store.get("0")
+        store.set("10", 10)
+
+        assert len(store) <= 10
+        self.eq_(store.get("0"), 0)
+        self.eq_(store.get("1"), None)
+        self.eq_(store.get("10"), 10)
+
+    def test_disk_store(self):
+        path = os.path.join(self.get_temp_dir(), "store")
+        store = DiskStore(path, max_entries=10)
+        store.set("a", {"body": "foo"})
+        self.eq_(store.get("a"), {"body": "foo"})
+
+        # a new instance sees the same values
+        self.eq_(DiskStore(path).get("a"), {"body": "foo"})
+
+        store.clear()
+        self.eq_(store.get("a"), None)
+
+    def test_disk_store_bounded(self):
+        path = os.path.join(self.get_temp_dir(), "store")
+        store = DiskStore(path, max_entries=10)
+        for i in range(25):
+            store.set(str(i), i)
+        assert len(store) <= 10
+        self.eq_(store.get("24"), 24)
+
+
+class PageCacheTest(UnitTestBase):
+    def build_get_request(self, path_info="/", query="", cfg=None):
+        datadir = os.path.join(self.get_temp_dir(), "entries")
+        if not os.path.isdir(datadir):
+            os.makedirs(datadir)
+
+        _cfg = {"datadir": datadir,
+                "pagecache_backend": "disk",
+                "pagecache_dir": os.path.join(self.get_temp_dir(), "cache")}
+        if cfg:
+            _cfg.update(cfg)
+
+        return self.build_request(
+            cfg=_cfg,
+            http={"REQUEST_METHOD": "GET",
+                  "PATH_INFO": path_info,
+                  "QUERY_STRING": query})
+
+    def render(self, request, body):
+        """Runs a request through the plugin and returns whether it
+        was served from the cache.
+        """
+        args = {"request": request}
+        if pagecache.cb_handle(args):
+            return True
+        request.get_response().add_header("Content-Type", "text/html")
+        request.get_response().write(body)
+        pagecache.cb_end(args)
+        return False
+
+    def read_body(self, request):
+        response = request.get_response()
+        response.seek(0)
+        return response.read()
+
+    def test_cache_key(self):
+        key1 = pagecache.get_cache_key(
+            self.build_get_request("/cat", "a=1&b=2"))
+        key2 = pagecache.get_cache_key(
+            self.build_get_request("/cat", "b=2&a=1"))
+        self.eq_(key1, key2)
+
+        key3 = pagecache.get_cache_key(
+            self.build_get_request("/cat", "flav=rss"))
+        assert key1 != key3
+
+    def test_cache_key_bypass(self):
+        req = self.build_get_request("/", "preview=1")
+        self.eq_(pagecache.get_cache_key(req), None)
+
+        req = self.build_request(http={"REQUEST_METHOD": "POST",
+                                       "PATH_INFO": "/"})
+        self.eq_(pagecache.get_cache_key(req), None)
+
+    def test_hit_and_invalidation(self):
+        datadir = os.path.join(self.get_temp_dir(), "entries")
+        os.makedirs(datadir)
+        fp = open(os.path.join(datadir, "a.txt"), "w")
+        fp.write("Title\nbody\n")
+        fp.close()
+
+        req = self.build_get_request("/")
+        self.eq_(self.render(req, "first"), False)
+
+        req = self.build_get_request("/")
+        self.eq_(self.render(req, "second"), True)
+        self.eq_(self.read_body(req), "first")
+        self.eq_(req.get_response().headers["Content-Type"], "text/html")
+
+        # a new entry invalidates the cached page
+        fp = open(os.path.join(datadir, "b.txt"), "w")
+        fp.write("Title\nbody\n")
+        fp.close()
+
+        req = self.build_get_request("/")
+        self.eq_(self.render(req, "third"), False)
+
+        req = self.build_get_request("/")
+        self.eq_(self.render(req, "fourth"), True)
+        self.eq_(self.read_body(req), "third")
+
+    def test_gzip_body_cached(self):
+        req = self.build_get_request("/", cfg={"wsgi_gzip": True})
+        self.eq_(self.render(req, "first"), False)
+        gzip_body = req.get_response().gzip_body
+        assert gzip_body is not None
+
+        req = self.build_get_request("/", cfg={"wsgi_gzip": True})
+        self.eq_(self.render(req, "second"), True)
+        self.eq_(req.get_response().gzip_body, gzip_body)
+
+    def test_static_bypass(self):
+        req = self.build_get_request("/")
+        req.get_data()["STATIC"] = 1
+        self.eq_(pagecache.cb_handle({"request": req}), None)
+        assert "pagecache_key" not in req.get_data()
+
+    def test_errors_not_cached(self):
+        req = self.build_get_request("/nothere")
+        req.get_response().set_status("404 Not Found")
+        self.eq_(self.render(req, "not found"), False)
+
+        req = self.build_get_request("/nothere")
+        self.eq_(self.render(req, "not found"), False)
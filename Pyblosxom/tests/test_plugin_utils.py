@@ -0,0 +1,258 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+import sys
+import time
+
+from Pyblosxom.tests import UnitTestBase
+from Pyblosxom import plugin_utils, pyblosxom
+
+PLUGIN = """
+def parse_foo(filename, request):
+    return {"title": filename}
+
+def cb_start(args):
+    pass
+
+def cb_entryparser(args):
+    args["foo"] = parse_foo
+    return args
+"""
+
+STORY_PLUGIN = """
+def cb_start(args):
+    pass
+
+def cb_story(args):
+    pass
+"""
+
+FORMAT_PLUGIN = """
+PREFORMATTER_ID = "shout"
+
+def cb_preformat(args):
+    if args.get("parser") == PREFORMATTER_ID:
+        return "".join(args["story"]).upper()
+"""
+
+PLUGIN_NAMES = ("snapplug", "storyplug", "otherplug", "formatplug")
+
+
+class PluginDirTestBase(UnitTestBase):
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.plugin_dir = os.path.join(self.get_temp_dir(), "plugins")
+        os.mkdir(self.plugin_dir)
+        self.write_plugin("snapplug", PLUGIN)
+        self.filename = os.path.join(self.get_temp_dir(), "snapshot")
+        self.config_filename = os.path.join(self.get_temp_dir(), "config.py")
+        open(self.config_filename, "w").close()
+        self.saved = (plugin_utils.plugins[:], plugin_utils.callbacks.copy(),
+                      plugin_utils.bad_plugins[:], sys.path[:])
+        self.reset()
+
+    def tearDown(self):
+        plugins, callbacks, bad_plugins, path = self.saved
+        plugin_utils.plugins[:] = plugins
+        plugin_utils.callbacks.clear()
+        plugin_utils.callbacks.update(callbacks)
+        plugin_utils.bad_plugins[:] = bad_plugins
+        plugin_utils.snapshot = plugin_utils._snapshot_settings = None
+        plugin_utils._lazy_plugins.clear()
+        plugin_utils._lazy_chains.clear()
+        pyblosxom._entryparsers = (None, None)
+        sys.path[:] = path
+        self.unimport()
+        UnitTestBase.tearDown(self)
+
+    def write_plugin(self, name, text):
+        f = open(os.path.join(self.plugin_dir, name + ".py"), "w")
+        f.write(text)
+        f.close()
+
+    def unimport(self):
+        for mem in PLUGIN_NAMES:
+            sys.modules.pop(mem, None)
+
+    def reset(self):
+        del plugin_utils.plugins[:]
+        del plugin_utils.bad_plugins[:]
+        plugin_utils.callbacks.clear()
+        plugin_utils._lazy_plugins.clear()
+        plugin_utils._lazy_chains.clear()
+        pyblosxom._entryparsers = (None, None)
+
+    def initialize(self, plugin_list=None, lazy=False):
+        self.reset()
+        plugin_utils.initialize_plugins([self.plugin_dir], plugin_list,
+                                        self.filename, lazy,
+                                        self.config_filename)
+        return pyblosxom.get_entryparsers()
+
+
+class SnapshotTest(PluginDirTestBase):
+    def test_snapshot(self):
+        entryparsers = self.initialize()
+        self.eq_(plugin_utils.snapshot["plugins"], ["snapplug"])
+        assert os.path.exists(self.filename)
+
+        entryparsers2 = self.initialize()
+        assert plugin_utils.snapshot is not None
+        self.eq_(plugin_utils.snapshot["callbacks"]["snapplug"],
+                 ["entryparser", "start"])
+        self.eq_(plugin_utils.get_callback_chain("start"),
+                 [sys.modules["snapplug"].cb_start])
+        self.eq_(entryparsers2, entryparsers)
+        assert entryparsers2["foo"] is sys.modules["snapplug"].parse_foo
+
+    def test_saved_once(self):
+        import threading
+        self.reset()
+        plugin_utils.initialize_plugins([self.plugin_dir], None,
+                                        self.filename,
+                                        config_filename=self.config_filename)
+        built = []
+        build_snapshot = plugin_utils.build_snapshot
+
+        def counting_build_snapshot(*args):
+            built.append(1)
+            # give the other threads a chance to get here, too
+            time.sleep(0.01)
+            return build_snapshot(*args)
+
+        plugin_utils.build_snapshot = counting_build_snapshot
+        try:
+            threads = [threading.Thread(target=plugin_utils.save_snapshot,
+                                        args=({},))
+                       for i in range(4)]
+            for mem in threads:
+                mem.start()
+            for mem in threads:
+                mem.join()
+        finally:
+            plugin_utils.build_snapshot = build_snapshot
+        self.eq_(built, [1])
+        self.eq_(sorted(os.listdir(self.get_temp_dir())),
+                 ["config.py", "plugins", "snapshot"])
+
+    def test_no_config_filename(self):
+        self.config_filename = None
+        self.initialize()
+        self.eq_(plugin_utils.snapshot, None)
+        assert not os.path.exists(self.filename)
+
+    def test_out_of_date(self):
+        self.initialize()
+        load = lambda: plugin_utils.load_snapshot(self.filename,
+                                                  [self.plugin_dir], None,
+                                                  self.config_filename)
+        assert load() is not None
+
+        # different settings
+        self.eq_(plugin_utils.load_snapshot(self.filename, [self.plugin_dir],
+                                            ["snapplug"],
+                                            self.config_filename), None)
+
+        # without config.py's filename, we can't tell whether it changed
+        self.eq_(plugin_utils.load_snapshot(self.filename, [self.plugin_dir],
+                                            None, None), None)
+
+        # a changed config.py
+        mtime = time.time() + 10
+        os.utime(self.config_filename, (mtime, mtime))
+        self.eq_(load(), None)
+        self.initialize()
+        assert load() is not None
+
+        # a new plugin
+        self.write_plugin("otherplug", "")
+        self.eq_(load(), None)
+        os.remove(os.path.join(self.plugin_dir, "otherplug.py"))
+        assert load() is not None
+
+        # a changed plugin
+        filename = os.path.join(self.plugin_dir, "snapplug.py")
+        mtime = time.time() + 20
+        os.utime(filename, (mtime, mtime))
+        self.eq_(load(), None)
+
+
+class LazyLoadTest(PluginDirTestBase):
+    def setUp(self):
+        PluginDirTestBase.setUp(self)
+        self.write_plugin("storyplug", STORY_PLUGIN)
+
+    def initialize_lazy(self, plugin_list=None):
+        # the first run imports everything and saves the snapshot
+        self.initialize(plugin_list)
+        self.unimport()
+        return self.initialize(plugin_list, lazy=True)
+
+    def test_imported_on_first_use(self):
+        entryparsers = self.initialize_lazy()
+        assert "foo" in entryparsers
+        self.eq_(plugin_utils.plugins, [])
+        assert "snapplug" not in sys.modules
+        assert "storyplug" not in sys.modules
+
+        chain = plugin_utils.get_callback_chain("story")
+        storyplug = sys.modules["storyplug"]
+        self.eq_(chain, [storyplug.cb_story])
+        self.eq_(plugin_utils.plugins, [storyplug])
+        assert "snapplug" not in sys.modules
+
+        # the lazy entryparser imports its plugin
+        self.eq_(entryparsers["foo"]("a.foo", None), {"title": "a.foo"})
+        self.eq_(plugin_utils.plugins,
+                 [sys.modules["snapplug"], storyplug])
+
+    def test_load_order(self):
+        self.initialize_lazy(["storyplug", "snapplug"])
+
+        # snapplug is imported first, but stays second
+        self.eq_(plugin_utils.get_plugin_by_name("snapplug"),
+                 sys.modules["snapplug"])
+        chain = plugin_utils.get_callback_chain("start")
+        self.eq_(chain, [sys.modules["storyplug"].cb_start,
+                         sys.modules["snapplug"].cb_start])
+        self.eq_([mem.__name__ for mem in plugin_utils.plugins],
+                 ["storyplug", "snapplug"])
+
+    def test_chain_without_loading(self):
+        self.initialize_lazy()
+        chain = plugin_utils.get_callback_chain("start", load=False)
+        self.eq_([(mem.plugin_name, mem.chain) for mem in chain],
+                 [("snapplug", "start"), ("storyplug", "start")])
+        self.eq_(plugin_utils.plugins, [])
+
+    def test_preformatter_imported_for_its_parser(self):
+        from Pyblosxom.blosxom import blosxom_entry_parser
+        from Pyblosxom.pyblosxom import Request
+        self.write_plugin("formatplug", FORMAT_PLUGIN)
+        self.initialize_lazy()
+        self.eq_(plugin_utils.snapshot["preformatters"],
+                 {"formatplug": "shout"})
+
+        filename = os.path.join(self.get_temp_dir(), "entry.txt")
+        req = Request({}, {}, {})
+
+        def parse(text):
+            f = open(filename, "w")
+            f.write(text)
+            f.close()
+            return blosxom_entry_parser(filename, req)["body"]
+
+        # a plain entry doesn't import the preformatter
+        self.eq_(parse("Title\nbody\n"), "body\n")
+        assert "formatplug" not in sys.modules
+
+        self.eq_(parse("Title\n#parser shout\nbody\n"), "BODY\n")
+        assert "formatplug" in sys.modules
+        self.eq_(parse("Title\nbody\n"), "body\n")
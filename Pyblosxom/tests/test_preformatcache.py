@@ -0,0 +1,68 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+
+from Pyblosxom.tests import UnitTestBase
+from Pyblosxom.cache import preformat
+from Pyblosxom.cache.store import DiskStore
+
+
+class PreformatCacheTest(UnitTestBase):
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.calls = []
+
+    def get_config(self):
+        return {"datadir": os.path.join(self.get_temp_dir(), "entries"),
+                "preformatcache_backend": "disk",
+                "preformatcache_dir": os.path.join(self.get_temp_dir(),
+                                                   "preformatcache")}
+
+    def parse(self, story):
+        self.calls.append(story)
+        return "<p>%s</p>" % story
+
+    def preformat(self, cfg, story, settings=None):
+        return preformat.cached_preformat(cfg, "test", settings or {}, story,
+                                          lambda: self.parse(story))
+
+    def test_disabled(self):
+        cfg = {"datadir": "/tmp"}
+        self.eq_(preformat.get_preformat_cache(cfg), None)
+        self.eq_(self.preformat(cfg, "a"), "<p>a</p>")
+        self.eq_(self.preformat(cfg, "a"), "<p>a</p>")
+        self.eq_(self.calls, ["a", "a"])
+
+    def test_key(self):
+        key = preformat.get_preformat_key("reST", {"a": 1, "b": 2}, "story")
+        self.eq_(key, preformat.get_preformat_key("reST", {"b": 2, "a": 1},
+                                                  "story"))
+        assert key != preformat.get_preformat_key("markdown",
+                                                  {"a": 1, "b": 2}, "story")
+        assert key != preformat.get_preformat_key("reST", {"a": 1, "b": 3},
+                                                  "story")
+        assert key != preformat.get_preformat_key("reST", {"a": 1, "b": 2},
+                                                  "story 2")
+
+    def test_cached(self):
+        cfg = self.get_config()
+        self.eq_(self.preformat(cfg, "a"), "<p>a</p>")
+        self.eq_(self.preformat(cfg, "a"), "<p>a</p>")
+        self.eq_(self.calls, ["a"])
+
+        # different text or settings are converted again
+        self.eq_(self.preformat(cfg, "b"), "<p>b</p>")
+        self.eq_(self.preformat(cfg, "a", {"level": 2}), "<p>a</p>")
+        self.eq_(self.calls, ["a", "b", "a"])
+
+        # the html is on disk for other processes
+        key = preformat.get_preformat_key("test", {}, "a")
+        store = DiskStore(cfg["preformatcache_dir"])
+        self.eq_(store.get(key), "<p>a</p>")
@@ -10,6 +10,7 @@
 from Pyblosxom.plugins import pycalendar
 
 import os
+import time
 import unittest
 import tempfile
 import shutil
@@ -41,3 +42,43 @@ class PyCalendarTest(unittest.TestCase):
         cal = data["calendar"]
 
         cal.generate_calendar()
+
+    def write_entry(self, filename, timetuple):
+        filename = os.path.join(self.get_datadir(), filename)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        fp = open(filename, "w")
+        fp.write("Title\nbody\n")
+        fp.close()
+        mtime = time.mktime(timetuple)
+        os.utime(filename, (mtime, mtime))
+
+    def test_marks_days_and_links_months(self):
+        self.write_entry("a.txt", (2009, 11, 3, 12, 0, 0, 0, 1, -1))
+        self.write_entry("b.txt", (2010, 1, 17, 12, 0, 0, 0, 1, -1))
+        self.write_entry("c.txt", (2010, 4, 1, 12, 0, 0, 0, 1, -1))
+
+        from Pyblosxom.pyblosxom import Request
+        req = Request({"datadir": self.get_datadir(),
+                       "base_url": "http://bl.og",
+                       "static_monthnumbers": 1},
+                      {},
+                      {"entry_list": [dict(PyCalendarTest.entry1)],
+                       "extensions": {"txt": None},
+                       "pi_yr": "2010",
+                       "pi_mo": "01"})
+        pycalendar.cb_prepare({"request": req})
+
+        cal = req.get_data()["calendar"]
+        cal.generate_calendar()
+
+        self.assertEquals(cal._entries.keys(), ["17"])
+        self.assertEquals(cal._entries["17"],
+                          ("http://bl.og/2010/01/17", "17"))
+        html = str(cal)
+        self.assert_('<a href="http://bl.og/2009/%s">&lt;</a>' %
+                     time.strftime("%b", (2009, 11, 1, 0, 0, 0, 0, 1, -1))
+                     in html)
+        self.assert_('<a href="http://bl.og/2010/%s">&gt;</a>' %
+                     time.strftime("%b", (2010, 4, 1, 0, 0, 0, 0, 1, -1))
+                     in html)
@@ -65,3 +65,44 @@ class Test_pycategories(PluginTest):
                  '<li><a href="http://bl.og//cat2/index.html">cat2/</a> (1)</li>',
                  '</ul></li>',
                  '</ul>']))
+
+    def test_nested_categories(self):
+        self.generate_entry("test1.txt")
+        self.generate_entry("dev/pyblosxom/releases/r1.txt")
+        self.generate_entry("dev/pyblosxom/releases/r2.txt")
+        self.generate_entry("dev/other.txt")
+
+        pycategories.cb_prepare(self.args)
+        self.assertEquals(
+            str(self.request.get_data()["categorylinks"]),
+            "\n".join(
+                ['<ul class="categorygroup">',
+                 '<li><a href="http://bl.og//index.html">/</a> (4)</li>',
+                 '<li><ul class="categorygroup">',
+                 '<li><a href="http://bl.og//dev/index.html">dev/</a> (3)</li>',
+                 '<li><ul class="categorygroup">',
+                 '<li><a href="http://bl.og//dev/pyblosxom/index.html">'
+                 'pyblosxom/</a> (2)</li>',
+                 '<li><ul class="categorygroup">',
+                 '<li><a href="http://bl.og//dev/pyblosxom/releases/index.html">'
+                 'releases/</a> (2)</li>',
+                 '</ul></li></ul></li></ul></li>',
+                 '</ul>']))
+
+    def test_counts_follow_entry_index(self):
+        self.generate_entry("cat1/a.txt")
+        pycategories.cb_prepare(self.args)
+        self.assert_("cat1/</a> (1)" in
+                     str(self.request.get_data()["categorylinks"]))
+
+        self.generate_entry("cat1/b.txt")
+        os.remove(os.path.join(self.datadir, "cat1", "a.txt"))
+        self.generate_entry("cat2/c.txt")
+
+        # a new request sees the updated index
+        del self.request.get_data()["entry_index"]
+        pycategories.cb_prepare(self.args)
+        html = str(self.request.get_data()["categorylinks"])
+        self.assert_("cat1/</a> (1)" in html)
+        self.assert_("cat2/</a> (1)" in html)
+        self.assert_("/</a> (2)" in html)
@@ -0,0 +1,183 @@
+#######################################################################
+# This file is part of Pyblosxom.
+#
+# Copyright (C) 2011 by the Pyblosxom team.  See AUTHORS.
+#
+# Pyblosxom is distributed under the MIT license.  See the file
+# LICENSE for distribution details.
+#######################################################################
+
+import os
+import sys
+import time
+import httplib
+import signal
+import threading
+import subprocess
+
+from Pyblosxom.tests import UnitTestBase
+from Pyblosxom import server
+
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    if environ["PATH_INFO"] == "/stream":
+        # no Content-Length
+        return iter(["one", "two"])
+    return ["%s %s %s" % (environ["REQUEST_METHOD"], environ["PATH_INFO"],
+                          environ["wsgi.input"].read())]
+
+
+# a server that answers with the time its process started and reloads
+# when the config.py next to it changes
+RELOAD_SCRIPT = """
+import sys
+import time
+sys.path.insert(0, %(dir)r)
+
+from Pyblosxom import server
+
+started = str(time.time())
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain"),
+                              ("Content-Length", str(len(started)))])
+    return [started]
+
+sock = server.get_inherited_socket()
+if sock is None:
+    sock = server.bind("127.0.0.1", 0)
+    print sock.getsockname()[1]
+    sys.stdout.flush()
+
+s = server.Server(app, sock, threads=2, quiet=True, argv=[%(script)r])
+s.poll_interval = 0.05
+s.run()
+"""
+
+
+class ServerTest(UnitTestBase):
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.server = server.PooledWSGIServer(("127.0.0.1", 0), app,
+                                              threads=2, quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={"poll_interval": 0.05})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.stop()
+        self.server.server_close()
+        self.thread.join()
+        UnitTestBase.tearDown(self)
+
+    def connect(self):
+        return httplib.HTTPConnection("127.0.0.1", self.server.server_port)
+
+    def request(self, conn, method, path, body=None):
+        conn.request(method, path, body)
+        resp = conn.getresponse()
+        return resp, resp.read()
+
+    def test_keep_alive(self):
+        conn = self.connect()
+        resp, body = self.request(conn, "GET", "/one")
+        self.eq_(body, "GET /one ")
+        self.eq_(resp.getheader("connection"), None)
+        sock = conn.sock
+
+        resp, body = self.request(conn, "GET", "/two")
+        self.eq_(body, "GET /two ")
+        # the second request went over the same connection
+        assert conn.sock is sock
+        conn.close()
+
+    def test_post_body_is_bounded(self):
+        conn = self.connect()
+        resp, body = self.request(conn, "POST", "/comment", "a=1&b=2")
+        self.eq_(body, "POST /comment a=1&b=2")
+
+        resp, body = self.request(conn, "GET", "/")
+        self.eq_(body, "GET / ")
+        conn.close()
+
+    def test_head(self):
+        conn = self.connect()
+        resp, body = self.request(conn, "HEAD", "/entry")
+        self.eq_(body, "")
+        self.eq_(resp.getheader("content-length"), str(len("HEAD /entry ")))
+
+        resp, body = self.request(conn, "GET", "/entry")
+        self.eq_(body, "GET /entry ")
+        conn.close()
+
+    def test_close_without_content_length(self):
+        conn = self.connect()
+        resp, body = self.request(conn, "GET", "/stream")
+        self.eq_(body, "onetwo")
+        self.eq_(resp.getheader("connection"), "close")
+        conn.close()
+
+
+    def test_idle_connection_closed_for_waiting_one(self):
+        # both threads hold an idle kept-alive connection
+        conns = [self.connect(), self.connect()]
+        for conn in conns:
+            resp, body = self.request(conn, "GET", "/")
+            self.eq_(body, "GET / ")
+
+        # a third connection doesn't wait for the keep-alive timeout
+        start = time.time()
+        conn = self.connect()
+        resp, body = self.request(conn, "GET", "/three")
+        self.eq_(body, "GET /three ")
+        assert time.time() - start < self.server.keepalive_timeout
+        for mem in conns + [conn]:
+            mem.close()
+
+
+class ReloadTest(UnitTestBase):
+    def test_reload_keeps_socket(self):
+        if os.name != "posix":
+            return
+        tempdir = self.get_temp_dir()
+        config_filename = os.path.join(tempdir, "config.py")
+        open(config_filename, "w").close()
+        script = os.path.join(tempdir, "serve.py")
+        fp = open(script, "w")
+        fp.write(RELOAD_SCRIPT % {"dir": tempdir, "script": script})
+        fp.close()
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(
+            os.path.abspath(server.__file__)))
+        proc = subprocess.Popen([sys.executable, script], env=env,
+                                stdout=subprocess.PIPE)
+        try:
+            port = int(proc.stdout.readline())
+
+            def get():
+                conn = httplib.HTTPConnection("127.0.0.1", port)
+                try:
+                    conn.request("GET", "/")
+                    return conn.getresponse().read()
+                finally:
+                    conn.close()
+
+            started = get()
+            mtime = time.time() + 10
+            os.utime(config_filename, (mtime, mtime))
+
+            # the new process takes over the socket; connections made
+            # while it starts wait in the backlog
+            deadline = time.time() + 10
+            body = started
+            while body == started and time.time() < deadline:
+                body = get()
+                time.sleep(0.05)
+            assert body != started
+            self.eq_(proc.poll(), None)
+        finally:
+            os.kill(proc.pid, signal.SIGTERM)
+            proc.wait()
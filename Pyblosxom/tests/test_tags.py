@@ -84,3 +84,281 @@ class TagsTest(PluginTest):
                  '<a class="biggestTag" href="http://bl.og//tag/tag2">tag2</a>',
                  '<a class="smallestTag" href="http://bl.og//tag/tag3">tag3</a>',
                  "</p>"]))
+
+    def build_tag_request(self, entries):
+        from Pyblosxom.blosxom import blosxom_entry_parser
+
+        datadir = self.get_datadir()
+        for name, (tagsline, mtime) in entries.items():
+            filename = os.path.join(datadir, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            fp = open(filename, "w")
+            if tagsline is None:
+                fp.write("Title\nbody\n")
+            else:
+                fp.write("Title\n#tags %s\nbody\n" % tagsline)
+            fp.close()
+            os.utime(filename, (mtime, mtime))
+
+        return Request({"datadir": datadir}, {},
+                       {"extensions": {"txt": blosxom_entry_parser}})
+
+    def build_tag_index(self, entries):
+        from Pyblosxom.entryindex import EntryIndex
+
+        req = self.build_tag_request(entries)
+        entry_index = EntryIndex(self.get_datadir())
+        entry_index.scan(req)
+
+        index = tags.TagIndex(os.path.join(self.tmpdir, "tags.index"))
+        index.load()
+        index.update(req, entry_index.entries, entry_index.generation)
+        index.save()
+        return index
+
+    def write_old_index(self, tagsdata):
+        import cPickle
+        path = os.path.join(self.tmpdir, "tags.index")
+        fp = open(path, "wb")
+        cPickle.dump(tagsdata, fp)
+        fp.close()
+        return path
+
+    def test_tag_index_update(self):
+        from Pyblosxom.entryindex import EntryIndex
+
+        req = self.build_tag_request({"a.txt": ("tag1, tag2", 1000),
+                                      "b.txt": ("tag1", 2000),
+                                      "cat/c.txt": ("tag3", 3000)})
+        entry_index = EntryIndex(self.get_datadir())
+        entry_index.scan(req)
+
+        path = os.path.join(self.tmpdir, "tags.index")
+        index = tags.TagIndex(path)
+        index.load()
+        self.assertEquals(index.update(req, entry_index.entries), True)
+        index.save()
+
+        datadir = self.get_datadir()
+        self.assertEquals(index.counts, {"tag1": 2, "tag2": 1, "tag3": 1})
+        self.assertEquals(index["tag1"], [os.path.join(datadir, "b.txt"),
+                                          os.path.join(datadir, "a.txt")])
+
+        # a fresh index only reads the postings it's asked for
+        index2 = tags.TagIndex(path)
+        index2.load()
+        self.assertEquals(index2.counts, index.counts)
+        self.assertEquals(index2._postings, {})
+        self.assertEquals(index2["tag1"], index["tag1"])
+        self.assertEquals(index2._postings.keys(), ["tag1"])
+
+        # nothing changed, so nothing gets updated
+        self.assertEquals(index2.update(req, entry_index.entries), False)
+
+        # change b.txt's tags and remove cat/c.txt
+        self.build_tag_request({"b.txt": ("tag2", 4000)})
+        os.remove(os.path.join(datadir, "cat", "c.txt"))
+        entry_index.scan(req)
+
+        self.assertEquals(index2.update(req, entry_index.entries), True)
+        self.assertEquals(index2.counts, {"tag1": 1, "tag2": 2})
+        self.assertEquals(index2["tag2"], [os.path.join(datadir, "b.txt"),
+                                           os.path.join(datadir, "a.txt")])
+
+    def test_tag_index_untagged_entries(self):
+        from Pyblosxom.entryindex import EntryIndex
+
+        req = self.build_tag_request({"a.txt": ("tag1", 1000)})
+        entry_index = EntryIndex(self.get_datadir())
+        entry_index.scan(req)
+        index = self.build_tag_index({"b.txt": (None, 2000)})
+
+        # b.txt is recorded without tags, so a fresh index doesn't
+        # parse it again
+        index2 = tags.TagIndex(index.path)
+        index2.load()
+        filename = os.path.join(self.get_datadir(), "b.txt")
+        self.assertEquals(index2.get_files()[filename][2], [])
+        self.assertEquals(index2.counts, {"tag1": 1})
+
+        # the same entry index generation doesn't read the files map
+        index3 = tags.TagIndex(index.path)
+        index3.load()
+        entry_index.scan(req)
+        self.assertEquals(index3.update(req, entry_index.entries,
+                                        entry_index.generation), False)
+        self.assertEquals(index3._files, None)
+
+    def test_tag_index_replaced(self):
+        index = self.build_tag_index({"a.txt": ("tag1, tag2", 1000),
+                                      "b.txt": ("tag1", 2000)})
+        index2 = tags.TagIndex(index.path)
+        index2.load()
+
+        # another process replaces the file after we read the header
+        self.build_tag_index({"a.txt": ("tag3, tag4, tag5", 1000),
+                              "b.txt": ("tag1, tag2, tag6", 3000),
+                              "c.txt": ("tag1", 4000)})
+
+        # the postings come from the file the header came from
+        datadir = self.get_datadir()
+        self.assertEquals(index2["tag1"], [os.path.join(datadir, "b.txt"),
+                                           os.path.join(datadir, "a.txt")])
+        self.assertEquals(index2["tag2"], [os.path.join(datadir, "a.txt")])
+        self.assertEquals(sorted(index2.get_files().keys()),
+                          [os.path.join(datadir, "a.txt"),
+                           os.path.join(datadir, "b.txt")])
+
+    def test_tag_index_old_format(self):
+        path = self.write_old_index({"tag1": ["a", "b"], "tag2": ["b", "c"]})
+
+        index = tags.TagIndex(path)
+        index.load()
+        self.assertEquals(index.counts, {"tag1": 2, "tag2": 2})
+        self.assertEquals(sorted(index["tag1"]), ["a", "b"])
+
+        # the postings are sorted, so intersecting them finds the
+        # entries that have both tags
+        self.assertEquals(
+            tags.intersect_postings([index.get_postings("tag1"),
+                                     index.get_postings("tag2")]),
+            [(0, "b")])
+
+    def test_old_format_upgraded(self):
+        req = self.build_tag_request({"a.txt": ("tag1", 3000),
+                                      "b.txt": ("tag1", 2000)})
+        datadir = self.get_datadir()
+        path = self.write_old_index(
+            {"tag1": [os.path.join(datadir, "a.txt"),
+                      os.path.join(datadir, "b.txt")]})
+        req.get_configuration()["tags_filename"] = path
+
+        # the postings of an old index are sorted by filename, so the
+        # newest entries aren't first and can't be cut off early
+        index = tags.get_tag_index(req)
+        self.assertEquals(index.has_mtimes(), False)
+        req.get_data()["tagsdata"] = index
+        req.get_configuration()["num_entries"] = 1
+        req.get_http()["PATH_INFO"] = "/tag/tag1"
+        entries = tags.cb_filelist({"request": req})
+        self.assertEquals([e["fn"] for e in entries], ["a"])
+
+        # cb_start replaces the old index right away
+        tags.cb_start({"request": req})
+        index = req.get_data()["tagsdata"]
+        self.assertEquals(index.has_mtimes(), True)
+        self.assertEquals(index.get_postings("tag1"),
+                          [(3000, os.path.join(datadir, "a.txt")),
+                           (2000, os.path.join(datadir, "b.txt"))])
+        fp = open(path, "rb")
+        self.assertEquals(fp.readline(), tags.TAGS_MAGIC)
+        fp.close()
+
+    def test_tag_cloud_tag_index(self):
+        index = self.build_tag_index({"a.txt": ("tag1, tag2, tag3", 1000),
+                                      "b.txt": ("tag1, tag2", 1000),
+                                      "c.txt": ("tag1, tag2", 1000),
+                                      "d.txt": ("tag1, tag2", 1000),
+                                      "e.txt": ("tag1", 1000),
+                                      "f.txt": ("tag1", 1000)})
+        self.request.get_data()["tagsdata"] = index
+
+        tags.cb_head(self.args)
+        self.assertEquals(
+            str(self.args["entry"]["tagcloud"]),
+            "\n".join(
+                ["<p>",
+                 '<a class="biggestTag" href="http://bl.og//tag/tag1">tag1</a>',
+                 '<a class="biggestTag" href="http://bl.og//tag/tag2">tag2</a>',
+                 '<a class="smallestTag" href="http://bl.og//tag/tag3">tag3</a>',
+                 "</p>"]))
+
+    def test_cb_start_builds_index(self):
+        req = self.build_tag_request({"a.txt": ("tag1", 1000)})
+        path = os.path.join(self.tmpdir, "tags.db")
+        req.get_configuration()["tags_filename"] = path
+
+        tags.cb_start({"request": req})
+        assert os.path.exists(path)
+        tagsdata = req.get_data()["tagsdata"]
+        self.assertEquals(tagsdata.keys(), ["tag1"])
+
+        # once there's a tags index, cb_start doesn't refresh the
+        # entry index
+        req2 = self.build_tag_request({})
+        req2.get_configuration()["tags_filename"] = path
+        tags.cb_start({"request": req2})
+        assert "entry_index" not in req2.get_data()
+        self.assertEquals(req2.get_data()["tagsdata"].keys(), ["tag1"])
+
+    def test_intersect_postings(self):
+        a = [(5, "e"), (4, "d"), (2, "b"), (1, "a")]
+        b = [(5, "e"), (3, "c"), (2, "b")]
+        self.assertEquals(tags.intersect_postings([a, b]),
+                          [(5, "e"), (2, "b")])
+        self.assertEquals(tags.intersect_postings([a, b], 1), [(5, "e")])
+        self.assertEquals(tags.intersect_postings([a, []]), [])
+        self.assertEquals(tags.intersect_postings([a]), a)
+
+    def test_union_postings(self):
+        a = [(5, "e"), (2, "b"), (1, "a")]
+        b = [(5, "e"), (3, "c")]
+        self.assertEquals(tags.union_postings([a, b]),
+                          [(5, "e"), (3, "c"), (2, "b"), (1, "a")])
+        self.assertEquals(tags.union_postings([a, b], 2),
+                          [(5, "e"), (3, "c")])
+
+    def test_parse_tag_query(self):
+        tagsdata = {"a": [], "b": [], "c++": []}
+        self.assertEquals(tags.parse_tag_query(tagsdata, "a"), [["a"]])
+        self.assertEquals(tags.parse_tag_query(tagsdata, "c++"), [["c++"]])
+        self.assertEquals(tags.parse_tag_query(tagsdata, "a+b"),
+                          [["a", "b"]])
+        self.assertEquals(tags.parse_tag_query(tagsdata, "a,b"),
+                          [["a"], ["b"]])
+        self.assertEquals(tags.parse_tag_query(tagsdata, "a+b,c++"),
+                          [["a", "b"], ["c++"]])
+        self.assertEquals(tags.parse_tag_query(tagsdata, "x+y"), None)
+
+    def test_filelist_query(self):
+        from Pyblosxom.entryindex import EntryIndex
+
+        req = self.build_tag_request({"a.txt": ("tag1, tag2", 1000),
+                                      "b.txt": ("tag1", 2000),
+                                      "c.txt": ("tag2", 3000)})
+        entry_index = EntryIndex(self.get_datadir())
+        entry_index.scan(req)
+        index = tags.TagIndex(os.path.join(self.tmpdir, "tags.index"))
+        index.update(req, entry_index.entries)
+        req.get_data()["tagsdata"] = index
+        req.get_configuration()["num_entries"] = 0
+
+        def filelist(path_info):
+            req.get_http()["PATH_INFO"] = path_info
+            return [e["fn"]
+                    for e in tags.cb_filelist({"request": req})]
+
+        self.assertEquals(filelist("/tag/tag1+tag2"), ["a"])
+        self.assertEquals(filelist("/tag/tag1,tag2.rss"), ["c", "b", "a"])
+        self.assertEquals(req.get_data()["flavour"], "rss")
+        self.assertEquals(filelist("/tag/nothere"), [])
+
+    def test_tags_html_memoized(self):
+        index = self.build_tag_index({"a.txt": ("tag1, tag2", 1000),
+                                      "b.txt": ("tag1", 1000)})
+        path = index.path
+        self.request.get_data()["tagsdata"] = index
+
+        html = tags.get_tags_html(self.request)
+        self.assertEquals(self.request.get_data()["tags_html"], html)
+        self.assertEquals(
+            tags._tags_html[path].values(), [html])
+
+        # a new generation replaces the cached html
+        del self.request.get_data()["tags_html"]
+        index.generation += 1
+        index.counts["tag3"] = 1
+        html2 = tags.get_tags_html(self.request)
+        assert html2 != html
+        self.assertEquals(tags._tags_html[path].values(), [html2])
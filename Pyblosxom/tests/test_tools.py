@@ -298,6 +298,15 @@ class TestStripper(UnitTestBase):
         s.close()
         return s.gettext()
 
+    def test_sgmlparser(self):
+        import sgmllib
+        s = tools.Stripper()
+        assert isinstance(s, sgmllib.SGMLParser)
+        assert isinstance(s, tools.get_stripper_class())
+        s.feed("<p>abc")
+        s.close()
+        self.eq_(s.gettext(), " abc")
+
     def test_replaces_html_markup_from_string_with_space(self):
         s = tools.Stripper()
         for mem in (("", ""),
@@ -437,3 +446,235 @@ class Testconvert_configini_values(UnitTestBase):
     # FIXME - test tools.walk
 
     # FIXME - test filestat
+
+
+class Testgzip(UnitTestBase):
+    def test_gzip_string(self):
+        import gzip
+        from StringIO import StringIO
+
+        s = "abc " * 100
+        gz = tools.gzip_string(s)
+        self.eq_(gzip.GzipFile(fileobj=StringIO(gz)).read(), s)
+
+        # the same input always compresses to the same bytes
+        self.eq_(tools.gzip_string(s), gz)
+
+    def test_accepts_gzip(self):
+        for mem in (("", False),
+                    ("gzip", True),
+                    ("deflate, gzip", True),
+                    ("gzip;q=0.5", True),
+                    ("gzip;q=0", False),
+                    ("identity", False),
+                    ("*", True),
+                    ("gzip;q=0, *", False)):
+            self.eq_(tools.accepts_gzip(mem[0]), mem[1], mem[0])
+
+    def test_gzip_etag(self):
+        self.eq_(tools.gzip_etag('"abc"'), '"abc-gzip"')
+        self.eq_(tools.gzip_etag('W/"abc"'), 'W/"abc-gzip"')
+        self.eq_(tools.gzip_etag('abc'), 'abc-gzip')
+
+    def test_compressed_response_etag(self):
+        from Pyblosxom.pyblosxom import PyblosxomWSGIApp, Response
+
+        class App(PyblosxomWSGIApp):
+            # PyblosxomWSGIApp.__init__ imports config.py
+            def __init__(self, config):
+                self.config = config
+
+        app = App({"wsgi_gzip": True})
+        env = {"HTTP_ACCEPT_ENCODING": "gzip"}
+
+        def build_response(status):
+            response = Response(None)
+            response.set_status(status)
+            response.add_header("Content-Type", "text/html")
+            response.add_header("ETag", '"abc"')
+            response.write("abc " * 100)
+            return response
+
+        response = build_response("200 OK")
+        app.compress_response(env, response)
+        self.eq_(response.headers["Content-Encoding"], "gzip")
+        self.eq_(response.headers["ETag"], '"abc-gzip"')
+
+        response = build_response("304 Not Modified")
+        app.compress_response(env, response)
+        self.eq_(response.headers["ETag"], '"abc-gzip"')
+
+        response = build_response("200 OK")
+        app.compress_response({}, response)
+        self.eq_(response.headers["ETag"], '"abc"')
+
+
+class Testlatest_comment_time(UnitTestBase):
+    def test_write_and_read(self):
+        comment_dir = self.get_temp_dir()
+        self.eq_(tools.get_latest_comment_time(comment_dir), -1)
+
+        tools.write_latest_comment_time(comment_dir, 1234.5)
+        self.eq_(tools.get_latest_comment_time(comment_dir), 1234.5)
+
+        tools.write_latest_comment_time(comment_dir, 1235.5)
+        self.eq_(tools.get_latest_comment_time(comment_dir), 1235.5)
+
+    def test_concurrent_writers(self):
+        import threading
+        comment_dir = self.get_temp_dir()
+        errors = []
+
+        def write():
+            for i in range(50):
+                try:
+                    tools.write_latest_comment_time(comment_dir, i)
+                except (IOError, OSError), e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=write) for i in range(4)]
+        for mem in threads:
+            mem.start()
+        for mem in threads:
+            mem.join()
+        self.eq_(errors, [])
+        self.eq_(os.listdir(comment_dir), [tools.LATEST_COMMENT_FILE])
+
+    def test_old_pickle_format(self):
+        import cPickle
+        comment_dir = self.get_temp_dir()
+        f = open(os.path.join(comment_dir, tools.LATEST_COMMENT_FILE), "w")
+        cPickle.dump(1234.5, f)
+        f.close()
+        self.eq_(tools.get_latest_comment_time(comment_dir), 1234.5)
+
+
+class Testget_time_fields(UnitTestBase):
+    def test_matches_strftime(self):
+        import time
+        formats = {"ti": "%H:%M",
+                   "mo": "%b",
+                   "mo_num": "%m",
+                   "da": "%d",
+                   "dw": "%A",
+                   "yr": "%Y",
+                   "fulltime": "%Y%m%d%H%M%S",
+                   "date": "%a, %d %b %Y"}
+
+        for mtime in (0, 1171480440, 1234567890, 1301234567, 1356998399):
+            timetuple = time.localtime(mtime)
+            fields = tools.get_time_fields(timetuple)
+            for key, fmt in formats.items():
+                self.eq_(fields[key], time.strftime(fmt, timetuple), key)
+
+            gmtimetuple = time.gmtime(mtime)
+            self.eq_(fields["mtime"], mtime)
+            self.eq_(fields["w3cdate"],
+                     time.strftime("%Y-%m-%dT%H:%M:%SZ", gmtimetuple))
+
+    def test_rfc822date(self):
+        import time
+        self.eq_(tools.format_rfc822date(time.gmtime(1171480440)),
+                 "Wed, 14 Feb 2007 19:14 GMT")
+
+    def test_memoized(self):
+        import time
+        timetuple = time.localtime(1171480440)
+        self.assert_(tools.get_time_fields(timetuple) is
+                     tools.get_time_fields(tuple(timetuple)))
+
+
+class Testget_config(UnitTestBase):
+    def test_per_thread(self):
+        import threading
+        import time
+
+        failures = []
+
+        def worker(i):
+            cfg = {"log_level": "error", "n": i}
+            tools.initialize(cfg)
+            time.sleep(0.01)
+            if tools.get_config() is not cfg:
+                failures.append(i)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.eq_(failures, [])
+
+    def test_month_tables(self):
+        tools.initialize({})
+        self.eq_(tools.month2num["Feb"], "02")
+        self.eq_(tools.num2month[2], "Feb")
+        self.eq_(tools.num2month["02"], "Feb")
+        assert "Feb" in tools.MONTHS
+
+        # the tables are built once per locale
+        month2num = tools.month2num
+        tools.initialize({})
+        assert tools.month2num is month2num
+
+
+class TestConfigOverlay(UnitTestBase):
+    def test_reads_through(self):
+        base = {"a": 1, "b": 2}
+        cfg = tools.ConfigOverlay(base)
+        self.eq_(cfg["a"], 1)
+        self.eq_(cfg.get("b"), 2)
+        self.eq_(cfg.get("c", 3), 3)
+        assert "a" in cfg
+        assert not cfg.has_key("c")
+        self.eq_(sorted(cfg.keys()), ["a", "b"])
+
+    def test_copy_on_write(self):
+        base = {"a": 1, "b": 2}
+        cfg = tools.ConfigOverlay(base)
+        cfg["a"] = 10
+        cfg.setdefault("c", 30)
+        del cfg["b"]
+
+        self.eq_(base, {"a": 1, "b": 2})
+        self.eq_(cfg.copy(), {"a": 10, "c": 30})
+        self.eq_(dict(cfg), {"a": 10, "c": 30})
+        self.eq_(len(cfg), 2)
+        assert "b" not in cfg
+        self.eq_(cfg.get("b", "gone"), "gone")
+        self.assertRaises(KeyError, lambda: cfg["b"])
+        self.assertRaises(KeyError, cfg.__delitem__, "b")
+
+        cfg["b"] = 20
+        self.eq_(cfg["b"], 20)
+        self.eq_(base["b"], 2)
+
+    def test_listing(self):
+        base = {"a": 1, "b": 2, "c": 3}
+        cfg = tools.ConfigOverlay(base)
+        cfg["a"] = 10
+        cfg["d"] = 40
+        del cfg["b"]
+
+        expected = {"a": 10, "c": 3, "d": 40}
+        self.eq_(sorted(cfg.keys()), sorted(expected.keys()))
+        self.eq_(sorted(cfg), sorted(expected.keys()))
+        self.eq_(sorted(cfg.items()), sorted(expected.items()))
+        self.eq_(len(cfg), 3)
+
+        # update_dict does what dict.update does
+        d = {"b": "kept", "e": 5}
+        cfg.update_dict(d)
+        self.eq_(d, {"a": 10, "b": "kept", "c": 3, "d": 40, "e": 5})
+        d = {"e": 5}
+        cfg.update_dict(d)
+        self.eq_(d, {"a": 10, "c": 3, "d": 40, "e": 5})
+
+    def test_pickle(self):
+        import cPickle
+        cfg = tools.ConfigOverlay({"a": 1, "b": 2})
+        del cfg["b"]
+        self.eq_(cPickle.loads(cPickle.dumps(cfg)), {"a": 1})
+
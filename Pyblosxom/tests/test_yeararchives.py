@@ -32,3 +32,20 @@ class Test_yeararchives(PluginTest):
  
             self.assertEquals(yeararchives.parse_path_info(testin),
                               testout)
+
+    def test_linear_archive(self):
+        for name, (year, month, day) in (("a.txt", (2003, 2, 5)),
+                                         ("b.txt", (2003, 11, 20)),
+                                         ("c.txt", (2004, 1, 2))):
+            filename = os.path.join(self.datadir, name)
+            fp = open(filename, "w")
+            fp.write("Title\nbody\n")
+            fp.close()
+            mtime = time.mktime((year, month, day, 12, 0, 0, 0, 0, -1))
+            os.utime(filename, (mtime, mtime))
+
+        self.data["extensions"] = {"txt": None}
+        self.config["archive_template"] = "%(Y)s-%(m)s-%(d)s.%(f)s"
+        archives = yeararchives.YearArchives(self.request)
+        self.assertEquals(str(archives),
+                          "2004-01-02.html\n2003-11-20.html")
@@ -10,7 +10,6 @@
 """Utility module for functions that are useful to Pyblosxom and plugins.
 """
 
-import sgmllib
 import re
 import os
 import time
@@ -18,9 +17,12 @@ import os.path
 import stat
 import sys
 import locale
-import urllib
-import inspect
-import textwrap
+import threading
+import UserDict
+
+# sgmllib, urllib, inspect and textwrap are imported where they're
+# used.  they're slow to import and most requests don't need them,
+# which matters for CGI where every request imports this module.
 
 # Pyblosxom imports
 from Pyblosxom import plugin_utils
@@ -57,68 +59,176 @@ _VAR_REGEXP = re.compile(r"""
     )
     """, re.VERBOSE)
 
-# reference to the pyblosxom config dict
+# reference to the pyblosxom config dict.  this is the config for the
+# process--threads handling requests use their own (see get_config).
 _config = {}
 
+# per-thread state: the config.py dict for the request this thread is
+# handling
+_local = threading.local()
+
+# LC_TIME locale -> (month2num, num2month, MONTHS)
+_month_tables = {}
+
 
 def initialize(config):
     """Initializes the tools module.
 
     This gives the module a chance to use configuration from the
-    pyblosxom config.py file.
+    pyblosxom config.py file.  The config is kept per thread, so
+    threads handling different requests don't step on each other.
 
     This should be called from ``Pyblosxom.pyblosxom.Pyblosxom.initialize``.
     """
     global _config
     _config = config
+    _local.config = config
 
-    # Month names tend to differ with locale
-    global month2num
+    # Month names tend to differ with locale, so the tables are built
+    # once per locale
+    global month2num, num2month, MONTHS
+    month2num, num2month, MONTHS = get_month_tables()
+
+
+def get_config():
+    """Returns the config.py dict for the request this thread is
+    handling.
+    """
+    config = getattr(_local, "config", None)
+    if config is None:
+        config = _config
+    return config
+
+
+def get_month_tables():
+    """Returns the month tables for the current ``LC_TIME`` locale.
+
+    :returns: tuple of (month2num, num2month, MONTHS) where month2num
+              maps month abbreviations (Jan) to numbers ("01"),
+              num2month maps numbers ("01" and 1) to abbreviations,
+              and MONTHS is a list of all of those
+    """
+    abbrs = get_locale_names()[0]
+    tables = _month_tables.get(abbrs)
+    if tables is not None:
+        return tables
+
+    month2num = {'nil': '00'}
+    for i, month_abbr in enumerate(abbrs):
+        month2num[month_abbr] = "%02d" % (i + 1)
 
-    try:
-        month2num = {'nil': '00',
-                     locale.nl_langinfo(locale.ABMON_1): '01',
-                     locale.nl_langinfo(locale.ABMON_2): '02',
-                     locale.nl_langinfo(locale.ABMON_3): '03',
-                     locale.nl_langinfo(locale.ABMON_4): '04',
-                     locale.nl_langinfo(locale.ABMON_5): '05',
-                     locale.nl_langinfo(locale.ABMON_6): '06',
-                     locale.nl_langinfo(locale.ABMON_7): '07',
-                     locale.nl_langinfo(locale.ABMON_8): '08',
-                     locale.nl_langinfo(locale.ABMON_9): '09',
-                     locale.nl_langinfo(locale.ABMON_10): '10',
-                     locale.nl_langinfo(locale.ABMON_11): '11',
-                     locale.nl_langinfo(locale.ABMON_12): '12'}
-
-    except AttributeError:
-        # Windows doesn't have nl_langinfo, so we use one that
-        # only return English.
-        # FIXME - need a better hack for this issue.
-        month2num = {'nil': '00',
-                     "Jan": '01',
-                     "Feb": '02',
-                     "Mar": '03',
-                     "Apr": '04',
-                     "May": '05',
-                     "Jun": '06',
-                     "Jul": '07',
-                     "Aug": '08',
-                     "Sep": '09',
-                     "Oct": '10',
-                     "Nov": '11',
-                     "Dec": '12'}
-
-    # This is not python 2.1 compatible (Nifty though)
-    # num2month = dict(zip(month2num.itervalues(), month2num))
-    global num2month
     num2month = {}
     for month_abbr, month_num in month2num.items():
         num2month[month_num] = month_abbr
         num2month[int(month_num)] = month_abbr
 
     # all the valid month possibilities
-    global MONTHS
-    MONTHS = num2month.keys() + month2num.keys()
+    months = num2month.keys() + month2num.keys()
+
+    tables = (month2num, num2month, months)
+    _month_tables[abbrs] = tables
+    return tables
+
+
+# English names for dates that must be in English regardless of the
+# locale (rfc822 dates).  Indexed by tm_wday and tm_mon - 1.
+ENGLISH_DAY_ABBR = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+ENGLISH_MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                      "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+# LC_TIME locale -> (month abbreviations, day names, day abbreviations)
+_locale_names = {}
+
+# (timetuple, LC_TIME locale) -> dict of date fields
+_time_fields = {}
+_TIME_FIELDS_MAX = 10000
+
+
+def get_locale_names():
+    """Returns the month abbreviations, day names, and day
+    abbreviations for the current ``LC_TIME`` locale.  These are what
+    ``%b``, ``%A``, and ``%a`` expand to in ``time.strftime``.
+
+    :returns: tuple of (month abbreviations indexed by tm_mon - 1,
+              day names indexed by tm_wday, day abbreviations indexed
+              by tm_wday)
+    """
+    loc = locale.setlocale(locale.LC_TIME)
+    names = _locale_names.get(loc)
+    if names is None:
+        # January 1st through 7th 2001 are Monday through Sunday
+        days = [(2001, 1, i + 1, 0, 0, 0, i, i + 1, 0) for i in range(7)]
+        names = (
+            tuple([time.strftime("%b", (2001, i + 1, 1, 0, 0, 0, 0, 1, 0))
+                   for i in range(12)]),
+            tuple([time.strftime("%A", day) for day in days]),
+            tuple([time.strftime("%a", day) for day in days]))
+        _locale_names[loc] = names
+    return names
+
+
+def format_w3cdate(gmtimetuple):
+    """Returns the W3C date (``YYYY-MM-DDThh:mm:ssZ``) for a UTC
+    timetuple.
+    """
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % tuple(gmtimetuple[:6])
+
+
+def format_rfc822date(gmtimetuple):
+    """Returns the RFC 822 date (``Wed, 14 Feb 2007 14:14 GMT``) for a
+    UTC timetuple.  Day and month names are in English regardless of
+    the locale.
+    """
+    return "%s, %02d %s %04d %02d:%02d GMT" % (
+        ENGLISH_DAY_ABBR[gmtimetuple[6]], gmtimetuple[2],
+        ENGLISH_MONTH_ABBR[gmtimetuple[1] - 1], gmtimetuple[0],
+        gmtimetuple[3], gmtimetuple[4])
+
+
+def get_time_fields(timetuple):
+    """Returns a dict of the date fields for a local timetuple: mtime,
+    ti, mo, mo_num, da, dw, yr, fulltime, date, w3cdate, and
+    rfc822date.
+
+    The fields are the same as ``time.strftime`` would give with the
+    current locale (rfc822date is always in English), but they're
+    built from name tables and memoized per timetuple, so this
+    doesn't call ``time.strftime`` or change the locale.
+
+    Don't modify the returned dict.
+
+    :param timetuple: the local time tuple
+
+    :returns: dict of date fields
+    """
+    month_abbr, day_names, day_abbr = get_locale_names()
+    key = (tuple(timetuple[:9]), month_abbr)
+    fields = _time_fields.get(key)
+    if fields is not None:
+        return fields
+
+    mtime = time.mktime(timetuple)
+    yr, mo_num, da, hour, minute, second, wday = tuple(timetuple[:7])
+    mo = month_abbr[mo_num - 1]
+    fields = {"mtime": mtime,
+              "ti": "%02d:%02d" % (hour, minute),
+              "mo": mo,
+              "mo_num": "%02d" % mo_num,
+              "da": "%02d" % da,
+              "dw": day_names[wday],
+              "yr": "%04d" % yr,
+              "fulltime": "%04d%02d%02d%02d%02d%02d" % (
+                  yr, mo_num, da, hour, minute, second),
+              "date": "%s, %02d %s %04d" % (day_abbr[wday], da, mo, yr)}
+
+    gmtimetuple = time.gmtime(mtime)
+    fields["w3cdate"] = format_w3cdate(gmtimetuple)
+    fields["rfc822date"] = format_rfc822date(gmtimetuple)
+
+    if len(_time_fields) >= _TIME_FIELDS_MAX:
+        _time_fields.clear()
+    _time_fields[key] = fields
+    return fields
 
 
 def pwrap(s):
@@ -131,6 +241,7 @@ def pwrap(s):
         s = s[2:]
         linesep = os.linesep + "  "
 
+    import textwrap
     print starter + linesep.join(textwrap.wrap(s, 72))
 
 
@@ -144,6 +255,7 @@ def pwrap_error(s):
         s = s[2:]
         linesep = os.linesep + "  "
 
+    import textwrap
     sys.stderr.write(starter + linesep.join(textwrap.wrap(s, 72)) + "\n")
 
 
@@ -225,6 +337,131 @@ def convert_configini_values(configini):
     return config
 
 
+# marks keys deleted from a ConfigOverlay
+_DELETED = object()
+
+
+class ConfigOverlay(UserDict.DictMixin, object):
+    """A copy-on-write view of a config dict.
+
+    Reads fall through to the base dict.  Changes are kept in the
+    overlay, so the base dict is never modified and can be shared by
+    all requests.  This is cheaper than copying the config for every
+    request since most requests change few (if any) config
+    variables.
+
+    Note that values aren't copied: a plugin that appends to a list in
+    the config changes the base dict, same as it did with a plain
+    copy of the config.
+    """
+    def __init__(self, base):
+        """
+        :param base: the config dict to read through to
+        """
+        self.base = base
+        self.changes = {}
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            value = self.changes[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        return self.base[key]
+
+    def get(self, key, default=None):
+        if key in self.changes:
+            value = self.changes[key]
+            if value is _DELETED:
+                return default
+            return value
+        return self.base.get(key, default)
+
+    def __contains__(self, key):
+        if key in self.changes:
+            return self.changes[key] is not _DELETED
+        return key in self.base
+
+    has_key = __contains__
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        if not key in self:
+            raise KeyError(key)
+        self.changes[key] = _DELETED
+
+    def __iter__(self):
+        changes = self.changes
+        for key in self.base:
+            if not key in changes:
+                yield key
+        for key, value in changes.iteritems():
+            if value is not _DELETED:
+                yield key
+
+    def iteritems(self):
+        changes = self.changes
+        for key, value in self.base.iteritems():
+            if not key in changes:
+                yield key, value
+        for key, value in changes.iteritems():
+            if value is not _DELETED:
+                yield key, value
+
+    def keys(self):
+        return list(self.__iter__())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __len__(self):
+        length = len(self.base)
+        for key, value in self.changes.iteritems():
+            if key in self.base:
+                if value is _DELETED:
+                    length -= 1
+            elif value is not _DELETED:
+                length += 1
+        return length
+
+    def update_dict(self, d):
+        """Updates the dict d with the config the way
+        ``d.update(config)`` would, but without going through the
+        config one key at a time.
+
+        :param d: the dict to update
+        """
+        deleted = [key for key, value in self.changes.iteritems()
+                   if value is _DELETED and key in self.base]
+        saved = [(key, d[key]) for key in deleted if key in d]
+
+        d.update(self.base)
+        for key in deleted:
+            del d[key]
+        d.update(saved)
+
+        for key, value in self.changes.iteritems():
+            if value is not _DELETED:
+                d[key] = value
+
+    def copy(self):
+        """Returns the config with the changes applied as a dict.
+        """
+        config = self.base.copy()
+        for key, value in self.changes.iteritems():
+            if value is _DELETED:
+                config.pop(key, None)
+            else:
+                config[key] = value
+        return config
+
+    def __reduce__(self):
+        # the _DELETED marker doesn't survive pickling
+        return (dict, (self.copy(),))
+
+
 def escape_text(s):
     """Takes in a string and converts:
 
@@ -273,46 +510,75 @@ def urlencode_text(s):
     if not s:
         return s
 
+    import urllib
     return urllib.quote(s)
 
 STANDARD_FILTERS = {"escape": lambda req, vd, s: escape_text(s),
                     "urlencode": lambda req, vd, s: urlencode_text(s)}
 
 
-class Stripper(sgmllib.SGMLParser):
-    """
-    SGMLParser that removes HTML formatting code.
-    """
-    def __init__(self):
-        """
-        Initializes the instance.
-        """
-        self.data = []
-        sgmllib.SGMLParser.__init__(self)
+# the Stripper class, built the first time it's needed so importing
+# this module doesn't import sgmllib
+_stripper_class = None
 
-    def unknown_starttag(self, tag, attrs):
-        """
-        Implements unknown_starttag.  Appends a space to the buffer.
-        """
-        self.data.append(" ")
 
-    def unknown_endtag(self, tag):
-        """
-        Implements unknown_endtag.  Appends a space to the buffer.
-        """
-        self.data.append(" ")
+def get_stripper_class():
+    """
+    Returns the Stripper class, an ``sgmllib.SGMLParser`` subclass
+    that removes HTML formatting code.  Subclass this rather than
+    ``Stripper``, which is a function.
+    """
+    global _stripper_class
+    if _stripper_class is not None:
+        return _stripper_class
 
-    def handle_data(self, data):
-        """
-        Implements handle_data.  Appends data to the buffer.
-        """
-        self.data.append(data)
+    import sgmllib
 
-    def gettext(self):
+    class Stripper(sgmllib.SGMLParser):
         """
-        Returns the buffer.
+        SGMLParser that removes HTML formatting code.
         """
-        return "".join(self.data)
+        def __init__(self):
+            """
+            Initializes the instance.
+            """
+            self.data = []
+            sgmllib.SGMLParser.__init__(self)
+
+        def unknown_starttag(self, tag, attrs):
+            """
+            Implements unknown_starttag.  Appends a space to the buffer.
+            """
+            self.data.append(" ")
+
+        def unknown_endtag(self, tag):
+            """
+            Implements unknown_endtag.  Appends a space to the buffer.
+            """
+            self.data.append(" ")
+
+        def handle_data(self, data):
+            """
+            Implements handle_data.  Appends data to the buffer.
+            """
+            self.data.append(data)
+
+        def gettext(self):
+            """
+            Returns the buffer.
+            """
+            return "".join(self.data)
+
+    _stripper_class = Stripper
+    return Stripper
+
+
+def Stripper():
+    """
+    Returns a new SGMLParser that removes HTML formatting code.  See
+    ``get_stripper_class``.
+    """
+    return get_stripper_class()()
 
 
 def commasplit(s):
@@ -367,6 +633,13 @@ def commasplit(s):
     return l
 
 
+def _get_arg_count(func):
+    """Returns the number of arguments func takes.
+    """
+    import inspect
+    return len(inspect.getargspec(func)[0])
+
+
 class Replacer:
     """
     Class for replacing variables in a template
@@ -485,7 +758,7 @@ class Replacer:
 
                 r = r(*args)
 
-            elif len(inspect.getargspec(r)[0]) == 2:
+            elif _get_arg_count(r) == 2:
                 r = r(request, vd)
 
             else:
@@ -987,10 +1260,207 @@ def render_url_statically(cdict, url, querystring):
 
     # by using the response object the cheesy part of removing the
     # HTTP headers from the file is history.
+    body = response.read()
     f = open(fn, "w")
-    f.write(response.read())
+    f.write(body)
     f.close()
 
+    # write a .gz sibling so the web server can serve it to clients
+    # that accept gzip
+    if cdict.get("static_gzip", False):
+        gzfn = fn + ".gz"
+        gzbody = gzip_string(body)
+        if ((cdict.get("static_gzip_only_smaller", True) and
+             len(gzbody) >= len(body))):
+            # remove the .gz from a previous run so it's not stale
+            if os.path.exists(gzfn):
+                os.remove(gzfn)
+        else:
+            f = open(gzfn, "wb")
+            f.write(gzbody)
+            f.close()
+
+
+def get_config_filename(config_module):
+    """
+    Returns the absolute filename of the source of the ``config``
+    module.  Entry points set the ``config_filename`` config variable
+    to this, so the startup snapshot knows which file to watch.
+
+    :param config_module: the imported config module
+
+    :returns: the filename or None if the module has no source file
+    """
+    filename = plugin_utils.get_source_filename(config_module)
+    if filename:
+        filename = os.path.abspath(filename)
+    return filename
+
+
+def gzip_string(s, level=6):
+    """
+    Compresses a string with gzip.
+
+    The gzip header has an mtime of 0, so the same string always
+    compresses to the same bytes.
+
+    :param s: the string to compress
+    :param level: the compression level from 1 to 9
+
+    :returns: the compressed string
+    """
+    import gzip
+    from StringIO import StringIO
+
+    out = StringIO()
+    try:
+        gz = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=level,
+                           mtime=0)
+    except TypeError:
+        # Python 2.6 doesn't have the mtime argument
+        gz = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=level)
+    gz.write(s)
+    gz.close()
+    return out.getvalue()
+
+
+def gzip_etag(etag):
+    """
+    Returns the ETag for the gzip-compressed variant of a response
+    whose ETag is etag.  The compressed body is different bytes, so it
+    gets its own ETag: ``"abc"`` becomes ``"abc-gzip"``.
+
+    :param etag: the ETag of the uncompressed response
+
+    :returns: the ETag of the compressed response
+    """
+    prefix = ""
+    if etag.startswith("W/"):
+        prefix, etag = "W/", etag[2:]
+    if etag.endswith('"'):
+        return '%s%s-gzip"' % (prefix, etag[:-1])
+    return "%s%s-gzip" % (prefix, etag)
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Returns True if the ``Accept-Encoding`` header value says the
+    client accepts gzip.
+
+    :param accept_encoding: the value of the ``Accept-Encoding``
+                            header or ""
+    """
+    qvalues = {}
+    for mem in accept_encoding.split(","):
+        mem = mem.strip().split(";")
+        coding = mem[0].strip().lower()
+
+        qvalue = 1.0
+        for param in mem[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    qvalue = float(param[2:])
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return False
+
+
+# the name of the file in the comment_dir that holds the time of the
+# latest comment
+LATEST_COMMENT_FILE = "LATEST.cmt"
+
+# filename -> (st_mtime, st_size, time) for this process
+_latest_comment_cache = {}
+
+
+def get_temp_filename(filename):
+    """
+    Returns a name for a temporary file to write filename's new
+    contents to before moving it into place.  The name is unique to
+    the process and thread, so concurrent writers don't move each
+    other's temporary files out from under one another.
+
+    :param filename: the file that's being written
+    """
+    return "%s.%d.%d.new" % (filename, os.getpid(),
+                             threading.currentThread().ident or 0)
+
+
+def write_latest_comment_time(comment_dir, cmt_time):
+    """
+    Records cmt_time as the time of the latest comment.
+
+    The time is written as a single line of text to a temporary file
+    which is then moved over ``LATEST.cmt`` in comment_dir, so readers
+    never see a partial file.
+
+    :param comment_dir: the comment directory
+    :param cmt_time: the time of the comment in seconds since the
+                     epoch
+
+    :raises IOError, OSError: if the file can't be written
+    """
+    filename = os.path.join(comment_dir, LATEST_COMMENT_FILE)
+    tmp = get_temp_filename(filename)
+    f = open(tmp, "wb")
+    try:
+        f.write("%r\n" % float(cmt_time))
+    finally:
+        f.close()
+    os.rename(tmp, filename)
+
+
+def get_latest_comment_time(comment_dir):
+    """
+    Returns the time of the latest comment as recorded in
+    ``LATEST.cmt`` in comment_dir or -1 if there's no such file or
+    it's unreadable.
+
+    The value is cached for as long as the file's mtime and size
+    don't change, so this usually costs a stat.  ``LATEST.cmt`` files
+    written by older versions of Pyblosxom hold a pickle and are
+    read, too.
+
+    :param comment_dir: the comment directory
+    """
+    filename = os.path.join(comment_dir, LATEST_COMMENT_FILE)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return -1
+
+    cached = _latest_comment_cache.get(filename)
+    if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+        return cached[2]
+
+    try:
+        f = open(filename, "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except IOError:
+        return -1
+
+    try:
+        value = float(data.strip())
+    except ValueError:
+        # older versions pickled the time
+        import cPickle
+        try:
+            value = float(cPickle.loads(data))
+        except Exception:
+            return -1
+
+    _latest_comment_cache[filename] = (st.st_mtime, st.st_size, value)
+    return value
+
 
 def render_url(cdict, pathinfo, querystring=""):
     """
@@ -1081,13 +1551,14 @@ def get_logger(log_file=None):
     """
     custom_log_file = False
     if log_file is None:
-        log_file = _config.get('log_file', 'stderr')
+        config = get_config()
+        log_file = config.get('log_file', 'stderr')
         f = sys._getframe(1)
         filename = f.f_code.co_filename
         module = f.f_globals["__name__"]
         # by default use the root logger
         log_name = ""
-        for path in _config.get('plugin_dirs', []):
+        for path in config.get('plugin_dirs', []):
             if filename.startswith(path):
                 # if it's a plugin, use the module name as the log
                 # channels name
@@ -1095,7 +1566,7 @@ def get_logger(log_file=None):
                 break
         # default to log level WARNING if it's not defined in
         # config.py
-        log_level = _config.get('log_level', 'warning')
+        log_level = config.get('log_level', 'warning')
     else:
         # handle custom log_file
         custom_log_file = True
@@ -1147,7 +1618,7 @@ def get_logger(log_file=None):
             # only log messages from plugins listed in log_filter.
             # add 'root' to the log_filter list to still allow
             # application level messages.
-            log_filter = _config.get('log_filter', None)
+            log_filter = get_config().get('log_filter', None)
             if log_filter:
                 lfilter = LogFilter(log_filter)
                 logger.addFilter(lfilter)